@@ -0,0 +1,339 @@
+"""Local CMS data engine for exact aggregates.
+
+CMS public-use files (Medicare utilization and payments, hospital data, ...) are
+loaded once into typed Parquet files under CMS_DATA_DIR: column names become
+snake_case, numeric columns are parsed and repetitive text columns become
+categoricals. The analytics agent then answers aggregate questions with the
+`cms_query` tool, which runs a constrained query (filters, group-by,
+aggregations, top-N) over the frame with pandas instead of doing arithmetic on
+retrieved text.
+
+    python -m analytics_agent.cms_data load MUP_PHY_R24_P05_V10_D22_Prov.csv \\
+        --name physicians --description "Medicare physician services by provider"
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+from typing import Any, Literal, Optional, Union
+
+import pandas as pd
+from langchain_core.tools import tool
+from pydantic import BaseModel, Field
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+CMS_DATA_DIR = os.environ.get("CMS_DATA_DIR", "cms_data")
+# Rows a query may return to the LLM
+CMS_QUERY_MAX_ROWS = int(os.environ.get("CMS_QUERY_MAX_ROWS", "50"))
+
+CATALOG = "catalog.json"
+# Codes that look numeric but are identifiers (NPI, ZIP, CCN, HCPCS, FIPS, ...)
+IDENTIFIER = re.compile(r"(^|_)(npi|zip\d*|ccn|fips|hcpcs|id|cd|code)($|_)")
+
+
+def _snake_case(name: str) -> str:
+    return re.sub(r"\W+", "_", name.strip().lower()).strip("_")
+
+
+def _typed(frame: pd.DataFrame) -> pd.DataFrame:
+    frame.columns = [_snake_case(column) for column in frame.columns]
+    for column in frame.columns:
+        values = frame[column]
+        numeric = pd.to_numeric(values.str.replace(",", ""), errors="coerce")
+        # Numeric when nearly everything present parses, unless values have
+        # leading zeros that would be lost
+        present = values.notna().sum()
+        if (
+            not IDENTIFIER.search(column)
+            and present
+            and numeric.notna().sum() >= 0.99 * present
+            and not values.str.match(r"^0\d").any()
+        ):
+            frame[column] = numeric
+        elif values.nunique() <= max(1000, len(values) // 20):
+            frame[column] = values.astype("category")
+    return frame
+
+
+def _conform(frame: pd.DataFrame, existing: pd.DataFrame) -> pd.DataFrame:
+    """Give appended rows the column types of the rows already loaded."""
+    for column, dtype in existing.dtypes.items():
+        if column not in frame.columns:
+            continue
+        if pd.api.types.is_numeric_dtype(dtype):
+            frame[column] = pd.to_numeric(frame[column], errors="coerce")
+        else:
+            frame[column] = frame[column].astype(object)
+    combined = pd.concat([existing, frame], ignore_index=True)
+    for column, dtype in existing.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            combined[column] = combined[column].astype("category")
+    return combined
+
+
+def load_csv(
+    path: str,
+    name: str,
+    description: str = "",
+    constants: Optional[dict[str, str]] = None,
+    append: bool = False,
+    chunksize: int = 500_000,
+) -> dict:
+    """Convert a CMS CSV file into a typed Parquet dataset named `name`.
+
+    `constants` adds columns with a fixed value, such as the year of a yearly
+    file. With `append` the rows are added to the dataset instead of replacing
+    it, which lets aggregate cubes refresh incrementally.
+    """
+    if pyarrow is None:
+        raise ImportError("Loading CMS files requires the `pyarrow` package")
+    frame = pd.concat(
+        pd.read_csv(path, dtype=str, chunksize=chunksize, low_memory=False),
+        ignore_index=True,
+    )
+    for column, value in (constants or {}).items():
+        frame[column] = value
+    frame = _typed(frame)
+
+    catalog = read_catalog()
+    previous = catalog.get(name)
+    if append and previous:
+        frame = _conform(frame, dataset(name))
+        generation = previous.get("generation", 1)
+        description = description or previous["description"]
+    else:
+        # A replaced dataset cannot be refreshed incrementally
+        generation = previous.get("generation", 1) + 1 if previous else 1
+
+    os.makedirs(CMS_DATA_DIR, exist_ok=True)
+    frame.to_parquet(os.path.join(CMS_DATA_DIR, f"{name}.parquet"), index=False)
+    catalog[name] = {
+        "description": description,
+        "rows": len(frame),
+        "generation": generation,
+        "columns": {column: str(dtype) for column, dtype in frame.dtypes.items()},
+    }
+    with open(os.path.join(CMS_DATA_DIR, CATALOG), "w") as f:
+        json.dump(catalog, f, indent=2)
+    with _frames_lock:
+        _frames.pop(name, None)
+    return catalog[name]
+
+
+def read_catalog() -> dict:
+    path = os.path.join(CMS_DATA_DIR, CATALOG)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def file_version(path: str) -> Optional[tuple[int, int]]:
+    """Identifies the current contents of `path`, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+# Frames with the version of the file they were read from
+_frames: dict[str, tuple[tuple[int, int], pd.DataFrame]] = {}
+_frames_lock = threading.Lock()
+
+
+def dataset(name: str) -> pd.DataFrame:
+    """The frame of a loaded dataset, read from Parquet once per version.
+
+    A dataset reloaded by another process is read again on its next use.
+    """
+    path = os.path.join(CMS_DATA_DIR, f"{name}.parquet")
+    version = file_version(path)
+    if version is None:
+        raise ValueError(
+            f"Unknown dataset {name!r}, expected one of {sorted(read_catalog())}"
+        )
+    with _frames_lock:
+        cached = _frames.get(name)
+        if cached is None or cached[0] != version:
+            _frames[name] = cached = (version, pd.read_parquet(path))
+        return cached[1]
+
+
+class Filter(BaseModel):
+    column: str
+    op: Literal["==", "!=", ">", ">=", "<", "<=", "in", "contains"] = "=="
+    value: Union[str, float, list[Union[str, float]]]
+
+
+class Aggregation(BaseModel):
+    column: str = Field(description="Column to aggregate; any column for count")
+    func: Literal["sum", "mean", "median", "min", "max", "count", "nunique"]
+
+
+class Query(BaseModel):
+    dataset: str
+    filters: list[Filter] = []
+    group_by: list[str] = []
+    aggregations: list[Aggregation] = []
+    columns: list[str] = Field(
+        default=[], description="Columns to return when not aggregating"
+    )
+    sort_by: Optional[str] = None
+    descending: bool = True
+    limit: int = 20
+
+
+def _check_columns(available: list[str], columns: list[str]):
+    unknown = [column for column in columns if column not in available]
+    if unknown:
+        raise ValueError(f"Unknown columns {unknown}; available: {available}")
+
+
+def _mask(frame: pd.DataFrame, condition: Filter) -> pd.Series:
+    column, value = frame[condition.column], condition.value
+    if condition.op == "in":
+        values = value if isinstance(value, list) else [value]
+        return column.isin(values)
+    if condition.op == "contains":
+        return column.astype(str).str.contains(str(value), case=False, regex=False)
+    if pd.api.types.is_numeric_dtype(column) and isinstance(value, str):
+        value = float(value)
+    return {
+        "==": column.__eq__,
+        "!=": column.__ne__,
+        ">": column.__gt__,
+        ">=": column.__ge__,
+        "<": column.__lt__,
+        "<=": column.__le__,
+    }[condition.op](value)
+
+
+def filter_rows(frame: pd.DataFrame, filters: list[Filter]) -> pd.DataFrame:
+    if not filters:
+        return frame
+    mask = pd.Series(True, index=frame.index)
+    for condition in filters:
+        mask &= _mask(frame, condition)
+    return frame[mask]
+
+
+def aggregate(frame: pd.DataFrame, query: Query) -> pd.DataFrame:
+    """Filter, group and aggregate the rows of `frame` as `query` asks."""
+    frame = filter_rows(frame, query.filters)
+    if query.aggregations:
+        named = {
+            f"{a.func}_{a.column}": pd.NamedAgg(a.column, a.func)
+            for a in query.aggregations
+        }
+        if query.group_by:
+            return (
+                frame.groupby(query.group_by, observed=True, sort=False)
+                .agg(**named)
+                .reset_index()
+            )
+        return pd.DataFrame(
+            {name: [frame[agg.column].agg(agg.aggfunc)] for name, agg in named.items()}
+        )
+    if query.group_by:
+        return (
+            frame.groupby(query.group_by, observed=True, sort=False)
+            .size()
+            .reset_index(name="count")
+        )
+    return frame[query.columns] if query.columns else frame
+
+
+def run_query(query: Query) -> pd.DataFrame:
+    catalog = read_catalog()
+    if query.dataset not in catalog:
+        raise ValueError(
+            f"Unknown dataset {query.dataset!r}, expected one of {sorted(catalog)}"
+        )
+    _check_columns(
+        list(catalog[query.dataset]["columns"]),
+        [f.column for f in query.filters]
+        + query.group_by
+        + [a.column for a in query.aggregations]
+        + query.columns,
+    )
+    # Imported here: cubes are built from the datasets of this module
+    from analytics_agent.cubes import cube_store
+
+    # Most questions are answered from a small precomputed cube; only the others
+    # scan the whole dataset
+    result = cube_store.answer(query)
+    if result is None:
+        result = aggregate(dataset(query.dataset), query)
+
+    sort_by = query.sort_by or (
+        result.columns[-1] if query.aggregations or query.group_by else None
+    )
+    if sort_by is not None:
+        if sort_by not in result.columns:
+            raise ValueError(
+                f"Cannot sort by {sort_by!r}; result columns: {list(result.columns)}"
+            )
+        result = result.sort_values(sort_by, ascending=not query.descending)
+    return result.head(min(query.limit, CMS_QUERY_MAX_ROWS))
+
+
+@tool
+def cms_datasets() -> str:
+    """
+    List the local CMS datasets with their descriptions, row counts and columns.
+    Call this before cms_query to find the dataset and column names.
+    """
+    catalog = read_catalog()
+    if not catalog:
+        return "No local CMS datasets are loaded; use cms_lookup instead."
+    return json.dumps(catalog, indent=2)
+
+
+@tool(args_schema=Query)
+def cms_query(**query: Any) -> str:
+    """
+    Compute exact figures over a local CMS dataset: filter rows (op is one of
+    ==, !=, >, >=, <, <=, in, contains), group by columns, aggregate (sum, mean,
+    median, min, max, count, nunique), sort and keep the top rows. Use this for
+    totals, averages, rankings and comparisons instead of estimating them from
+    text. Without aggregations, group_by counts rows per group.
+    """
+    try:
+        result = run_query(Query.model_validate(query))
+    except (ValueError, TypeError) as e:
+        return f"Error: {e}"
+    return result.to_csv(index=False, float_format="%.2f")
+
+
+if __name__ == "__main__":
+    from analytics_agent.cubes import cube_store
+
+    parser = argparse.ArgumentParser(description="Manage local CMS datasets.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    load = commands.add_parser("load", help="Load a CMS CSV file as a dataset")
+    load.add_argument("csv")
+    load.add_argument("--name", required=True)
+    load.add_argument("--description", default="")
+    load.add_argument(
+        "--set",
+        nargs="*",
+        default=[],
+        metavar="COLUMN=VALUE",
+        help="Columns to add with a fixed value, e.g. year=2023",
+    )
+    load.add_argument(
+        "--append", action="store_true", help="Add the rows to the dataset"
+    )
+    args = parser.parse_args()
+    constants = dict(item.split("=", 1) for item in args.set)
+    info = load_csv(args.csv, args.name, args.description, constants, args.append)
+    print(f"Loaded {info['rows']} rows into {args.name}: {info['columns']}")
+    for cube in cube_store.refresh(args.name):
+        print(f"Refreshed cube {cube['name']}: {cube['size']} cells")
@@ -0,0 +1,272 @@
+"""Precomputed aggregate cubes over the local CMS datasets.
+
+A cube holds, for every combination of a few dimension columns (provider type,
+state, year, ...), partial aggregates of its measure columns: their sum, count,
+min and max, plus the number of rows. Partials combine exactly, so a query that
+filters and groups only on a cube's dimensions and asks for the sum, mean,
+count, min or max of its measures is answered from the cube's few thousand
+cells instead of the millions of rows of the dataset. Other queries, and any
+query while a cube is behind its dataset, fall back to scanning the dataset.
+
+Cubes are refreshed after every load. Rows appended to a dataset are aggregated
+on their own and merged into its cubes; a replaced dataset is rebuilt.
+
+    python -m analytics_agent.cubes define physicians \\
+        --dimensions rndrng_prvdr_type rndrng_prvdr_state_abrvtn year \\
+        --measures tot_benes tot_srvcs tot_mdcr_pymt_amt
+    python -m analytics_agent.cubes refresh
+"""
+
+import argparse
+import json
+import os
+import threading
+from typing import Optional
+
+import pandas as pd
+
+from analytics_agent.cms_data import (
+    CMS_DATA_DIR,
+    IDENTIFIER,
+    Query,
+    dataset,
+    file_version,
+    filter_rows,
+    read_catalog,
+)
+
+CUBES = "cubes.json"
+ROWS = "rows"
+# How each partial aggregate is combined across cells
+PARTIALS = {"sum": "sum", "count": "sum", "min": "min", "max": "max"}
+CUBE_FUNCTIONS = ("sum", "mean", "count", "min", "max")
+
+
+def _partial(func: str, column: str) -> str:
+    return f"{func}__{column}"
+
+
+def _build(frame: pd.DataFrame, dimensions: list[str], measures: list[str]):
+    named = {ROWS: pd.NamedAgg(dimensions[0], "size")}
+    for measure in measures:
+        for func in PARTIALS:
+            named[_partial(func, measure)] = pd.NamedAgg(measure, func)
+    # Rows with a missing dimension are kept so totals over the cube stay exact
+    return (
+        frame.groupby(dimensions, observed=True, dropna=False, sort=False)
+        .agg(**named)
+        .reset_index()
+    )
+
+
+def _merge(cube: pd.DataFrame, cells: pd.DataFrame, dimensions: list[str]):
+    combine = {ROWS: "sum"}
+    for column in cube.columns:
+        if column not in dimensions and column != ROWS:
+            combine[column] = PARTIALS[column.split("__", 1)[0]]
+    return (
+        pd.concat([cube, cells], ignore_index=True)
+        .groupby(dimensions, observed=True, dropna=False, sort=False)
+        .agg(combine)
+        .reset_index()
+    )
+
+
+class CubeStore:
+    """Cube definitions and cells, kept next to the datasets in CMS_DATA_DIR."""
+
+    def __init__(self, directory: str = CMS_DATA_DIR):
+        self.directory = directory
+        # Cells with the version of the file they were read from
+        self._cells: dict[str, tuple[tuple[int, int], pd.DataFrame]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def definitions(self) -> dict[str, dict]:
+        path = os.path.join(self.directory, CUBES)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _save(self, definitions: dict[str, dict]):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, CUBES), "w") as f:
+            json.dump(definitions, f, indent=2)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.cube.parquet")
+
+    def define(
+        self, dataset_name: str, dimensions: list[str], measures: list[str] = ()
+    ) -> dict:
+        """Add a cube over `dataset_name` and build it.
+
+        Measures default to every numeric column that is not a dimension.
+        """
+        columns = read_catalog()[dataset_name]["columns"]
+        if not measures:
+            measures = [
+                column
+                for column, dtype in columns.items()
+                if column not in dimensions
+                and not IDENTIFIER.search(column)
+                and (dtype.startswith("int") or dtype.startswith("float"))
+            ]
+        unknown = [c for c in [*dimensions, *measures] if c not in columns]
+        if unknown:
+            raise ValueError(f"Unknown columns {unknown}; available: {list(columns)}")
+        name = "__".join([dataset_name, *dimensions])
+        definitions = self.definitions()
+        definitions[name] = {
+            "name": name,
+            "dataset": dataset_name,
+            "dimensions": list(dimensions),
+            "measures": list(measures),
+            "generation": 0,
+            "rows": 0,
+            "size": 0,
+        }
+        self._save(definitions)
+        self.refresh(dataset_name)
+        return self.definitions()[name]
+
+    def refresh(self, dataset_name: Optional[str] = None) -> list[dict]:
+        """Bring the cubes of one or every dataset up to date with their data."""
+        catalog = read_catalog()
+        definitions = self.definitions()
+        refreshed = []
+        for name, cube in definitions.items():
+            info = catalog.get(cube["dataset"])
+            if info is None or dataset_name not in (None, cube["dataset"]):
+                continue
+            generation = info.get("generation", 1)
+            if cube["generation"] == generation and cube["rows"] == info["rows"]:
+                continue
+            frame = dataset(cube["dataset"])
+            dimensions, measures = cube["dimensions"], cube["measures"]
+            if cube["generation"] == generation and cube["rows"] < info["rows"]:
+                # Only the appended rows are aggregated
+                cells = _merge(
+                    self._load(name),
+                    _build(frame.iloc[cube["rows"] :], dimensions, measures),
+                    dimensions,
+                )
+            else:
+                cells = _build(frame, dimensions, measures)
+            cells.to_parquet(self._path(name), index=False)
+            cube.update(generation=generation, rows=info["rows"], size=len(cells))
+            with self._lock:
+                self._cells.pop(name, None)
+            refreshed.append(cube)
+        self._save(definitions)
+        return refreshed
+
+    def _load(self, name: str) -> pd.DataFrame:
+        """A cube's cells, read again once a refresh (in any process) rewrote them."""
+        path = self._path(name)
+        version = file_version(path)
+        with self._lock:
+            cached = self._cells.get(name)
+            if cached is None or cached[0] != version:
+                self._cells[name] = cached = (version, pd.read_parquet(path))
+            return cached[1]
+
+    def _match(self, query: Query) -> Optional[dict]:
+        """The smallest up-to-date cube able to answer `query`, if any."""
+        if not (query.aggregations or query.group_by) or any(
+            a.func not in CUBE_FUNCTIONS for a in query.aggregations
+        ):
+            return None
+        info = read_catalog().get(query.dataset, {})
+        dimensions = {f.column for f in query.filters} | set(query.group_by)
+        measures = {a.column for a in query.aggregations}
+        candidates = [
+            cube
+            for cube in self.definitions().values()
+            if cube["dataset"] == query.dataset
+            and cube["generation"] == info.get("generation", 1)
+            and cube["rows"] == info.get("rows")
+            and dimensions <= set(cube["dimensions"])
+            and measures <= set(cube["measures"])
+        ]
+        return min(candidates, key=lambda cube: cube["size"], default=None)
+
+    def answer(self, query: Query) -> Optional[pd.DataFrame]:
+        """`query`'s result computed from a cube, or None to scan the dataset.
+
+        The columns are the same as those of `cms_data.aggregate`.
+        """
+        cube = self._match(query)
+        if cube is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        cells = filter_rows(self._load(cube["name"]), query.filters)
+
+        combine = {}
+        for a in query.aggregations:
+            for func in ("sum", "count") if a.func == "mean" else (a.func,):
+                combine[_partial(func, a.column)] = PARTIALS[func]
+        if not query.aggregations:
+            combine[ROWS] = "sum"
+        if query.group_by:
+            combined = (
+                cells.groupby(query.group_by, observed=True, sort=False)
+                .agg(combine)
+                .reset_index()
+            )
+        else:
+            combined = pd.DataFrame(
+                {column: [cells[column].agg(func)] for column, func in combine.items()}
+            )
+
+        result = combined[query.group_by].copy()
+        for a in query.aggregations:
+            if a.func == "mean":
+                result[f"mean_{a.column}"] = (
+                    combined[_partial("sum", a.column)]
+                    / combined[_partial("count", a.column)]
+                )
+            else:
+                result[f"{a.func}_{a.column}"] = combined[_partial(a.func, a.column)]
+        if not query.aggregations:
+            result["count"] = combined[ROWS]
+        return result
+
+    def snapshot(self) -> dict:
+        return {
+            "cubes": {
+                name: {"size": cube["size"], "rows": cube["rows"]}
+                for name, cube in self.definitions().items()
+            },
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+cube_store = CubeStore()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage CMS aggregate cubes.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    define = commands.add_parser("define", help="Add and build a cube")
+    define.add_argument("dataset")
+    define.add_argument("--dimensions", nargs="+", required=True)
+    define.add_argument(
+        "--measures", nargs="*", default=[], help="Defaults to the numeric columns"
+    )
+    refresh = commands.add_parser("refresh", help="Bring cubes up to date")
+    refresh.add_argument("dataset", nargs="?")
+    commands.add_parser("list", help="Show the cubes")
+    args = parser.parse_args()
+    if args.command == "define":
+        cube = cube_store.define(args.dataset, args.dimensions, args.measures)
+        print(f"Built cube {cube['name']}: {cube['size']} cells")
+    elif args.command == "refresh":
+        for cube in cube_store.refresh(args.dataset):
+            print(f"Refreshed cube {cube['name']}: {cube['size']} cells")
+    else:
+        print(json.dumps(cube_store.definitions(), indent=2))
@@ -17,6 +17,10 @@ SYSTEM_PROMPT = """You are the **Analytics Agent**, specializing in analyzing he
 2. Apply appropriate analytical methods (e.g., trend analysis, comparative analysis).
 3. Summarize findings into a clear and concise answer.
 
+#### Computing Figures
+- For totals, averages, counts, rankings or comparisons over CMS data, call `cms_datasets` to see the loaded datasets and their columns, then compute the figures with `cms_query`.
+- Report the numbers `cms_query` returns; never add up or average values read from `cms_lookup` text yourself. Use `cms_lookup` for context and for data that is not loaded locally.
+
 #### Formatting the Response
 - Use **Markdown** for structured and readable answers.
 - Provide findings in bullet points, tables, or summarized paragraphs.
@@ -5,6 +5,8 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableLambda
 from langgraph.prebuilt import ToolNode
 
+from agent_common.blobs import offload_tool_messages, resolve_tool_messages
+
 
 def handle_tool_error(state) -> dict:
     error = state.get("error")
@@ -23,11 +25,11 @@ def handle_tool_error(state) -> dict:
 def create_tool_node_with_fallback(tools: list) -> dict:
     return ToolNode(tools).with_fallbacks(
         [RunnableLambda(handle_tool_error)], exception_key="error"
-    )
+    ) | RunnableLambda(offload_tool_messages)
 
 
 def create_prompt(template: str):
-    return ChatPromptTemplate.from_messages(
+    return RunnableLambda(resolve_tool_messages) | ChatPromptTemplate.from_messages(
         [
             ("system", template),
             ("placeholder", "{messages}"),
@@ -0,0 +1,278 @@
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+from langchain_core.runnables import RunnableConfig
+
+from agent_common.ratelimit import rate_limiter
+from agent_common.retrieval import retrieval_stats
+from agent_common.scheduler import PRIORITIES, call_context
+
+# Thresholds at which new runs stop being admitted; 0 disables a threshold
+ADMISSION_MAX_RUNS = int(os.environ.get("ADMISSION_MAX_RUNS", "0"))
+ADMISSION_MAX_LLM_QUEUE = int(os.environ.get("ADMISSION_MAX_LLM_QUEUE", "0"))
+ADMISSION_MAX_RETRIEVAL_MS = float(os.environ.get("ADMISSION_MAX_RETRIEVAL_MS", "0"))
+# Seconds a run may wait for admission before it is rejected; 0 rejects at once
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "0"))
+# Batch runs are only admitted below this fraction of every threshold, so they
+# are shed before interactive runs
+ADMISSION_BATCH_HEADROOM = float(os.environ.get("ADMISSION_BATCH_HEADROOM", "0.7"))
+# Seconds between re-reads of the LLM queue and retrieval latency while runs
+# wait: unlike finished runs, these change without notifying the controller
+LOAD_RECHECK_INTERVAL = 0.1
+
+
+class AdmissionRejected(RuntimeError):
+    """The system is overloaded; retry the run after `retry_after` seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"{reason}, retry after {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@dataclass
+class Load:
+    llm_queue: int
+    retrieval_ms: float
+
+
+def local_load() -> Load:
+    """Load signals of this process: queued LLM calls and retrieval p95 latency."""
+    waiting = rate_limiter.scheduler.snapshot()["waiting"]
+    return Load(
+        llm_queue=sum(sum(tenants.values()) for tenants in waiting.values()),
+        retrieval_ms=retrieval_stats.p95_ms(),
+    )
+
+
+class AdmissionController:
+    """Admit, queue or reject graph runs based on the current load.
+
+    A run is admitted while in-flight runs, queued LLM calls and retrieval p95
+    latency are all below their thresholds (scaled by `batch_headroom` for batch
+    runs). Otherwise it waits up to `queue_timeout` seconds, behind any waiting
+    run of a higher priority class, and is then rejected with
+    `AdmissionRejected`, whose `retry_after` estimates when capacity frees up.
+    """
+
+    def __init__(
+        self,
+        max_runs: int = ADMISSION_MAX_RUNS,
+        max_llm_queue: int = ADMISSION_MAX_LLM_QUEUE,
+        max_retrieval_ms: float = ADMISSION_MAX_RETRIEVAL_MS,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+        batch_headroom: float = ADMISSION_BATCH_HEADROOM,
+        load: Callable[[], Load] = local_load,
+    ):
+        self.max_runs = max_runs
+        self.max_llm_queue = max_llm_queue
+        self.max_retrieval_ms = max_retrieval_ms
+        self.queue_timeout = queue_timeout
+        self.headroom = {"interactive": 1.0, "batch": batch_headroom}
+        self.load = load
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = {priority: 0 for priority in PRIORITIES}
+        self._run_seconds = 0.0
+        # Wake async waiters, which cannot wait on the condition
+        self._wakers: set[Callable[[], None]] = set()
+        self.admitted = {priority: 0 for priority in PRIORITIES}
+        self.rejected = {priority: 0 for priority in PRIORITIES}
+
+    def _overload(self, priority: str) -> Optional[str]:
+        headroom = self.headroom[priority]
+        if self.max_runs and self._running >= self.max_runs * headroom:
+            return "too many runs in flight"
+        if not (self.max_llm_queue or self.max_retrieval_ms):
+            return None
+        load = self.load()
+        if self.max_llm_queue and load.llm_queue >= self.max_llm_queue * headroom:
+            return "LLM queue is full"
+        if (
+            self.max_retrieval_ms
+            and load.retrieval_ms >= self.max_retrieval_ms * headroom
+        ):
+            return "retrieval is slow"
+        return None
+
+    def _blocked(self, priority: str) -> Optional[str]:
+        # Waiting runs of a more urgent class go first
+        for other in PRIORITIES[: PRIORITIES.index(priority)]:
+            if self._waiting[other]:
+                return "higher priority runs are waiting"
+        return self._overload(priority)
+
+    def _wait_time(self, remaining: float) -> float:
+        if self.max_llm_queue or self.max_retrieval_ms:
+            return min(remaining, LOAD_RECHECK_INTERVAL)
+        return remaining
+
+    def _notify(self):
+        self._cond.notify_all()
+        for wake in self._wakers:
+            wake()
+
+    def retry_after(self) -> float:
+        """Rough time until a slot frees up: the average run time, at least 1s."""
+        return max(1.0, self._run_seconds)
+
+    def _reject(self, priority: str, reason: str):
+        self.rejected[priority] += 1
+        raise AdmissionRejected(reason, self.retry_after())
+
+    def _admit(self, priority: str):
+        self._running += 1
+        self.admitted[priority] += 1
+
+    def acquire(self, priority: str = "interactive"):
+        """Block until the run is admitted or raise `AdmissionRejected`."""
+        deadline = time.monotonic() + self.queue_timeout
+        with self._cond:
+            reason = self._blocked(priority)
+            if reason is None:
+                return self._admit(priority)
+            if not self.queue_timeout:
+                self._reject(priority, reason)
+            self._waiting[priority] += 1
+            try:
+                while (reason := self._blocked(priority)) is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject(priority, reason)
+                    self._cond.wait(self._wait_time(remaining))
+                self._admit(priority)
+            finally:
+                self._waiting[priority] -= 1
+                self._notify()
+
+    async def aacquire(self, priority: str = "interactive"):
+        deadline = time.monotonic() + self.queue_timeout
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+
+        def wake():
+            loop.call_soon_threadsafe(woken.set)
+
+        with self._cond:
+            reason = self._blocked(priority)
+            if reason is None:
+                return self._admit(priority)
+            if not self.queue_timeout:
+                self._reject(priority, reason)
+            self._waiting[priority] += 1
+            self._wakers.add(wake)
+        try:
+            while True:
+                # Cleared before the check, so a release right after it still wakes us
+                woken.clear()
+                with self._cond:
+                    reason = self._blocked(priority)
+                    if reason is None:
+                        return self._admit(priority)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject(priority, reason)
+                try:
+                    await asyncio.wait_for(woken.wait(), self._wait_time(remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._cond:
+                self._wakers.discard(wake)
+                self._waiting[priority] -= 1
+                self._notify()
+
+    def release(self, seconds: float):
+        with self._cond:
+            self._running -= 1
+            # Exponentially weighted average run time for retry-after hints
+            self._run_seconds = (
+                seconds
+                if not self._run_seconds
+                else 0.8 * self._run_seconds + 0.2 * seconds
+            )
+            self._notify()
+
+    @contextmanager
+    def admit(self, config: Optional[RunnableConfig] = None) -> Iterator[None]:
+        _, priority = call_context(config)
+        self.acquire(priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    @asynccontextmanager
+    async def aadmit(
+        self, config: Optional[RunnableConfig] = None
+    ) -> AsyncIterator[None]:
+        _, priority = call_context(config)
+        await self.aacquire(priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                "running": self._running,
+                "waiting": dict(self._waiting),
+                "admitted": dict(self.admitted),
+                "rejected": dict(self.rejected),
+                "retry_after": round(self.retry_after(), 1),
+            }
+
+
+admission_controller = AdmissionController()
+
+
+class AdmittedGraph:
+    """Mixin for compiled graphs whose every run passes admission control first.
+
+    `invoke`, `ainvoke` and `astream_events` go through `stream`/`astream`, so
+    those two cover every way a run starts. Use `admitted()` to apply it.
+    """
+
+    admission: AdmissionController
+    graph_class: type
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs):
+        with self.admission.admit(config):
+            yield from super().stream(input, config, **kwargs)
+
+    async def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs
+    ):
+        async with self.admission.aadmit(config):
+            async for chunk in super().astream(input, config, **kwargs):
+                yield chunk
+
+    def without_admission(self) -> Any:
+        """The same graph without admission control."""
+        return self.graph_class(**self.__dict__)
+
+
+def admitted(graph: Any, controller: AdmissionController = admission_controller):
+    """Return a copy of a compiled graph that runs under admission control.
+
+    The copy is still a `Pregel` graph, so it can be served from
+    `langgraph.json`. By default every graph of the process shares one
+    controller, so `ADMISSION_MAX_RUNS` bounds their runs together.
+    """
+    graph_class = type(graph)
+    if issubclass(graph_class, AdmittedGraph):
+        graph_class = graph.graph_class
+    admitted_class = type(
+        f"Admitted{graph_class.__name__}",
+        (AdmittedGraph, graph_class),
+        {"admission": controller, "graph_class": graph_class},
+    )
+    return admitted_class(**graph.__dict__)
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from langchain_core.messages import AnyMessage, ToolMessage
+
+# Move ToolMessage contents of at least TOOL_BLOB_THRESHOLD characters out of the
+# graph state into a content-addressed store shared by every thread
+TOOL_BLOB_OFFLOAD = os.environ.get("TOOL_BLOB_OFFLOAD", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+TOOL_BLOB_THRESHOLD = int(os.environ.get("TOOL_BLOB_THRESHOLD", "2048"))
+# Directory for blobs; kept in memory when empty
+TOOL_BLOB_DIR = os.environ.get("TOOL_BLOB_DIR") or None
+# Bytes of blob contents cached in memory when TOOL_BLOB_DIR is set, least
+# recently used evicted first
+TOOL_BLOB_CACHE_BYTES = int(os.environ.get("TOOL_BLOB_CACHE_BYTES", str(64 << 20)))
+
+
+class BlobNotFoundError(LookupError):
+    """A message references a blob the store no longer has."""
+
+
+class BlobStore:
+    """Content-addressed store for large strings, keyed by their SHA-256.
+
+    Blobs live in memory and, when `path` is set, are also written once to
+    `path/<first two hex digits>/<digest>` so they survive restarts alongside a
+    durable checkpointer. Storing the same content again only adds a reference.
+    With a `path`, memory only caches the most recently used `cache_bytes` of
+    contents; without one, memory holds the only copy and nothing is evicted.
+    """
+
+    def __init__(
+        self, path: Optional[str] = None, cache_bytes: int = TOOL_BLOB_CACHE_BYTES
+    ):
+        self.path = Path(path) if path else None
+        self.cache_bytes = cache_bytes
+        self._blobs: OrderedDict[str, str] = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        self.references = 0
+        self.logical_bytes = 0
+        self.stored_bytes = 0
+
+    def _file(self, digest: str) -> Path:
+        return self.path / digest[:2] / digest
+
+    def _cache(self, digest: str, content: str, size: int):
+        self._blobs[digest] = content
+        self._cached_bytes += size
+        if self.path is None:
+            return
+        # The newest blob stays even when it alone exceeds the budget
+        while self._cached_bytes > self.cache_bytes and len(self._blobs) > 1:
+            _, evicted = self._blobs.popitem(last=False)
+            self._cached_bytes -= len(evicted.encode("utf-8"))
+
+    def put(self, content: str) -> str:
+        data = content.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self.references += 1
+            self.logical_bytes += len(data)
+            if digest in self._blobs:
+                self._blobs.move_to_end(digest)
+                return digest
+            self._cache(digest, content, len(data))
+            self.stored_bytes += len(data)
+        if self.path is not None:
+            file = self._file(digest)
+            if not file.exists():
+                file.parent.mkdir(parents=True, exist_ok=True)
+                tmp = file.with_suffix(f".{threading.get_ident()}.tmp")
+                tmp.write_bytes(data)
+                tmp.replace(file)
+        return digest
+
+    def get(self, digest: str) -> Optional[str]:
+        with self._lock:
+            content = self._blobs.get(digest)
+            if content is not None:
+                self._blobs.move_to_end(digest)
+                return content
+        if self.path is not None:
+            file = self._file(digest)
+            if file.exists():
+                data = file.read_bytes()
+                content = data.decode("utf-8")
+                with self._lock:
+                    if digest not in self._blobs:
+                        self._cache(digest, content, len(data))
+        return content
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "references": self.references,
+                "cached_blobs": len(self._blobs),
+                "cached_bytes": self._cached_bytes,
+                "logical_bytes": self.logical_bytes,
+                "stored_bytes": self.stored_bytes,
+                "saved_bytes": self.logical_bytes - self.stored_bytes,
+                "dedup_ratio": (
+                    self.logical_bytes / self.stored_bytes if self.stored_bytes else 1.0
+                ),
+            }
+
+
+blob_store = BlobStore(TOOL_BLOB_DIR)
+
+
+def offload_message(message: AnyMessage, store: BlobStore = blob_store) -> AnyMessage:
+    """Replace a large ToolMessage's content with a reference into `store`."""
+    if (
+        not isinstance(message, ToolMessage)
+        or not isinstance(message.content, str)
+        or len(message.content) < TOOL_BLOB_THRESHOLD
+        or "blob" in message.additional_kwargs
+    ):
+        return message
+    digest = store.put(message.content)
+    return message.model_copy(
+        update={
+            "content": f"[Tool output stored as blob {digest}, {len(message.content)} characters]",
+            "additional_kwargs": {**message.additional_kwargs, "blob": digest},
+        }
+    )
+
+
+def resolve_message(message: AnyMessage, store: BlobStore = blob_store) -> AnyMessage:
+    """Swap a blob reference back for its content.
+
+    Raises BlobNotFoundError rather than show the model a placeholder in place of
+    the tool output.
+    """
+    digest = message.additional_kwargs.get("blob")
+    if digest is None:
+        return message
+    content = store.get(digest)
+    if content is None:
+        raise BlobNotFoundError(
+            f"Tool output blob {digest} is not in the blob store"
+            + ("" if store.path else "; set TOOL_BLOB_DIR to keep blobs on disk")
+        )
+    additional_kwargs = dict(message.additional_kwargs)
+    del additional_kwargs["blob"]
+    return message.model_copy(
+        update={"content": content, "additional_kwargs": additional_kwargs}
+    )
+
+
+def offload_tool_messages(output: dict) -> dict:
+    """Tool node post-processor, a no-op unless TOOL_BLOB_OFFLOAD is set."""
+    if not TOOL_BLOB_OFFLOAD or not isinstance(output, dict):
+        return output
+    return {**output, "messages": [offload_message(m) for m in output["messages"]]}
+
+
+def resolve_tool_messages(state: dict) -> dict:
+    """Prompt pre-processor that restores offloaded tool outputs for the LLM."""
+    messages = state.get("messages")
+    if not messages or not any(
+        "blob" in getattr(m, "additional_kwargs", {}) for m in messages
+    ):
+        return state
+    return {**state, "messages": [resolve_message(m) for m in messages]}
@@ -0,0 +1,486 @@
+"""Local BM25 full-text index over snapshots of the Dify knowledge bases.
+
+Keyword-heavy lookups (organization names, CPT, HCPCS and taxonomy codes, NPIs)
+are answered from a local inverted index in well under a millisecond instead of
+a round trip to Dify, and the same index serves as a fallback while Dify is slow
+or down. A snapshot of a knowledge base is exported once and re-exported when
+it changes:
+
+    python -m agent_common.bm25 <dataset_id> [<dataset_id> ...]
+
+Layout of an index directory (KB_INDEX_DIR/<dataset_id>), one entry per segment:
+
+- content.bin: UTF-8 segment contents, with offsets in content_offsets.npy
+- segment_ids.txt: Dify segment ids, one per line
+- terms.txt: the vocabulary, one term per line in term id order
+- postings: segments (postings_docs.npy) and term frequencies
+  (postings_tf.npy) of each term, sliced by postings_offsets.npy
+- doc_lengths.npy and meta.json (segment count, average length)
+
+`update` applies changes without a rebuild: changed segments are indexed as a
+new part (parts/<generation>, same layout) and the ones they replace or that
+were deleted are recorded in tombstones-<generation>.npy, both listed in
+meta.json. Once too many segments are deleted or parts appended, the index
+should be rebuilt, which compacts it.
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, Optional
+
+import numpy as np
+import requests
+
+from agent_common.dify import iter_dataset_segments
+
+KB_INDEX_DIR = os.environ.get("KB_INDEX_DIR", "kb_index")
+# Seconds lookups are served from the local index alone after Dify failed
+KB_FALLBACK_COOLDOWN = float(os.environ.get("KB_FALLBACK_COOLDOWN", "30"))
+
+K1 = 1.2
+B = 0.75
+# Share of deleted segments, and number of appended parts, past which an index
+# is rebuilt instead of updated
+COMPACT_DELETED_RATIO = 0.2
+COMPACT_MAX_PARTS = 8
+# Reciprocal rank fusion constant used to merge local and remote rankings
+RRF_K = 60
+TOKEN = re.compile(r"[a-z0-9]+")
+# Queries longer than this, or phrased as a question, go to semantic search
+KEYWORD_QUERY_TERMS = 6
+QUESTION_WORDS = frozenset(
+    "what which who whom whose when where why how list find show compare "
+    "describe explain tell give does do is are can should".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN.findall(text.lower())
+
+
+def is_keyword_query(query: str) -> bool:
+    """Whether `query` looks like a name or code lookup rather than a question.
+
+    A code or number only makes a short query a lookup: questions and long
+    queries that mention one ("how many claims did NPI 1234567890 bill") still
+    go to semantic search.
+    """
+    tokens = tokenize(query)
+    if not tokens or QUESTION_WORDS & set(tokens):
+        return False
+    return len(tokens) <= KEYWORD_QUERY_TERMS
+
+
+def replace_dir(src: str, dst: str):
+    """Move the finished index in `src` to `dst`, replacing the one there.
+
+    The old index is renamed aside rather than deleted first, so `dst` is only
+    missing between two renames, and is put back if the new one cannot be
+    moved in.
+    """
+    old_dir = f"{dst}.old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    try:
+        os.rename(dst, old_dir)
+    except FileNotFoundError:
+        old_dir = None
+    try:
+        os.replace(src, dst)
+    except BaseException:
+        if old_dir is not None:
+            os.rename(old_dir, dst)
+        raise
+    if old_dir is not None:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def build(segments: Iterable[dict], out_dir: str) -> int:
+    """Index `segments` (dicts with `id` and `content`) into `out_dir`.
+
+    The index is written next to `out_dir` and swapped in when complete, so
+    processes never see a partial index.
+    """
+    tmp_dir = f"{out_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    vocabulary: dict[str, int] = {}
+    term_ids, docs, tfs = array("i"), array("i"), array("i")
+    doc_lengths, offsets = array("q"), array("q", [0])
+    with open(os.path.join(tmp_dir, "content.bin"), "wb") as contents, open(
+        os.path.join(tmp_dir, "segment_ids.txt"), "w"
+    ) as ids:
+        for doc, segment in enumerate(segments):
+            content = segment.get("content") or ""
+            encoded = content.encode()
+            contents.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+            ids.write(f"{segment.get('id', '')}\n")
+            counts = Counter(tokenize(content))
+            doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                docs.append(doc)
+                tfs.append(tf)
+
+    term_ids = np.frombuffer(term_ids, dtype=np.int32)
+    order = np.argsort(term_ids, kind="stable")
+    np.save(
+        os.path.join(tmp_dir, "postings_offsets.npy"),
+        np.concatenate(
+            [[0], np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)))]
+        ).astype(np.int64),
+    )
+    np.save(
+        os.path.join(tmp_dir, "postings_docs.npy"),
+        np.frombuffer(docs, dtype=np.int32)[order],
+    )
+    np.save(
+        os.path.join(tmp_dir, "postings_tf.npy"),
+        np.frombuffer(tfs, dtype=np.int32)[order].astype(np.float32),
+    )
+    lengths = np.frombuffer(doc_lengths, dtype=np.int64).astype(np.float32)
+    np.save(os.path.join(tmp_dir, "doc_lengths.npy"), lengths)
+    np.save(
+        os.path.join(tmp_dir, "content_offsets.npy"),
+        np.frombuffer(offsets, dtype=np.int64),
+    )
+    with open(os.path.join(tmp_dir, "terms.txt"), "w") as f:
+        f.writelines(f"{term}\n" for term in vocabulary)
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(
+            {
+                "segments": len(lengths),
+                "average_length": float(lengths.mean()) if len(lengths) else 0.0,
+                "built_at": time.time(),
+            },
+            f,
+        )
+
+    replace_dir(tmp_dir, out_dir)
+    return len(lengths)
+
+
+def index_version(path: str) -> Optional[int]:
+    """Identifies the build of the index in `path`, or None if there is none."""
+    try:
+        return os.stat(os.path.join(path, "meta.json")).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+@dataclass
+class Hit:
+    segment: dict
+    score: float
+    # Share of the query's terms found in the segment
+    coverage: float
+
+
+class SegmentIndex:
+    """Segments of an index directory and of the parts `update` appended to it.
+
+    Segments are numbered across parts in order; deleted ones keep their number
+    until the index is rebuilt.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.part_dirs = [path] + [
+            os.path.join(path, "parts", part) for part in self.meta.get("parts", [])
+        ]
+        self.segment_ids: list[str] = []
+        self._contents, self._content_offsets = [], []
+        starts = [0]
+        for part in self.part_dirs:
+            with open(os.path.join(part, "segment_ids.txt")) as f:
+                self.segment_ids.extend(f.read().splitlines())
+            offsets = np.load(os.path.join(part, "content_offsets.npy"), mmap_mode="r")
+            self._content_offsets.append(offsets)
+            self._contents.append(
+                np.memmap(os.path.join(part, "content.bin"), dtype=np.uint8, mode="r")
+                if offsets[-1]
+                else np.zeros(0, dtype=np.uint8)
+            )
+            starts.append(len(self.segment_ids))
+        self.starts = np.asarray(starts[:-1])
+        self.alive = np.ones(len(self.segment_ids), dtype=bool)
+        if self.meta.get("tombstones"):
+            self.alive[np.load(os.path.join(path, self.meta["tombstones"]))] = False
+        self._live = int(self.alive.sum())
+
+    def __len__(self) -> int:
+        return self._live
+
+    def segment(self, doc: int) -> dict:
+        part = int(np.searchsorted(self.starts, doc, side="right")) - 1
+        offsets = self._content_offsets[part]
+        local = doc - self.starts[part]
+        start, end = offsets[local], offsets[local + 1]
+        return {
+            "id": self.segment_ids[doc],
+            "content": self._contents[part][start:end].tobytes().decode(),
+        }
+
+    def segments(self) -> Iterator[dict]:
+        """The segments that are not deleted, in index order."""
+        for doc in np.flatnonzero(self.alive):
+            yield self.segment(int(doc))
+
+    def needs_compaction(self) -> bool:
+        deleted = len(self.alive) - len(self)
+        return len(
+            self.part_dirs
+        ) > COMPACT_MAX_PARTS + 1 or deleted > COMPACT_DELETED_RATIO * len(self.alive)
+
+
+def update(
+    path: str,
+    segments: list[dict],
+    removed: Iterable[str],
+    build_part: Callable[[list[dict], str], int],
+) -> SegmentIndex:
+    """Index changed `segments` and delete the `removed` segment ids in `path`.
+
+    Indexed segments with the id of a changed one are replaced by it. The
+    changed segments are indexed by `build_part(segments, part_dir)`, and
+    processes pick the update up once meta.json is swapped, as after a rebuild.
+    """
+    index = SegmentIndex(path)
+    stale = set(removed) | {segment["id"] for segment in segments}
+    deleted = ~index.alive
+    deleted[
+        [doc for doc, segment_id in enumerate(index.segment_ids) if segment_id in stale]
+    ] = True
+    meta = dict(index.meta)
+    generation = meta.get("generation", 0) + 1
+    if segments:
+        build_part(segments, os.path.join(path, "parts", str(generation)))
+        meta["parts"] = [*meta.get("parts", []), str(generation)]
+    meta["generation"] = generation
+    meta["tombstones"] = f"tombstones-{generation}.npy"
+    np.save(os.path.join(path, meta["tombstones"]), np.flatnonzero(deleted))
+    with open(os.path.join(path, "meta.json.tmp"), "w") as f:
+        json.dump(meta, f)
+    os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+    # Processes still loading the previous generation may need its tombstones
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(os.path.join(path, f"tombstones-{generation - 2}.npy"))
+    return SegmentIndex(path)
+
+
+@dataclass
+class _Postings:
+    """Posting lists of one part of a keyword index."""
+
+    offsets: np.ndarray
+    docs: np.ndarray
+    tf: np.ndarray
+    doc_lengths: np.ndarray
+    terms: dict[str, int]
+
+    @classmethod
+    def load(cls, path: str) -> "_Postings":
+        def load(name: str) -> np.ndarray:
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+        with open(os.path.join(path, "terms.txt")) as f:
+            terms = {term: i for i, term in enumerate(f.read().splitlines())}
+        return cls(
+            load("postings_offsets"),
+            load("postings_docs"),
+            load("postings_tf"),
+            load("doc_lengths"),
+            terms,
+        )
+
+
+class KeywordIndex(SegmentIndex):
+    """Memory-mapped BM25 index built by `build`, with the parts of `update`."""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.parts = [_Postings.load(part) for part in self.part_dirs]
+        lengths = np.concatenate([part.doc_lengths for part in self.parts])
+        average = float(lengths[self.alive].mean()) if len(self) else 0.0
+        # Length normalization only depends on the segment, so it is done once
+        self._norm = K1 * (1 - B + B * lengths / max(average, 1.0))
+
+    def search(self, query: str, top_k: int) -> list[Hit]:
+        tokens = set(tokenize(query))
+        if not len(self):
+            return []
+        docs, weights = [], []
+        for token in tokens:
+            term_docs, tf = [], []
+            for start, part in zip(self.starts, self.parts):
+                if token in part.terms:
+                    term = part.terms[token]
+                    begin, end = part.offsets[term], part.offsets[term + 1]
+                    term_docs.append(start + part.docs[begin:end])
+                    tf.append(part.tf[begin:end])
+            if not term_docs:
+                continue
+            term_docs, tf = np.concatenate(term_docs), np.concatenate(tf)
+            # Deleted segments count toward the statistics until a rebuild
+            idf = math.log(
+                1 + (len(self.alive) - len(term_docs) + 0.5) / (len(term_docs) + 0.5)
+            )
+            live = self.alive[term_docs]
+            term_docs, tf = term_docs[live], tf[live]
+            docs.append(term_docs)
+            weights.append(idf * tf * (K1 + 1) / (tf + self._norm[term_docs]))
+        if not docs or not sum(map(len, docs)):
+            return []
+        docs = np.concatenate(docs)
+        # Rare terms touch few segments: score only those instead of every one
+        candidates, positions = np.unique(docs, return_inverse=True)
+        scores = np.bincount(positions, np.concatenate(weights))
+        matched = np.bincount(positions)
+        top = np.argpartition(-scores, min(top_k, len(scores) - 1))[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            Hit(
+                self.segment(int(candidates[i])),
+                float(scores[i]),
+                float(matched[i] / len(tokens)),
+            )
+            for i in top
+            if scores[i] > 0
+        ]
+
+
+def fuse(rankings: list[list[dict]], top_k: int) -> list[dict]:
+    """Merge ranked segment lists by reciprocal rank, without duplicates."""
+    scores: dict[str, float] = {}
+    segments: dict[str, dict] = {}
+    for ranking in rankings:
+        for rank, segment in enumerate(ranking):
+            key = segment.get("id") or segment.get("content", "")
+            scores[key] = scores.get(key, 0.0) + 1 / (RRF_K + rank + 1)
+            segments.setdefault(key, segment)
+    return [segments[key] for key in sorted(scores, key=scores.get, reverse=True)][
+        :top_k
+    ]
+
+
+class KeywordSearch:
+    """Routes knowledge-base lookups between the local indexes and Dify.
+
+    - Keyword-style queries whose best local match contains every query term are
+      answered locally.
+    - Other keyword-style queries are sent to Dify and its results are fused
+      with the local ones.
+    - Questions go to Dify alone.
+    - When Dify fails, lookups with local matches are answered locally for
+      KB_FALLBACK_COOLDOWN seconds.
+    """
+
+    def __init__(self, directory: str = KB_INDEX_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._indexes: dict[str, Optional[KeywordIndex]] = {}
+        self._versions: dict[str, Optional[int]] = {}
+        self._down_until: dict[str, float] = {}
+        self.local = 0
+        self.fused = 0
+        self.remote = 0
+        self.fallbacks = 0
+
+    def index(self, dataset_id: str) -> Optional[KeywordIndex]:
+        if not dataset_id:
+            return None
+        path = os.path.join(self.directory, dataset_id)
+        version = index_version(path)
+        with self._lock:
+            # Rebuilt indexes are swapped in on disk and picked up here
+            if self._versions.get(dataset_id, -1) != version:
+                index = KeywordIndex(path) if version is not None else None
+                self._indexes[dataset_id] = index if index and len(index) else None
+                self._versions[dataset_id] = version
+            return self._indexes[dataset_id]
+
+    def retrieve(
+        self, dataset_id: str, query: str, top_k: int, remote: Callable[[], list[dict]]
+    ) -> list[dict]:
+        """Up to `top_k` segments for `query`; `remote` asks Dify for its own."""
+        index = self.index(dataset_id)
+        if index is None:
+            return remote()
+        keyword = is_keyword_query(query)
+        hits = index.search(query, top_k)
+        local = [hit.segment for hit in hits]
+        if keyword and hits and hits[0].coverage == 1:
+            self.local += 1
+            return local
+        if local and time.monotonic() < self._down_until.get(dataset_id, 0):
+            self.fallbacks += 1
+            return local
+
+        try:
+            segments = remote()
+        except requests.RequestException as e:
+            response = getattr(e, "response", None)
+            # Client errors are not outages; a bad request fails the same locally
+            if response is not None and response.status_code < 500:
+                raise
+            self._down_until[dataset_id] = time.monotonic() + KB_FALLBACK_COOLDOWN
+            if not local:
+                raise
+            self.fallbacks += 1
+            return local
+        self._down_until.pop(dataset_id, None)
+        if keyword and local:
+            self.fused += 1
+            return fuse([segments, local], top_k)
+        self.remote += 1
+        return segments
+
+    def snapshot(self) -> dict:
+        return {
+            "indexes": {
+                dataset_id: len(index)
+                for dataset_id, index in self._indexes.items()
+                if index is not None
+            },
+            "local": self.local,
+            "fused": self.fused,
+            "remote": self.remote,
+            "fallbacks": self.fallbacks,
+        }
+
+
+keyword_search = KeywordSearch()
+
+
+def export(dataset_id: str, directory: str = KB_INDEX_DIR) -> int:
+    """Snapshot a Dify knowledge base into a local index."""
+    return build(
+        (
+            {"id": segment.get("id", ""), "content": segment.get("content", "")}
+            for _, segment in iter_dataset_segments(dataset_id)
+        ),
+        os.path.join(directory, dataset_id),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export Dify knowledge bases into local BM25 indexes."
+    )
+    parser.add_argument("dataset_ids", nargs="+")
+    parser.add_argument("--out", default=KB_INDEX_DIR)
+    args = parser.parse_args()
+    for dataset_id in args.dataset_ids:
+        print(f"Indexed {export(dataset_id, args.out)} segments of {dataset_id}")
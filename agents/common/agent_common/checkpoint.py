@@ -0,0 +1,220 @@
+import os
+import sqlite3
+from collections import OrderedDict
+from typing import Any, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+)
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from agent_common.serde import CompactSerializer
+
+try:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+except ImportError:
+    SqliteSaver = None
+
+# Checkpoint storage: "memory" (per process) or "sqlite" (durable, can be shared
+# by several worker processes on one machine)
+CHECKPOINTER = os.environ.get("CHECKPOINTER", "memory")
+CHECKPOINT_SQLITE_PATH = os.environ.get("CHECKPOINT_SQLITE_PATH", "checkpoints.sqlite")
+
+# Checkpoint serialization: "jsonplus" (LangGraph's default) or "compact"
+CHECKPOINT_SERDE = os.environ.get("CHECKPOINT_SERDE", "jsonplus")
+# Compression for compact checkpoints: "zstd", "lz4" or empty for none
+CHECKPOINT_COMPRESSION = os.environ.get("CHECKPOINT_COMPRESSION") or None
+CHECKPOINT_COMPRESSION_THRESHOLD = int(
+    os.environ.get("CHECKPOINT_COMPRESSION_THRESHOLD", "4096")
+)
+# Persist only the messages appended since the parent checkpoint, with a full
+# snapshot every CHECKPOINT_SNAPSHOT_INTERVAL writes (memory checkpointer only)
+CHECKPOINT_DELTA = os.environ.get("CHECKPOINT_DELTA", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+CHECKPOINT_SNAPSHOT_INTERVAL = int(os.environ.get("CHECKPOINT_SNAPSHOT_INTERVAL", "20"))
+
+DELTA_PREFIX = "delta+"
+
+
+class DeltaMemorySaver(MemorySaver):
+    """`MemorySaver` that stores append-only channels as deltas.
+
+    When a new version of one of `delta_channels` extends the version written
+    for the parent checkpoint, only the appended items are stored, together with
+    the version they extend. Anything else (the first write, forks from an older
+    checkpoint, replaced or removed messages) and every `snapshot_interval`-th
+    write store the full value, so rebuilding a value never replays more than
+    `snapshot_interval` deltas. Recently rebuilt values are cached, which makes
+    resuming a thread a single cache hit plus the newest delta.
+    """
+
+    def __init__(
+        self,
+        *,
+        delta_channels: Sequence[str] = ("messages",),
+        snapshot_interval: int = 20,
+        cache_size: int = 256,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.delta_channels = set(delta_channels)
+        self.snapshot_interval = snapshot_interval
+        self.cache_size = cache_size
+        # (thread id, checkpoint ns, channel) -> (checkpoint id, version, value, depth)
+        self.heads: dict[tuple[str, str, str], tuple[str, Any, list, int]] = {}
+        self.cache: OrderedDict[tuple, list] = OrderedDict()
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        parent_id = config["configurable"].get("checkpoint_id")
+        values = checkpoint["channel_values"]
+
+        for channel in self.delta_channels:
+            head_key = (thread_id, checkpoint_ns, channel)
+            head = self.heads.get(head_key)
+            if head is not None and head[0] != parent_id:
+                # Forked from an older checkpoint
+                head = None
+            if channel not in new_versions:
+                if head is not None:
+                    self.heads[head_key] = (checkpoint["id"], *head[1:])
+                continue
+
+            version = new_versions[channel]
+            value = values.get(channel)
+            if not isinstance(value, list):
+                self.heads.pop(head_key, None)
+                continue
+            blob = None
+            depth = 0
+            if head is not None and head[3] + 1 < self.snapshot_interval:
+                _, base_version, base, base_depth = head
+                if len(value) >= len(base) and all(
+                    new is old for new, old in zip(value, base)
+                ):
+                    type_, data = self.serde.dumps_typed(
+                        [base_version, value[len(base) :]]
+                    )
+                    blob = (DELTA_PREFIX + type_, data)
+                    depth = base_depth + 1
+            if blob is None:
+                blob = self.serde.dumps_typed(value)
+            self.blobs[(thread_id, checkpoint_ns, channel, version)] = blob
+            self.heads[head_key] = (checkpoint["id"], version, list(value), depth)
+            self._remember((thread_id, checkpoint_ns, channel, version), value)
+
+        other_versions = {
+            k: v for k, v in new_versions.items() if k not in self.delta_channels
+        }
+        return super().put(config, checkpoint, metadata, other_versions)
+
+    def _remember(self, key: tuple, value: list) -> None:
+        self.cache[key] = list(value)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _load_value(self, key: tuple) -> Optional[list]:
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.move_to_end(key)
+            return list(cached)
+
+        # Walk back to the nearest snapshot or cached version, then replay
+        deltas = []
+        while True:
+            type_, data = self.blobs[key]
+            if not type_.startswith(DELTA_PREFIX):
+                value = self.serde.loads_typed((type_, data))
+                break
+            base_version, appended = self.serde.loads_typed(
+                (type_[len(DELTA_PREFIX) :], data)
+            )
+            deltas.append((key, appended))
+            key = (*key[:3], base_version)
+            if key in self.cache:
+                value = list(self.cache[key])
+                break
+        for key, appended in reversed(deltas):
+            value = value + appended
+            self._remember(key, value)
+        return value
+
+    def _load_blobs(
+        self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions
+    ) -> dict[str, Any]:
+        delta_versions = {}
+        other_versions = {}
+        for k, v in versions.items():
+            if k in self.delta_channels:
+                delta_versions[k] = v
+            else:
+                other_versions[k] = v
+        channel_values = super()._load_blobs(thread_id, checkpoint_ns, other_versions)
+        for k, v in delta_versions.items():
+            key = (thread_id, checkpoint_ns, k, v)
+            if key in self.blobs and self.blobs[key][0] != "empty":
+                channel_values[k] = self._load_value(key)
+        return channel_values
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        for key in [key for key in self.heads if key[0] == thread_id]:
+            del self.heads[key]
+        for key in [key for key in self.cache if key[0] == thread_id]:
+            del self.cache[key]
+
+
+def create_serializer() -> SerializerProtocol:
+    if CHECKPOINT_SERDE == "compact":
+        return CompactSerializer(
+            compression=CHECKPOINT_COMPRESSION,
+            threshold=CHECKPOINT_COMPRESSION_THRESHOLD,
+        )
+    if CHECKPOINT_SERDE == "jsonplus":
+        return JsonPlusSerializer()
+    raise ValueError(f"Unknown CHECKPOINT_SERDE {CHECKPOINT_SERDE!r}")
+
+
+def create_checkpointer() -> BaseCheckpointSaver:
+    """Checkpointer shared by the agent graphs, configured from the environment."""
+    if CHECKPOINTER == "sqlite":
+        if CHECKPOINT_DELTA:
+            # Delta chains are tracked in memory, which other processes sharing
+            # the file cannot see
+            raise ValueError(
+                "CHECKPOINT_DELTA is only supported with CHECKPOINTER=memory"
+            )
+        if SqliteSaver is None:
+            raise ImportError(
+                "CHECKPOINTER=sqlite requires the `langgraph-checkpoint-sqlite` package"
+            )
+        # Other processes may hold the write lock for a while, wait instead of failing
+        conn = sqlite3.connect(
+            CHECKPOINT_SQLITE_PATH, check_same_thread=False, timeout=30
+        )
+        return SqliteSaver(conn, serde=create_serializer())
+    if CHECKPOINTER != "memory":
+        raise ValueError(f"Unknown CHECKPOINTER {CHECKPOINTER!r}")
+    if CHECKPOINT_DELTA:
+        return DeltaMemorySaver(
+            serde=create_serializer(),
+            snapshot_interval=CHECKPOINT_SNAPSHOT_INTERVAL,
+        )
+    return MemorySaver(serde=create_serializer())
@@ -0,0 +1,81 @@
+import os
+import threading
+from typing import Iterator, Optional
+
+import requests
+
+DIFY_BASE_URL = os.environ.get("DIFY_BASE_URL")
+DIFY_API_KEY = os.environ.get("DIFY_API_KEY")
+# Items requested per page when listing documents and segments (Dify allows 100)
+DIFY_PAGE_SIZE = int(os.environ.get("DIFY_PAGE_SIZE", "100"))
+# Seconds to wait for a Dify API response
+DIFY_TIMEOUT = float(os.environ.get("DIFY_TIMEOUT", "30"))
+
+_local = threading.local()
+
+
+def _session() -> requests.Session:
+    # Paging issues many small requests; reuse connections per thread
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+        _local.session.headers["Authorization"] = f"Bearer {DIFY_API_KEY}"
+    return _local.session
+
+
+def _get(path: str, params: Optional[dict] = None) -> dict:
+    response = _session().get(
+        f"{DIFY_BASE_URL}/v1{path}", params=params, timeout=DIFY_TIMEOUT
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def _paged(path: str, page_size: int, params: Optional[dict] = None) -> Iterator[dict]:
+    page = 1
+    while True:
+        data = _get(path, {**(params or {}), "page": page, "limit": page_size})
+        yield from data.get("data", [])
+        # Older Dify versions return every segment at once without `has_more`
+        if not data.get("has_more"):
+            return
+        page += 1
+
+
+def iter_documents(dataset_id: str, page_size: int = DIFY_PAGE_SIZE) -> Iterator[dict]:
+    """Documents of a knowledge base, fetched one page at a time."""
+    return _paged(f"/datasets/{dataset_id}/documents", page_size)
+
+
+def iter_segments(
+    dataset_id: str, document_id: str, page_size: int = DIFY_PAGE_SIZE
+) -> Iterator[dict]:
+    """Enabled segments of a document, fetched one page at a time."""
+    return _paged(
+        f"/datasets/{dataset_id}/documents/{document_id}/segments",
+        page_size,
+        {"status": "completed", "enabled": "true"},
+    )
+
+
+def iter_dataset_segments(
+    dataset_id: str, page_size: int = DIFY_PAGE_SIZE
+) -> Iterator[tuple[dict, dict]]:
+    """Every (document, segment) pair of a knowledge base, lazily.
+
+    Only one page of documents and one page of segments is held at a time, so a
+    whole knowledge base can be scanned in bounded memory.
+    """
+    for document in iter_documents(dataset_id, page_size):
+        if document.get("enabled") is False:
+            continue
+        for segment in iter_segments(dataset_id, document["id"], page_size):
+            yield document, segment
+
+
+def dataset_fingerprint(dataset_id: str) -> str:
+    """Changes whenever documents are added to or removed from a knowledge base."""
+    data = _get(f"/datasets/{dataset_id}/documents", {"page": 1, "limit": 1})
+    latest = (data.get("data") or [{}])[0]
+    return (
+        f"{data.get('total', 0)}:{latest.get('id', '')}:{latest.get('created_at', '')}"
+    )
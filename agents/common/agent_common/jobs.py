@@ -0,0 +1,466 @@
+"""Durable background jobs for long-running graph runs.
+
+A job is a graph run submitted to a SQLite-backed queue instead of being run
+inside a client request. Job worker processes claim queued jobs, stream them
+through the graph and record their events, result or error, so clients can
+disconnect and poll or follow a job later:
+
+    jobs = JobQueue("jobs.sqlite")
+    job_id = jobs.submit("prospectingExport", {"messages": [...]})
+    for event in jobs.events(job_id):
+        print(event.mode, event.data)
+    print(jobs.wait(job_id).result)
+
+and the workers run next to the server:
+
+    python -m agent_common.jobs --graphs langgraph.json --processes 2
+
+A claimed job holds a lease its worker keeps renewing. When a worker dies the
+lease runs out and another worker picks the job up again, resuming the run from
+its last checkpoint (workers always use the SQLite checkpointer). Jobs run in
+the batch priority class by default and each worker runs a bounded number at
+once, so queued jobs do not eat into interactive capacity.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Iterator, Optional
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from agent_common import checkpoint
+from agent_common.scheduler import PRIORITIES
+from agent_common.workers import load_graph
+
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", "jobs.sqlite")
+# Jobs each worker process runs at once
+JOB_WORKER_CONCURRENCY = int(os.environ.get("JOB_WORKER_CONCURRENCY", "2"))
+# Seconds a worker may go silent before its jobs are handed to another worker
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "60"))
+# Runs of a job (first run plus resumes after crashes) before it is failed
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+_serde = JsonPlusSerializer()
+
+
+def _dumps(value: Any) -> bytes:
+    try:
+        type_, data = _serde.dumps_typed(value)
+    except Exception:
+        # Events are informational; keep what we can rather than fail the job
+        type_, data = _serde.dumps_typed(repr(value))
+    return type_.encode() + b"\0" + data
+
+
+def _loads(data: Optional[bytes]) -> Any:
+    if data is None:
+        return None
+    type_, _, payload = data.partition(b"\0")
+    return _serde.loads_typed((type_.decode(), payload))
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it has been cancelled."""
+
+
+@dataclass
+class Job:
+    id: str
+    graph: str
+    input: Any
+    config: RunnableConfig
+    priority: str
+    status: str
+    attempts: int
+    worker: Optional[str]
+    created_at: float
+    started_at: Optional[float]
+    finished_at: Optional[float]
+    result: Any
+    error: Optional[str]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+
+@dataclass
+class JobEvent:
+    seq: int
+    at: float
+    mode: str
+    data: Any
+
+
+class JobQueue:
+    """Jobs, their events and results in a SQLite file shared by all processes."""
+
+    COLUMNS = (
+        "id",
+        "graph",
+        "input",
+        "config",
+        "priority",
+        "status",
+        "attempts",
+        "worker",
+        "created_at",
+        "started_at",
+        "finished_at",
+        "result",
+        "error",
+    )
+
+    def __init__(
+        self, path: str = JOB_DB_PATH, lease_seconds: float = JOB_LEASE_SECONDS
+    ):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, graph TEXT, "
+            "input BLOB, config TEXT, priority TEXT, rank INTEGER, status TEXT, "
+            "attempts INTEGER, worker TEXT, lease_until REAL, created_at REAL, "
+            "started_at REAL, finished_at REAL, result BLOB, error TEXT)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, rank, created_at)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_events (job_id TEXT, seq INTEGER, "
+            "at REAL, mode TEXT, data BLOB, PRIMARY KEY (job_id, seq))"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        if not hasattr(self._local, "conn"):
+            self._local.conn = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None
+            )
+            self._local.conn.execute("PRAGMA journal_mode=WAL")
+        return self._local.conn
+
+    def submit(
+        self,
+        graph: str,
+        input: Any,
+        config: Optional[RunnableConfig] = None,
+        priority: str = "batch",
+    ) -> str:
+        """Queue a run of `graph` and return the job id.
+
+        The run uses thread `job:<id>` unless `config` names a thread.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(
+                f"Unknown priority {priority!r}, expected one of {PRIORITIES}"
+            )
+        job_id = uuid.uuid4().hex
+        config = dict(config or {})
+        config["configurable"] = {
+            "thread_id": f"job:{job_id}",
+            **config.get("configurable", {}),
+            "priority": priority,
+        }
+        self._connect().execute(
+            "INSERT INTO jobs (id, graph, input, config, priority, rank, status, "
+            "attempts, created_at) VALUES (?, ?, ?, ?, ?, ?, 'queued', 0, ?)",
+            (
+                job_id,
+                graph,
+                _dumps(input),
+                json.dumps(config),
+                priority,
+                PRIORITIES.index(priority),
+                time.time(),
+            ),
+        )
+        return job_id
+
+    def get(self, job_id: str) -> Job:
+        row = (
+            self._connect()
+            .execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            )
+            .fetchone()
+        )
+        if row is None:
+            raise KeyError(f"Unknown job {job_id!r}")
+        values = dict(zip(self.COLUMNS, row))
+        values["input"] = _loads(values["input"])
+        values["config"] = json.loads(values["config"])
+        values["result"] = _loads(values["result"])
+        return Job(**values)
+
+    def recent(self, status: Optional[str] = None, limit: int = 100) -> list[dict]:
+        """Most recent jobs, without their inputs and results."""
+        query = "SELECT id, graph, priority, status, attempts, created_at FROM jobs"
+        params: tuple = ()
+        if status is not None:
+            query += " WHERE status = ?"
+            params = (status,)
+        rows = self._connect().execute(
+            query + " ORDER BY created_at DESC LIMIT ?", (*params, limit)
+        )
+        keys = ("id", "graph", "priority", "status", "attempts", "created_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def counts(self) -> dict[str, int]:
+        rows = self._connect().execute(
+            "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+        )
+        return dict(rows.fetchall())
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job that has not finished; a running job stops at its next step."""
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ? "
+            "WHERE id = ? AND status IN ('queued', 'running')",
+            (time.time(), job_id),
+        )
+        return cursor.rowcount > 0
+
+    def wait(
+        self, job_id: str, timeout: Optional[float] = None, poll: float = 0.5
+    ) -> Job:
+        """Poll until the job has finished, or raise `TimeoutError`."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not (job := self.get(job_id)).finished:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Job {job_id} is still {job.status}")
+            time.sleep(poll)
+        return job
+
+    def events(
+        self, job_id: str, after: int = 0, follow: bool = True, poll: float = 0.5
+    ) -> Iterator[JobEvent]:
+        """Events recorded after `after`, following the job until it finishes."""
+        conn = self._connect()
+        while True:
+            # Read the status first, so no event written before it finished is lost
+            finished = self.get(job_id).finished
+            for seq, at, mode, data in conn.execute(
+                "SELECT seq, at, mode, data FROM job_events "
+                "WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after),
+            ):
+                after = seq
+                yield JobEvent(seq, at, mode, _loads(data))
+            if finished or not follow:
+                return
+            time.sleep(poll)
+
+    # Used by workers
+
+    def claim(self, worker: str) -> Optional[Job]:
+        """Take the most urgent queued job, or one whose worker stopped renewing."""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, attempts FROM jobs WHERE status = 'queued' "
+                "OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY rank, created_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            job_id, attempts = row
+            if attempts >= JOB_MAX_ATTEMPTS:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? "
+                    "WHERE id = ?",
+                    (now, f"Gave up after {attempts} attempts", job_id),
+                )
+                conn.execute("COMMIT")
+                return self.claim(worker)
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                "worker = ?, lease_until = ?, started_at = COALESCE(started_at, ?) "
+                "WHERE id = ?",
+                (worker, now + self.lease_seconds, now, job_id),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(job_id)
+
+    def renew(self, job_ids: list[str], worker: str):
+        if not job_ids:
+            return
+        self._connect().executemany(
+            "UPDATE jobs SET lease_until = ? "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            [(time.time() + self.lease_seconds, job_id, worker) for job_id in job_ids],
+        )
+
+    def add_event(self, job_id: str, mode: str, data: Any) -> bool:
+        """Record an event; False once the job has been cancelled."""
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO job_events (job_id, seq, at, mode, data) VALUES (?, "
+            "(SELECT COALESCE(MAX(seq), 0) + 1 FROM job_events WHERE job_id = ?), "
+            "?, ?, ?)",
+            (job_id, job_id, time.time(), mode, _dumps(data)),
+        )
+        status = conn.execute(
+            "SELECT status FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()[0]
+        return status != "cancelled"
+
+    def finish(
+        self,
+        job_id: str,
+        worker: str,
+        result: Any = None,
+        error: Optional[str] = None,
+    ):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (
+                "failed" if error is not None else "succeeded",
+                time.time(),
+                _dumps(result),
+                error,
+                job_id,
+                worker,
+            ),
+        )
+
+
+class JobWorker:
+    """Claims jobs from a `JobQueue` and runs up to `concurrency` of them at once."""
+
+    def __init__(
+        self,
+        jobs: JobQueue,
+        graphs: dict[str, Any],
+        concurrency: int = JOB_WORKER_CONCURRENCY,
+        name: Optional[str] = None,
+    ):
+        self.jobs = jobs
+        self.graphs = graphs
+        self.concurrency = concurrency
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self._running: set[str] = set()
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(concurrency)
+
+    def _execute(self, job: Job):
+        try:
+            graph = self.graphs[job.graph]
+            input = job.input
+            # A job picked up again after a crash continues from its checkpoint
+            if job.attempts > 1:
+                state = graph.get_state(job.config)
+                if state.next:
+                    input = None
+                elif state.values:
+                    self.jobs.add_event(job.id, "resumed", {"completed": True})
+                    return self.jobs.finish(job.id, self.name, state.values)
+            for mode, chunk in graph.stream(
+                input, job.config, stream_mode=["updates", "custom"]
+            ):
+                if not self.jobs.add_event(job.id, mode, chunk):
+                    raise JobCancelled()
+            self.jobs.finish(job.id, self.name, graph.get_state(job.config).values)
+        except JobCancelled:
+            pass
+        except Exception as e:
+            self.jobs.finish(job.id, self.name, error=repr(e))
+        finally:
+            with self._lock:
+                self._running.discard(job.id)
+            self._slots.release()
+
+    def _heartbeat(self, stop: threading.Event):
+        while not stop.wait(self.jobs.lease_seconds / 3):
+            with self._lock:
+                running = list(self._running)
+            self.jobs.renew(running, self.name)
+
+    def run(self, stop: Optional[threading.Event] = None, idle: float = 0.5):
+        """Claim and run jobs until `stop` is set, then finish the running ones."""
+        stop = stop or threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(stop,), name="job-heartbeat", daemon=True
+        )
+        heartbeat.start()
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix="job") as pool:
+            while not stop.is_set():
+                if not self._slots.acquire(timeout=idle):
+                    continue
+                job = self.jobs.claim(self.name)
+                if job is None:
+                    self._slots.release()
+                    stop.wait(idle)
+                    continue
+                with self._lock:
+                    self._running.add(job.id)
+                pool.submit(self._execute, job)
+
+
+def _job_worker_main(
+    graph_specs: dict[str, str], path: str, checkpoint_path: str, concurrency: int
+):
+    # Jobs must be resumable by any worker after a crash
+    checkpoint.CHECKPOINTER = "sqlite"
+    checkpoint.CHECKPOINT_SQLITE_PATH = checkpoint_path
+    graphs = {name: load_graph(spec) for name, spec in graph_specs.items()}
+    JobWorker(JobQueue(path), graphs, concurrency).run()
+
+
+def start_job_workers(
+    graph_specs: dict[str, str],
+    processes: int = 1,
+    path: str = JOB_DB_PATH,
+    checkpoint_path: str = checkpoint.CHECKPOINT_SQLITE_PATH,
+    concurrency: int = JOB_WORKER_CONCURRENCY,
+) -> list[multiprocessing.Process]:
+    """Start `processes` job worker processes; they run until terminated."""
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(
+            target=_job_worker_main,
+            args=(graph_specs, path, checkpoint_path, concurrency),
+            name=f"job-worker-{index}",
+        )
+        for index in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background job workers.")
+    parser.add_argument(
+        "--graphs", default="langgraph.json", help="langgraph.json with the graphs"
+    )
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKER_CONCURRENCY)
+    parser.add_argument("--db", default=JOB_DB_PATH)
+    args = parser.parse_args()
+    with open(args.graphs) as f:
+        specs = json.load(f)["graphs"]
+    for worker in start_job_workers(
+        specs, args.processes, args.db, concurrency=args.concurrency
+    ):
+        worker.join()
@@ -0,0 +1,122 @@
+import uuid
+from typing import Optional, Sequence
+
+from langchain_core.messages import (
+    AnyMessage,
+    BaseMessageChunk,
+    RemoveMessage,
+    convert_to_messages,
+    message_chunk_to_message,
+)
+from langgraph.channels.base import BaseChannel
+from langgraph.graph.message import Messages
+from typing_extensions import Self
+
+
+class IndexedMessages(BaseChannel[list[AnyMessage], Messages, list[AnyMessage]]):
+    """Messages channel with the semantics of `add_messages`, but O(1) per message.
+
+    Use it in place of the reducer in a state definition:
+
+        messages: Annotated[list[AnyMessage], IndexedMessages]
+
+    `add_messages` re-converts the whole history, rebuilds an id -> position map
+    and copies the list in Python on every update. This channel keeps the map
+    alongside the list, so appending or replacing a message only touches that
+    message. Once the list has been handed out (to a node, a stream or a
+    checkpoint) it is never mutated again: the next update starts from a shallow
+    copy of the list and map, which is a single C-level copy rather than a pass
+    over every message.
+
+    Checkpoints hold the same plain list of messages as `add_messages`, so the two
+    are interchangeable on existing threads.
+    """
+
+    __slots__ = ("value", "index", "shared", "frozen")
+
+    def __init__(self, typ: type = list):
+        super().__init__(typ)
+        self.value: list[AnyMessage] = []
+        self.index: dict[str, int] = {}
+        self.shared = False
+        # Last handed-out list and its index, reused when Pregel restores a
+        # channel copy from that same list (e.g. to evaluate conditional edges)
+        self.frozen: Optional[tuple[list[AnyMessage], dict[str, int]]] = None
+
+    def __eq__(self, value: object) -> bool:
+        return isinstance(value, IndexedMessages)
+
+    @property
+    def ValueType(self) -> type:
+        return list[AnyMessage]
+
+    @property
+    def UpdateType(self) -> type:
+        return Messages
+
+    def from_checkpoint(self, checkpoint: Optional[list[AnyMessage]]) -> Self:
+        empty = self.__class__(self.typ)
+        empty.key = self.key
+        if checkpoint is None:
+            return empty
+        if checkpoint is self.value and self.shared:
+            empty.value, empty.index = self.value, self.index
+        elif self.frozen is not None and checkpoint is self.frozen[0]:
+            empty.value, empty.index = self.frozen
+        else:
+            empty.update([checkpoint])
+            return empty
+        empty.shared = True
+        empty.frozen = (empty.value, empty.index)
+        return empty
+
+    def checkpoint(self) -> list[AnyMessage]:
+        self.shared = True
+        return self.value
+
+    def get(self) -> list[AnyMessage]:
+        self.shared = True
+        return self.value
+
+    def update(self, values: Sequence[Messages]) -> bool:
+        if not values:
+            return False
+        if self.shared:
+            self.frozen = (self.value, self.index)
+            self.value = self.value.copy()
+            self.index = self.index.copy()
+            self.shared = False
+
+        for value in values:
+            self._merge(value)
+        return True
+
+    def _merge(self, value: Messages):
+        if not isinstance(value, list):
+            value = [value]
+        ids_to_remove = set()
+        for message in convert_to_messages(value):
+            if isinstance(message, BaseMessageChunk):
+                message = message_chunk_to_message(message)
+            if message.id is None:
+                message.id = str(uuid.uuid4())
+
+            position = self.index.get(message.id)
+            if position is not None:
+                if isinstance(message, RemoveMessage):
+                    ids_to_remove.add(message.id)
+                else:
+                    ids_to_remove.discard(message.id)
+                    self.value[position] = message
+            elif isinstance(message, RemoveMessage):
+                raise ValueError(
+                    f"Attempting to delete a message with an ID that doesn't exist ('{message.id}')"
+                )
+            else:
+                self.index[message.id] = len(self.value)
+                self.value.append(message)
+
+        if ids_to_remove:
+            # Removals shift positions, so they are the one O(n) operation
+            self.value = [m for m in self.value if m.id not in ids_to_remove]
+            self.index = {m.id: i for i, m in enumerate(self.value)}
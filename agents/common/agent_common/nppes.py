@@ -0,0 +1,452 @@
+"""Local columnar index of the NPPES NPI registry.
+
+The public NPPES dissemination file (npidata_pfile_*.csv, ~9M providers, ~10GB)
+is ingested once into a directory of NumPy arrays that are memory-mapped at
+query time, so exact questions ("NPI 1234567890", "taxonomy 207X00000X in ZIP
+787xx", "organizations named Mayo Clinic") are answered in milliseconds without
+loading the registry into memory:
+
+    python -m agent_common.nppes npidata_pfile.csv nppes_index/
+
+Layout (one row per provider, in file order):
+
+- npi (int64), entity_type (uint8: 1 individual, 2 organization)
+- state, city, taxonomy: dictionary codes plus a JSON list of their values;
+  taxonomy is the primary taxonomy code
+- zip (S5), first five digits of the practice location postal code
+- name: UTF-8 bytes in name.bin with row offsets in name_offsets.npy
+- indexes: rows sorted by NPI, by ZIP and by normalized organization name, and
+  a posting list of rows per taxonomy code (all 15 taxonomy slots)
+"""
+
+import argparse
+import json
+import os
+import re
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import numpy as np
+from langchain_core.tools import tool
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+NPPES_INDEX_DIR = os.environ.get("NPPES_INDEX_DIR", "nppes_index")
+
+NPI = "NPI"
+ENTITY_TYPE = "Entity Type Code"
+ORGANIZATION = "Provider Organization Name (Legal Business Name)"
+LAST_NAME = "Provider Last Name (Legal Name)"
+FIRST_NAME = "Provider First Name"
+CREDENTIAL = "Provider Credential Text"
+CITY = "Provider Business Practice Location Address City Name"
+STATE = "Provider Business Practice Location Address State Name"
+POSTAL_CODE = "Provider Business Practice Location Address Postal Code"
+TAXONOMY = "Healthcare Provider Taxonomy Code_{}"
+PRIMARY_TAXONOMY = "Healthcare Provider Primary Taxonomy Switch_{}"
+TAXONOMY_SLOTS = 15
+
+COLUMNS = [
+    NPI,
+    ENTITY_TYPE,
+    ORGANIZATION,
+    LAST_NAME,
+    FIRST_NAME,
+    CREDENTIAL,
+    CITY,
+    STATE,
+    POSTAL_CODE,
+    *(TAXONOMY.format(slot) for slot in range(1, TAXONOMY_SLOTS + 1)),
+    *(PRIMARY_TAXONOMY.format(slot) for slot in range(1, TAXONOMY_SLOTS + 1)),
+]
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(re.sub(r"[^\w ]+", " ", name.casefold()).split())
+
+
+class _Dictionary:
+    """Assigns dense integer codes to string values; code 0 is the empty value."""
+
+    def __init__(self):
+        self.codes = {"": 0}
+
+    def encode(self, values: Iterable[str]) -> list[int]:
+        codes = self.codes
+        return [codes.setdefault(value, len(codes)) for value in values]
+
+    def values(self) -> list[str]:
+        return list(self.codes)
+
+
+def ingest(csv_path: str, out_dir: str, chunksize: int = 200_000) -> int:
+    """Build the index in `out_dir` from an NPPES CSV file; returns the row count."""
+    if pd is None:
+        raise ImportError("Ingesting the NPPES file requires the `pandas` package")
+    os.makedirs(out_dir, exist_ok=True)
+    dictionaries = {name: _Dictionary() for name in ("state", "city", "taxonomy")}
+    parts: dict[str, list[np.ndarray]] = {
+        name: [] for name in ("npi", "entity_type", "state", "city", "taxonomy", "zip")
+    }
+    name_offsets = [np.zeros(1, dtype=np.int64)]
+    name_size = 0
+    posting_codes: list[np.ndarray] = []
+    posting_rows: list[np.ndarray] = []
+    rows = 0
+
+    with open(os.path.join(out_dir, "name.bin"), "wb") as names:
+        for chunk in pd.read_csv(
+            csv_path,
+            usecols=COLUMNS,
+            dtype=str,
+            keep_default_na=False,
+            chunksize=chunksize,
+        ):
+            chunk = chunk[chunk[NPI] != ""]
+            count = len(chunk)
+            parts["npi"].append(chunk[NPI].to_numpy(dtype=np.int64))
+            parts["entity_type"].append(
+                pd.to_numeric(chunk[ENTITY_TYPE], errors="coerce")
+                .fillna(0)
+                .to_numpy(dtype=np.uint8)
+            )
+            parts["state"].append(
+                np.array(
+                    dictionaries["state"].encode(chunk[STATE].str.upper()),
+                    dtype=np.uint16,
+                )
+            )
+            parts["city"].append(
+                np.array(
+                    dictionaries["city"].encode(chunk[CITY].str.upper()),
+                    dtype=np.uint32,
+                )
+            )
+            parts["zip"].append(chunk[POSTAL_CODE].str[:5].to_numpy(dtype="S5"))
+
+            # Primary taxonomy: the slot flagged "Y", else the first one
+            taxonomies = chunk[
+                [TAXONOMY.format(s) for s in range(1, TAXONOMY_SLOTS + 1)]
+            ].to_numpy()
+            flags = chunk[
+                [PRIMARY_TAXONOMY.format(s) for s in range(1, TAXONOMY_SLOTS + 1)]
+            ]
+            slot = np.where(
+                (flags.to_numpy() == "Y").any(axis=1),
+                (flags.to_numpy() == "Y").argmax(axis=1),
+                0,
+            )
+            primary = taxonomies[np.arange(count), slot]
+            parts["taxonomy"].append(
+                np.array(dictionaries["taxonomy"].encode(primary), dtype=np.uint16)
+            )
+            filled = taxonomies != ""
+            row_ids = np.broadcast_to(
+                np.arange(rows, rows + count)[:, None], taxonomies.shape
+            )
+            posting_codes.append(
+                np.array(
+                    dictionaries["taxonomy"].encode(taxonomies[filled]),
+                    dtype=np.uint16,
+                )
+            )
+            posting_rows.append(row_ids[filled].astype(np.uint32))
+
+            individual = (
+                chunk[FIRST_NAME]
+                + " "
+                + chunk[LAST_NAME]
+                + np.where(chunk[CREDENTIAL] != "", ", " + chunk[CREDENTIAL], "")
+            ).str.strip()
+            display = np.where(
+                chunk[ORGANIZATION] != "", chunk[ORGANIZATION], individual
+            )
+            encoded = [name.encode() for name in display]
+            names.write(b"".join(encoded))
+            lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=count)
+            name_offsets.append(name_size + np.cumsum(lengths))
+            name_size += int(lengths.sum())
+            rows += count
+
+    columns = {name: np.concatenate(arrays) for name, arrays in parts.items()}
+    for name, values in columns.items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), values)
+    np.save(os.path.join(out_dir, "name_offsets.npy"), np.concatenate(name_offsets))
+    with open(os.path.join(out_dir, "dictionaries.json"), "w") as f:
+        json.dump({name: d.values() for name, d in dictionaries.items()}, f)
+
+    order = np.argsort(columns["npi"], kind="stable").astype(np.uint32)
+    np.save(os.path.join(out_dir, "npi_order.npy"), order)
+    np.save(os.path.join(out_dir, "npi_sorted.npy"), columns["npi"][order])
+    order = np.argsort(columns["zip"], kind="stable").astype(np.uint32)
+    np.save(os.path.join(out_dir, "zip_order.npy"), order)
+    np.save(os.path.join(out_dir, "zip_sorted.npy"), columns["zip"][order])
+
+    codes = np.concatenate(posting_codes)
+    order = np.argsort(codes, kind="stable")
+    np.save(
+        os.path.join(out_dir, "taxonomy_rows.npy"), np.concatenate(posting_rows)[order]
+    )
+    np.save(
+        os.path.join(out_dir, "taxonomy_offsets.npy"),
+        np.searchsorted(
+            codes[order], np.arange(len(dictionaries["taxonomy"].codes) + 1)
+        ).astype(np.int64),
+    )
+
+    # Organization names are indexed normalized, so prefixes match regardless of
+    # case and punctuation
+    index = NppesIndex(out_dir)
+    organizations = np.flatnonzero(columns["entity_type"] == 2)
+    keys = [normalize_name(index.name(row)) for row in organizations]
+    order = np.argsort(np.array(keys, dtype=object), kind="stable")
+    np.save(
+        os.path.join(out_dir, "organization_order.npy"),
+        organizations[order].astype(np.uint32),
+    )
+    with open(os.path.join(out_dir, "organization_keys.txt"), "w") as f:
+        f.write("\n".join(keys[i] for i in order))
+    return rows
+
+
+@dataclass
+class Provider:
+    npi: int
+    entity_type: str
+    name: str
+    taxonomy: str
+    city: str
+    state: str
+    zip: str
+
+
+class NppesIndex:
+    """Memory-mapped NPPES index built by `ingest`."""
+
+    def __init__(self, path: str = NPPES_INDEX_DIR):
+        self.path = path
+
+        def load(name: str) -> np.ndarray:
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+        self.npi = load("npi")
+        self.entity_type = load("entity_type")
+        self.state = load("state")
+        self.city = load("city")
+        self.taxonomy = load("taxonomy")
+        self.zip = load("zip")
+        self.name_offsets = load("name_offsets")
+        self.names = np.memmap(os.path.join(path, "name.bin"), dtype=np.uint8, mode="r")
+        with open(os.path.join(path, "dictionaries.json")) as f:
+            self.values = json.load(f)
+        self.codes = {
+            name: {value: code for code, value in enumerate(values)}
+            for name, values in self.values.items()
+        }
+        self._indexes: dict[str, np.ndarray] = {}
+        self._organization_keys: Optional[list[str]] = None
+
+    def _index(self, name: str) -> np.ndarray:
+        if name not in self._indexes:
+            self._indexes[name] = np.load(
+                os.path.join(self.path, f"{name}.npy"), mmap_mode="r"
+            )
+        return self._indexes[name]
+
+    def __len__(self) -> int:
+        return len(self.npi)
+
+    def name(self, row: int) -> str:
+        start, end = self.name_offsets[row], self.name_offsets[row + 1]
+        return self.names[start:end].tobytes().decode()
+
+    def provider(self, row: int) -> Provider:
+        return Provider(
+            npi=int(self.npi[row]),
+            entity_type={1: "individual", 2: "organization"}.get(
+                int(self.entity_type[row]), ""
+            ),
+            name=self.name(row),
+            taxonomy=self.values["taxonomy"][self.taxonomy[row]],
+            city=self.values["city"][self.city[row]],
+            state=self.values["state"][self.state[row]],
+            zip=self.zip[row].decode(),
+        )
+
+    # Candidate rows from the indexes, each sorted
+
+    def rows_for_npi(self, npi: int) -> np.ndarray:
+        sorted_npis = self._index("npi_sorted")
+        start = np.searchsorted(sorted_npis, npi, side="left")
+        end = np.searchsorted(sorted_npis, npi, side="right")
+        return np.sort(self._index("npi_order")[start:end])
+
+    def rows_for_zip(self, prefix: str) -> np.ndarray:
+        sorted_zips = self._index("zip_sorted")
+        start = np.searchsorted(sorted_zips, prefix.encode(), side="left")
+        end = np.searchsorted(sorted_zips, prefix.encode() + b"\xff", side="left")
+        return np.sort(self._index("zip_order")[start:end])
+
+    def rows_for_taxonomy(self, prefix: str) -> np.ndarray:
+        """Rows with any taxonomy code (of all 15 slots) starting with `prefix`."""
+        offsets = self._index("taxonomy_offsets")
+        postings = self._index("taxonomy_rows")
+        prefix = prefix.upper()
+        parts = [
+            postings[offsets[code] : offsets[code + 1]]
+            for value, code in self.codes["taxonomy"].items()
+            if value and value.startswith(prefix)
+        ]
+        return np.unique(np.concatenate(parts)) if parts else np.empty(0, np.uint32)
+
+    def rows_for_organization(self, prefix: str) -> np.ndarray:
+        """Organizations whose normalized name starts with `prefix`."""
+        if self._organization_keys is None:
+            with open(os.path.join(self.path, "organization_keys.txt")) as f:
+                self._organization_keys = f.read().split("\n")
+        keys = self._organization_keys
+        prefix = normalize_name(prefix)
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + "￿", lo=start)
+        return np.sort(self._index("organization_order")[start:end])
+
+    def search(
+        self,
+        npi: Optional[int] = None,
+        taxonomy: Optional[str] = None,
+        state: Optional[str] = None,
+        zip_prefix: Optional[str] = None,
+        city: Optional[str] = None,
+        organization: Optional[str] = None,
+        entity_type: Optional[int] = None,
+    ) -> np.ndarray:
+        """Rows matching every given filter, in registry order."""
+        rows: Optional[np.ndarray] = None
+
+        def narrow(candidates: np.ndarray):
+            nonlocal rows
+            rows = (
+                candidates
+                if rows is None
+                else np.intersect1d(rows, candidates, assume_unique=True)
+            )
+
+        if npi is not None:
+            narrow(self.rows_for_npi(npi))
+        if zip_prefix:
+            narrow(self.rows_for_zip(zip_prefix))
+        if organization:
+            narrow(self.rows_for_organization(organization))
+        if taxonomy:
+            narrow(self.rows_for_taxonomy(taxonomy))
+
+        # The remaining filters compare dictionary codes, over the candidates or
+        # the whole column when no index applied
+        for column, value in (("state", state), ("city", city)):
+            if not value:
+                continue
+            code = self.codes[column].get(value.strip().upper())
+            if code is None:
+                return np.empty(0, np.uint32)
+            if rows is None:
+                rows = np.flatnonzero(getattr(self, column) == code)
+            else:
+                rows = rows[getattr(self, column)[rows] == code]
+        if entity_type is not None:
+            if rows is None:
+                rows = np.flatnonzero(self.entity_type == entity_type)
+            else:
+                rows = rows[self.entity_type[rows] == entity_type]
+        if rows is None:
+            raise ValueError("At least one filter is required")
+        return rows
+
+
+ENTITY_TYPES = {"individual": 1, "organization": 2}
+
+_index: Optional[NppesIndex] = None
+
+
+def registry_search(
+    npi: str = "",
+    taxonomy: str = "",
+    state: str = "",
+    zip_prefix: str = "",
+    city: str = "",
+    organization: str = "",
+    entity_type: str = "",
+    limit: int = 20,
+) -> str:
+    """Providers matching structured filters, as a table for the LLM."""
+    global _index
+    if _index is None:
+        if not os.path.exists(os.path.join(NPPES_INDEX_DIR, "npi.npy")):
+            return "The local NPI registry is not available; use npi_lookup instead."
+        _index = NppesIndex(NPPES_INDEX_DIR)
+    if entity_type and entity_type.lower() not in ENTITY_TYPES:
+        return f"Error: entity_type must be one of {sorted(ENTITY_TYPES)}."
+    digits = re.sub(r"\D", "", npi)
+    try:
+        rows = _index.search(
+            npi=int(digits) if digits else None,
+            taxonomy=taxonomy or None,
+            state=state or None,
+            zip_prefix=re.sub(r"\D", "", zip_prefix) or None,
+            city=city or None,
+            organization=organization or None,
+            entity_type=ENTITY_TYPES.get(entity_type.lower()),
+        )
+    except ValueError as e:
+        return f"Error: {e}."
+    if not len(rows):
+        return "No providers match."
+    lines = [
+        f"{len(rows)} providers match"
+        + (f"; the first {limit} are:" if len(rows) > limit else ":"),
+        "NPI | Name | Type | Primary taxonomy | City | State | ZIP",
+    ]
+    for row in rows[:limit]:
+        provider = _index.provider(row)
+        lines.append(
+            f"{provider.npi} | {provider.name} | {provider.entity_type} | "
+            f"{provider.taxonomy} | {provider.city} | {provider.state} | "
+            f"{provider.zip}"
+        )
+    return "\n".join(lines)
+
+
+@tool
+def npi_registry_search(
+    npi: str = "",
+    taxonomy: str = "",
+    state: str = "",
+    zip_prefix: str = "",
+    city: str = "",
+    organization: str = "",
+    entity_type: str = "",
+    limit: int = 20,
+) -> str:
+    """
+    Look up providers in the NPI registry by exact criteria, combined as needed:
+    NPI number, taxonomy code or code prefix (e.g. 207X00000X for orthopaedic
+    surgery), two-letter state, ZIP code prefix (e.g. 787), city, organization
+    name prefix, and entity_type ("individual" or "organization").
+    Returns the number of matches and up to `limit` providers.
+    Use npi_lookup for free-text questions instead.
+    """
+    return registry_search(
+        npi, taxonomy, state, zip_prefix, city, organization, entity_type, limit
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the local NPPES index.")
+    parser.add_argument("csv", help="NPPES dissemination file (npidata_pfile_*.csv)")
+    parser.add_argument("out", nargs="?", default=NPPES_INDEX_DIR)
+    parser.add_argument("--chunksize", type=int, default=200_000)
+    args = parser.parse_args()
+    print(f"Indexed {ingest(args.csv, args.out, args.chunksize)} providers")
@@ -0,0 +1,561 @@
+import asyncio
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.runnables.config import ensure_config
+from langchain_openai import ChatOpenAI
+
+from agent_common.scheduler import (
+    DEFAULT_PRIORITY,
+    DEFAULT_TENANT,
+    PRIORITIES,
+    TENANT_MAX_IN_FLIGHT,
+    TENANT_WEIGHTS,
+    FairScheduler,
+    Ticket,
+    call_context,
+)
+
+try:
+    from openai import APIConnectionError, APIStatusError, RateLimitError
+except ImportError:
+    APIConnectionError = APIStatusError = RateLimitError = None
+
+# Requests and tokens per minute shared by every LLM call; 0 leaves the limit
+# unset until the provider's rate-limit headers report it
+LLM_RPM = int(os.environ.get("LLM_RPM", "0"))
+LLM_TPM = int(os.environ.get("LLM_TPM", "0"))
+# SQLite file coordinating the limits across worker processes; in-process when empty
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE") or None
+# Completion tokens assumed for calls without max_tokens, reconciled with the usage
+LLM_COMPLETION_TOKENS_ESTIMATE = int(
+    os.environ.get("LLM_COMPLETION_TOKENS_ESTIMATE", "512")
+)
+LLM_RATE_LIMIT_RETRIES = int(os.environ.get("LLM_RATE_LIMIT_RETRIES", "5"))
+# Retries of connection errors, timeouts and 5xx responses, with exponential backoff
+LLM_TRANSIENT_RETRIES = int(os.environ.get("LLM_TRANSIENT_RETRIES", "2"))
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse OpenAI reset durations such as "6m0s", "1.5s" or "20ms" into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _UNITS[unit] for amount, unit in parts)
+
+
+def estimate_tokens(messages: list[BaseMessage], completion_tokens: int) -> int:
+    """Cheap pre-dispatch estimate: ~4 characters per token plus message overhead."""
+    characters = 0
+    for message in messages:
+        characters += len(str(message.content))
+        for tool_call in getattr(message, "tool_calls", None) or []:
+            characters += len(str(tool_call.get("args", "")))
+    return characters // 4 + 4 * len(messages) + completion_tokens
+
+
+def _take(state: dict, tokens: int, now: float) -> float:
+    """Refill the buckets and take one request and `tokens`; return the wait if short."""
+    if state["paused_until"] > now:
+        return state["paused_until"] - now
+    elapsed = max(0.0, now - state["updated"])
+    state["updated"] = now
+    rpm, tpm = state["rpm"], state["tpm"]
+    if rpm:
+        state["requests"] = min(rpm, state["requests"] + elapsed * rpm / 60)
+    if tpm:
+        state["tokens"] = min(tpm, state["tokens"] + elapsed * tpm / 60)
+        # A call larger than the whole bucket would otherwise never be admitted
+        tokens = min(tokens, tpm)
+
+    wait = 0.0
+    if rpm and state["requests"] < 1:
+        wait = (1 - state["requests"]) * 60 / rpm
+    if tpm and state["tokens"] < tokens:
+        wait = max(wait, (tokens - state["tokens"]) * 60 / tpm)
+    if wait:
+        return wait
+    if rpm:
+        state["requests"] -= 1
+    if tpm:
+        state["tokens"] -= tokens
+    return 0.0
+
+
+def _new_state(rpm: int, tpm: int, now: float) -> dict:
+    return {
+        "rpm": rpm,
+        "tpm": tpm,
+        "requests": float(rpm),
+        "tokens": float(tpm),
+        "updated": now,
+        "paused_until": 0.0,
+    }
+
+
+class _MemoryBuckets:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states: dict[str, dict] = {}
+
+    def update(self, name: str, rpm: int, tpm: int, change) -> Any:
+        with self._lock:
+            now = time.time()
+            state = self._states.setdefault(name, _new_state(rpm, tpm, now))
+            return change(state, now)
+
+
+class _SqliteBuckets:
+    """Bucket state in a SQLite file, updated under an immediate write transaction."""
+
+    COLUMNS = ("rpm", "tpm", "requests", "tokens", "updated", "paused_until")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits (name TEXT PRIMARY KEY, "
+                "rpm INTEGER, tpm INTEGER, requests REAL, tokens REAL, "
+                "updated REAL, paused_until REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        if not hasattr(self._local, "conn"):
+            self._local.conn = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None
+            )
+            self._local.conn.execute("PRAGMA journal_mode=WAL")
+        return self._local.conn
+
+    def update(self, name: str, rpm: int, tpm: int, change) -> Any:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM rate_limits WHERE name = ?",
+                (name,),
+            ).fetchone()
+            state = dict(zip(self.COLUMNS, row)) if row else _new_state(rpm, tpm, now)
+            result = change(state, now)
+            conn.execute(
+                f"INSERT OR REPLACE INTO rate_limits (name, {', '.join(self.COLUMNS)}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (name, *(state[column] for column in self.COLUMNS)),
+            )
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class RateLimitStats:
+    """Queue wait and throttling counters for the process's LLM calls."""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.queued_calls = 0
+            self.wait_seconds = 0.0
+            self.throttled = 0
+            self.estimated_tokens = 0
+            self.actual_tokens = 0
+            self._waits = {
+                priority: deque(maxlen=self.window) for priority in PRIORITIES
+            }
+
+    def record_wait(self, seconds: float, estimated_tokens: int, priority: str):
+        with self._lock:
+            self.calls += 1
+            self.estimated_tokens += estimated_tokens
+            self._waits[priority].append(seconds)
+            # Uncontended acquisitions take well under a millisecond
+            if seconds >= 0.001:
+                self.queued_calls += 1
+                self.wait_seconds += seconds
+
+    def record_usage(self, tokens: int):
+        with self._lock:
+            self.actual_tokens += tokens
+
+    def record_throttled(self):
+        with self._lock:
+            self.throttled += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            by_priority = {}
+            for priority, recent in self._waits.items():
+                waits = sorted(recent)
+                by_priority[priority] = {
+                    "recent_calls": len(waits),
+                    "queue_wait_p50": _percentile(waits, 0.5),
+                    "queue_wait_p95": _percentile(waits, 0.95),
+                    "queue_wait_max": round(waits[-1], 3) if waits else 0.0,
+                }
+            return {
+                "calls": self.calls,
+                "queued_calls": self.queued_calls,
+                "queue_wait_seconds": round(self.wait_seconds, 3),
+                "by_priority": by_priority,
+                "throttled": self.throttled,
+                "estimated_tokens": self.estimated_tokens,
+                "actual_tokens": self.actual_tokens,
+            }
+
+
+def _percentile(values: list[float], q: float) -> float:
+    return round(values[int(q * (len(values) - 1))], 3) if values else 0.0
+
+
+rate_limit_stats = RateLimitStats()
+
+
+class TokenBucketLimiter:
+    """Requests-per-minute and tokens-per-minute token buckets.
+
+    With `store` set, the buckets live in a SQLite file so every process on the
+    machine draws from the same budget. Callers in one process are ordered by
+    `scheduler` (priority class, then weighted tenant share) instead of polling
+    the buckets concurrently.
+    """
+
+    def __init__(
+        self,
+        rpm: int = 0,
+        tpm: int = 0,
+        store: Optional[str] = None,
+        name: str = "default",
+        scheduler: Optional[FairScheduler] = None,
+    ):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.name = name
+        self.buckets = _SqliteBuckets(store) if store else _MemoryBuckets()
+        self.scheduler = scheduler or FairScheduler()
+
+    def _update(self, change) -> Any:
+        return self.buckets.update(self.name, self.rpm, self.tpm, change)
+
+    def _try_acquire(self, tokens: int) -> float:
+        return self._update(lambda state, now: _take(state, tokens, now))
+
+    def acquire(
+        self,
+        tokens: int,
+        tenant: str = DEFAULT_TENANT,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> Ticket:
+        """Block until a request of `tokens` may be sent; `release` the ticket after."""
+        ticket = self.scheduler.acquire(
+            tenant, priority, tokens, lambda: self._try_acquire(tokens)
+        )
+        rate_limit_stats.record_wait(ticket.waited, tokens, priority)
+        return ticket
+
+    async def aacquire(
+        self,
+        tokens: int,
+        tenant: str = DEFAULT_TENANT,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> Ticket:
+        ticket = await self.scheduler.aacquire(
+            tenant, priority, tokens, lambda: self._try_acquire(tokens)
+        )
+        rate_limit_stats.record_wait(ticket.waited, tokens, priority)
+        return ticket
+
+    def release(self, ticket: Ticket):
+        self.scheduler.release(ticket)
+
+    def reconcile(self, estimated: int, actual: int):
+        """Give back (or take) the difference between the estimate and the usage."""
+        rate_limit_stats.record_usage(actual)
+
+        def change(state: dict, now: float):
+            if state["tpm"]:
+                state["tokens"] = min(
+                    state["tpm"], state["tokens"] + estimated - actual
+                )
+
+        self._update(change)
+
+    def observe_headers(self, headers: dict):
+        """Adopt the provider's limits and remaining budget from response headers."""
+        headers = {key.lower(): value for key, value in headers.items()}
+
+        def number(key: str) -> Optional[float]:
+            try:
+                return float(headers[key])
+            except (KeyError, ValueError):
+                return None
+
+        limit_requests = number("x-ratelimit-limit-requests")
+        limit_tokens = number("x-ratelimit-limit-tokens")
+        remaining_requests = number("x-ratelimit-remaining-requests")
+        remaining_tokens = number("x-ratelimit-remaining-tokens")
+        if limit_requests is None and limit_tokens is None:
+            return
+
+        def change(state: dict, now: float):
+            # Configured limits are a ceiling, the provider may only lower them.
+            # Buckets without a limit so far start out full.
+            if limit_requests:
+                if not state["rpm"]:
+                    state["requests"] = limit_requests
+                state["rpm"] = min(self.rpm or limit_requests, limit_requests)
+            if limit_tokens:
+                if not state["tpm"]:
+                    state["tokens"] = limit_tokens
+                state["tpm"] = min(self.tpm or limit_tokens, limit_tokens)
+            if remaining_requests is not None and state["rpm"]:
+                state["requests"] = min(state["requests"], remaining_requests)
+            if remaining_tokens is not None and state["tpm"]:
+                state["tokens"] = min(state["tokens"], remaining_tokens)
+
+        self._update(change)
+
+    def pause(self, seconds: float):
+        """Hold every caller, in every process, for `seconds` after a 429."""
+        rate_limit_stats.record_throttled()
+
+        def change(state: dict, now: float):
+            state["paused_until"] = max(state["paused_until"], now + seconds)
+
+        self._update(change)
+
+
+rate_limiter = TokenBucketLimiter(
+    LLM_RPM,
+    LLM_TPM,
+    RATE_LIMIT_STORE,
+    scheduler=FairScheduler(TENANT_WEIGHTS, TENANT_MAX_IN_FLIGHT),
+)
+
+
+def _retry_after(error: Exception, attempt: int) -> float:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    for key in (
+        "retry-after",
+        "x-ratelimit-reset-tokens",
+        "x-ratelimit-reset-requests",
+    ):
+        seconds = parse_duration(headers.get(key))
+        if seconds:
+            return seconds
+    return min(2**attempt, 60)
+
+
+def _backoff(attempt: int) -> float:
+    # The OpenAI client's own schedule: 0.5s doubling up to 8s, with jitter
+    return min(0.5 * 2**attempt, 8.0) * (1 - 0.25 * random.random())
+
+
+def _retry_delay(error: Exception, retries: Counter) -> Optional[float]:
+    """Seconds to wait before retrying a failed call, or None to raise `error`.
+
+    A 429 pauses every caller through the limiter, so the retry only waits for
+    its turn there. Transient failures only back off the failing call.
+    """
+    if _is_rate_limit(error):
+        if retries["rate_limit"] >= LLM_RATE_LIMIT_RETRIES:
+            return None
+        rate_limiter.pause(_retry_after(error, retries["rate_limit"]))
+        retries["rate_limit"] += 1
+        return 0.0
+    if _is_transient(error) and retries["transient"] < LLM_TRANSIENT_RETRIES:
+        retries["transient"] += 1
+        return _backoff(retries["transient"] - 1)
+    return None
+
+
+class RateLimitedChatOpenAI(ChatOpenAI):
+    """`ChatOpenAI` whose calls go through the process-wide `rate_limiter`.
+
+    Each call waits for its estimated tokens before it is sent, the estimate is
+    reconciled with the reported usage afterwards, and the response's rate-limit
+    headers retune the buckets. A 429 pauses every caller for the retry-after
+    period and is retried up to LLM_RATE_LIMIT_RETRIES times; connection
+    errors, timeouts and 5xx responses are retried up to LLM_TRANSIENT_RETRIES
+    times after a backoff. Every retry goes through the buckets again.
+    """
+
+    include_response_headers: bool = True
+    # Failed calls are retried above; the client's own retries would resend
+    # the request without going through the buckets
+    max_retries: int = 0
+
+    def _acquire(self, estimated: int) -> Ticket:
+        return rate_limiter.acquire(estimated, *call_context(ensure_config()))
+
+    async def _aacquire(self, estimated: int) -> Ticket:
+        return await rate_limiter.aacquire(estimated, *call_context(ensure_config()))
+
+    def _estimate(self, messages: list[BaseMessage], kwargs: dict) -> int:
+        completion = kwargs.get("max_tokens") or self.max_tokens
+        return estimate_tokens(messages, completion or LLM_COMPLETION_TOKENS_ESTIMATE)
+
+    def _observe(self, estimated: int, generation_info: Optional[dict], usage: Any):
+        headers = (generation_info or {}).pop("headers", None)
+        if headers:
+            rate_limiter.observe_headers(headers)
+        if usage:
+            rate_limiter.reconcile(estimated, usage.get("total_tokens", estimated))
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.streaming:
+            # Rate limited in _stream
+            return super()._generate(messages, stop, run_manager, **kwargs)
+        estimated = self._estimate(messages, kwargs)
+        retries = Counter()
+        while True:
+            ticket = self._acquire(estimated)
+            try:
+                result = super()._generate(messages, stop, run_manager, **kwargs)
+                break
+            except Exception as e:
+                delay = _retry_delay(e, retries)
+                if delay is None:
+                    raise
+            finally:
+                rate_limiter.release(ticket)
+            time.sleep(delay)
+        for generation in result.generations:
+            self._observe(
+                estimated,
+                generation.generation_info,
+                getattr(generation.message, "usage_metadata", None),
+            )
+        return result
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.streaming:
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+        estimated = self._estimate(messages, kwargs)
+        retries = Counter()
+        while True:
+            ticket = await self._aacquire(estimated)
+            try:
+                result = await super()._agenerate(messages, stop, run_manager, **kwargs)
+                break
+            except Exception as e:
+                delay = _retry_delay(e, retries)
+                if delay is None:
+                    raise
+            finally:
+                rate_limiter.release(ticket)
+            await asyncio.sleep(delay)
+        for generation in result.generations:
+            self._observe(
+                estimated,
+                generation.generation_info,
+                getattr(generation.message, "usage_metadata", None),
+            )
+        return result
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        # Streams are not retried: chunks may already have been emitted
+        estimated = self._estimate(messages, kwargs)
+        ticket = self._acquire(estimated)
+        try:
+            for chunk in super()._stream(messages, stop, run_manager, **kwargs):
+                self._observe(
+                    estimated,
+                    chunk.generation_info,
+                    getattr(chunk.message, "usage_metadata", None),
+                )
+                yield chunk
+        except Exception as e:
+            if _is_rate_limit(e):
+                rate_limiter.pause(_retry_after(e, 0))
+            raise
+        finally:
+            rate_limiter.release(ticket)
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        estimated = self._estimate(messages, kwargs)
+        ticket = await self._aacquire(estimated)
+        try:
+            async for chunk in super()._astream(messages, stop, run_manager, **kwargs):
+                self._observe(
+                    estimated,
+                    chunk.generation_info,
+                    getattr(chunk.message, "usage_metadata", None),
+                )
+                yield chunk
+        except Exception as e:
+            if _is_rate_limit(e):
+                rate_limiter.pause(_retry_after(e, 0))
+            raise
+        finally:
+            rate_limiter.release(ticket)
+
+
+def _is_rate_limit(error: Exception) -> bool:
+    return RateLimitError is not None and isinstance(error, RateLimitError)
+
+
+def _is_transient(error: Exception) -> bool:
+    """Failures the OpenAI client retries itself, other than 429s."""
+    if APIConnectionError is None:
+        return False
+    if isinstance(error, APIConnectionError):
+        return True
+    return isinstance(error, APIStatusError) and (
+        error.status_code in (408, 409) or error.status_code >= 500
+    )
@@ -0,0 +1,371 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass, fields, replace
+from typing import Any, Callable, Mapping, Optional, Union
+
+import requests
+from langchain_core.runnables import RunnableConfig
+
+from agent_common.bm25 import keyword_search
+from agent_common.dify import DIFY_API_KEY, DIFY_BASE_URL
+from agent_common.vectors import vector_search
+
+# Reranking model used by profiles that enable reranking
+RETRIEVAL_RERANKING_PROVIDER = os.environ.get("RETRIEVAL_RERANKING_PROVIDER", "")
+RETRIEVAL_RERANKING_MODEL = os.environ.get("RETRIEVAL_RERANKING_MODEL", "")
+# JSON object of profiles to add or adjust, e.g. '{"precise": {"top_k": 2}}'
+RETRIEVAL_PROFILES = json.loads(os.environ.get("RETRIEVAL_PROFILES") or "{}")
+# Seconds to wait for a knowledge-base lookup; a timeout counts as an outage and
+# is answered from the local keyword index when one is available
+RETRIEVAL_TIMEOUT = float(os.environ.get("RETRIEVAL_TIMEOUT", "10"))
+# Seconds a lookup's latency counts toward the p95 that admission control reads
+RETRIEVAL_STATS_WINDOW = float(os.environ.get("RETRIEVAL_STATS_WINDOW", "60"))
+# Profile each agent uses unless a request picks one, e.g.
+# "prospecting_agent=recall,analytics_agent=aggregate"
+RETRIEVAL_AGENT_PROFILES = {
+    agent.strip(): profile.strip()
+    for agent, _, profile in (
+        item.partition("=")
+        for item in os.environ.get("RETRIEVAL_AGENT_PROFILES", "").split(",")
+        if item.strip()
+    )
+}
+
+
+class RetrievalStats:
+    """Latency of the last `window` Dify lookups within `seconds`.
+
+    Samples age out, so a p95 that made admission control reject runs (and with
+    them the lookups that would replace it) recovers once it is old.
+
+    Lookups are also tracked per retrieval profile and per source that answered
+    them (local keyword index, vector index or Dify): end-to-end latency, and how
+    many records and characters they return, which is what ends up in the prompt.
+    """
+
+    def __init__(self, window: int = 200, seconds: float = RETRIEVAL_STATS_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._seconds = seconds
+        # (monotonic time, latency) pairs
+        self._latencies: deque[tuple[float, float]] = deque(maxlen=window)
+        self._profiles: dict[str, dict] = {}
+        self.calls = 0
+        self.errors = 0
+
+    def _profile(self, name: str, source: str) -> dict:
+        return self._profiles.setdefault(name, {}).setdefault(
+            source,
+            {
+                "calls": 0,
+                "latencies": deque(maxlen=self._window),
+                "records": 0,
+                "chars": 0,
+            },
+        )
+
+    @contextmanager
+    def timed(self):
+        started = time.monotonic()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            now = time.monotonic()
+            elapsed = now - started
+            with self._lock:
+                self.calls += 1
+                self._latencies.append((now, elapsed))
+
+    def record_result(
+        self, profile: str, source: str, elapsed: float, records: int, chars: int
+    ):
+        with self._lock:
+            stats = self._profile(profile, source)
+            stats["calls"] += 1
+            stats["latencies"].append((time.monotonic(), elapsed))
+            stats["records"] += records
+            stats["chars"] += chars
+
+    def _recent(self, samples: deque) -> list[float]:
+        cutoff = time.monotonic() - self._seconds
+        while samples and samples[0][0] < cutoff:
+            samples.popleft()
+        return [latency for _, latency in samples]
+
+    def p95_ms(self) -> float:
+        with self._lock:
+            latencies = self._recent(self._latencies)
+        return _percentile_ms(latencies, 0.95)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            calls, errors = self.calls, self.errors
+            profiles = {}
+            for name, sources in self._profiles.items():
+                profiles[name] = {}
+                for source, stats in sources.items():
+                    latencies = self._recent(stats["latencies"])
+                    divisor = max(stats["calls"], 1)
+                    profiles[name][source] = {
+                        "calls": stats["calls"],
+                        "p50_ms": round(_percentile_ms(latencies, 0.5), 1),
+                        "p95_ms": round(_percentile_ms(latencies, 0.95), 1),
+                        "avg_records": round(stats["records"] / divisor, 2),
+                        "avg_chars": round(stats["chars"] / divisor),
+                    }
+        return {
+            "calls": calls,
+            "errors": errors,
+            "p95_ms": round(self.p95_ms(), 1),
+            "profiles": profiles,
+        }
+
+
+def _percentile_ms(latencies, q: float) -> float:
+    latencies = sorted(latencies)
+    if not latencies:
+        return 0.0
+    return latencies[int(q * (len(latencies) - 1))] * 1000
+
+
+retrieval_stats = RetrievalStats()
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split()).casefold()
+
+
+def flight_key(dataset_id: str, query: str, retrieval_model: dict) -> str:
+    """Identity of a retrieval: dataset, normalized query and search parameters."""
+    return json.dumps(
+        [dataset_id, normalize_query(query), retrieval_model], sort_keys=True
+    )
+
+
+class SingleFlight:
+    """Share one upstream call between concurrent callers asking for the same key.
+
+    The first caller for a key runs `fn`; callers arriving while it is in flight
+    wait for and receive the same result (or exception). Async tool execution
+    runs sync tools on executor threads, so it coalesces through the same path.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: dict[str, Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                follower = True
+            else:
+                flight = self._flights[key] = Future()
+                follower = False
+        if follower:
+            return flight.result()
+        try:
+            flight.set_result(fn())
+        except BaseException as e:
+            flight.set_exception(e)
+        finally:
+            with self._lock:
+                del self._flights[key]
+        return flight.result()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "upstream_calls": self.calls - self.coalesced,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._flights),
+            }
+
+
+retrieval_flight = SingleFlight()
+
+
+# Search methods a local vector index can stand in for
+VECTOR_SEARCH_METHODS = ("semantic_search", "hybrid_search")
+
+
+@dataclass(frozen=True)
+class RetrievalProfile:
+    """Knowledge-base search settings, turned into a Dify `retrieval_model`."""
+
+    search_method: str = (
+        "hybrid_search"  # keyword_search, semantic_search, full_text_search or hybrid_search
+    )
+    top_k: int = 3
+    weights: Optional[float] = 0.7  # semantic share of hybrid search
+    score_threshold: Optional[float] = None
+    reranking: bool = False
+    # Minimum cosine similarity of hits from a local vector index, whose scores
+    # are not on the scale of Dify's
+    vector_score_threshold: Optional[float] = None
+
+    def retrieval_model(self) -> dict:
+        if self.reranking and not RETRIEVAL_RERANKING_MODEL:
+            raise ValueError(
+                "Reranking profiles require RETRIEVAL_RERANKING_PROVIDER and "
+                "RETRIEVAL_RERANKING_MODEL"
+            )
+        return {
+            "search_method": self.search_method,
+            "reranking_enable": self.reranking,
+            "reranking_mode": "reranking_model" if self.reranking else None,
+            "reranking_model": {
+                "reranking_provider_name": (
+                    RETRIEVAL_RERANKING_PROVIDER if self.reranking else ""
+                ),
+                "reranking_model_name": (
+                    RETRIEVAL_RERANKING_MODEL if self.reranking else ""
+                ),
+            },
+            "weights": self.weights,
+            "top_k": self.top_k,
+            "score_threshold_enabled": self.score_threshold is not None,
+            "score_threshold": self.score_threshold,
+        }
+
+
+def _build_profiles(overrides: Mapping[str, Mapping[str, Any]]):
+    profiles = {
+        "default": RetrievalProfile(),
+        # Prospecting lists as many matching providers as it can
+        "recall": RetrievalProfile(top_k=10, weights=0.5),
+        # Lead qualification wants a few hits it can trust
+        "precise": RetrievalProfile(top_k=2, score_threshold=0.5),
+        # Analytics reads aggregate documents, which match on keywords better
+        "aggregate": RetrievalProfile(top_k=6, weights=0.3),
+    }
+    for name, settings in overrides.items():
+        profiles[name] = replace(profiles.get(name, profiles["default"]), **settings)
+    return profiles
+
+
+retrieval_profiles: dict[str, RetrievalProfile] = _build_profiles(RETRIEVAL_PROFILES)
+
+agent_profiles: dict[str, str] = {
+    "prospecting_agent": "recall",
+    "lead_qualification_agent": "precise",
+    "analytics_agent": "aggregate",
+    **RETRIEVAL_AGENT_PROFILES,
+}
+
+
+def resolve_profile(
+    agent: str, config: Optional[RunnableConfig] = None
+) -> tuple[str, RetrievalProfile]:
+    """The retrieval profile for a lookup made by `agent`, and its stats name.
+
+    A request picks a profile with {"configurable": {"retrieval_profile": ...}},
+    either by name or as a mapping of settings applied over the agent's profile.
+    """
+    name = agent_profiles.get(agent, "default")
+    requested: Union[str, Mapping, None] = (
+        (config or {}).get("configurable", {}).get("retrieval_profile")
+    )
+    if isinstance(requested, Mapping):
+        unknown = set(requested) - {field.name for field in fields(RetrievalProfile)}
+        if unknown:
+            raise ValueError(f"Unknown retrieval profile settings {sorted(unknown)}")
+        return f"{name}*", replace(retrieval_profiles[name], **requested)
+    if requested:
+        name = requested
+    if name not in retrieval_profiles:
+        raise ValueError(
+            f"Unknown retrieval profile {name!r}, expected one of "
+            f"{sorted(retrieval_profiles)}"
+        )
+    return name, retrieval_profiles[name]
+
+
+def retrieve(
+    agent: str, dataset_id: str, query: str, config: Optional[RunnableConfig] = None
+) -> str:
+    """Contents of the segments of knowledge base `dataset_id` matching `query`.
+
+    `agent` is the package name of the calling agent, which picks its retrieval
+    profile. Keyword lookups may be answered by the local keyword index and
+    semantic ones by a local vector index; the others go to Dify's /retrieve
+    endpoint. Identical concurrent lookups share one upstream request.
+    """
+    url = f"{DIFY_BASE_URL}/v1/datasets/{dataset_id}/retrieve"
+    headers = {
+        "Authorization": f"Bearer {DIFY_API_KEY}",
+        "Content-Type": "application/json",
+    }
+
+    profile_name, profile = resolve_profile(agent, config)
+    retrieval_model = profile.retrieval_model()
+
+    # Which index answered, for the per-profile stats; Dify results fused with
+    # local ones count as Dify's
+    source = "local"
+
+    def remote() -> list[dict]:
+        nonlocal source
+        # A local vector index, when one is built, stands in for Dify's
+        # semantic search; keyword and full-text profiles always ask Dify
+        if profile.search_method in VECTOR_SEARCH_METHODS:
+            segments = vector_search.search(
+                dataset_id, query, profile.top_k, profile.vector_score_threshold
+            )
+            if segments is not None:
+                source = "vector"
+                return segments
+        payload = {"query": query, "retrieval_model": retrieval_model}
+        with retrieval_stats.timed():
+            response = requests.post(
+                url, json=payload, headers=headers, timeout=RETRIEVAL_TIMEOUT
+            )
+        response.raise_for_status()
+        data = response.json()
+        source = "dify"
+        return [record.get("segment", {}) for record in data.get("records", [])]
+
+    def fetch() -> str:
+        started = time.monotonic()
+        # Keyword lookups may be answered by the local index, which also stands
+        # in for Dify while it is down
+        segments = keyword_search.retrieve(dataset_id, query, profile.top_k, remote)
+        contents = []
+        for segment in segments:
+            content = segment.get("content", "")
+            if content:
+                contents.append(content.strip())
+
+        result = "\n\n".join(contents)
+        retrieval_stats.record_result(
+            profile_name,
+            source,
+            time.monotonic() - started,
+            len(contents),
+            len(result),
+        )
+        return result
+
+    # Identical lookups from concurrent sessions share one upstream request
+    # The vector threshold is not part of Dify's retrieval model, but changes the
+    # results as well
+    key = flight_key(
+        dataset_id,
+        query,
+        {**retrieval_model, "vector_score_threshold": profile.vector_score_threshold},
+    )
+    return retrieval_flight.do(key, fetch)
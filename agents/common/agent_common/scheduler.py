@@ -0,0 +1,265 @@
+import asyncio
+import itertools
+import os
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from langchain_core.runnables import RunnableConfig
+
+# Priority classes, most urgent first. Runs pick theirs with
+# {"configurable": {"priority": "batch"}}; the default is interactive.
+PRIORITIES = ("interactive", "batch")
+DEFAULT_PRIORITY = "interactive"
+DEFAULT_TENANT = "default"
+
+# Relative shares of LLM capacity, e.g. "acme=3,globex=1"; unlisted tenants get 1
+TENANT_WEIGHTS = {
+    tenant.strip(): float(weight)
+    for tenant, _, weight in (
+        item.partition("=")
+        for item in os.environ.get("TENANT_WEIGHTS", "").split(",")
+        if item.strip()
+    )
+}
+# LLM calls a single tenant may have in flight at once; 0 for no cap
+TENANT_MAX_IN_FLIGHT = int(os.environ.get("TENANT_MAX_IN_FLIGHT", "0"))
+
+
+def call_context(config: Optional[RunnableConfig]) -> tuple[str, str]:
+    """Tenant id and priority class of a run, from its configurable values."""
+    configuration = (config or {}).get("configurable", {})
+    tenant = str(configuration.get("tenant_id") or DEFAULT_TENANT)
+    priority = configuration.get("priority") or DEFAULT_PRIORITY
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority {priority!r}, expected one of {PRIORITIES}")
+    return tenant, priority
+
+
+@dataclass
+class Ticket:
+    tenant: str
+    priority: str
+    cost: float
+    finish: float = 0.0
+    seq: int = -1
+    enqueued_at: float = field(default_factory=time.monotonic)
+    waited: float = 0.0
+    dispatched: bool = False
+    cancelled: bool = False
+    # Wakes an async waiter when the ticket may have become next
+    wake: Optional[Callable[[], None]] = field(default=None, repr=False)
+
+
+class FairScheduler:
+    """Orders calls waiting for a shared resource by priority, then tenant share.
+
+    Higher priority classes always go first. Within a class, tenants are served
+    by self-clocked weighted fair queueing: each call gets a virtual finish time
+    of `max(virtual clock, tenant's last finish) + cost / weight`, and the
+    waiting call with the earliest finish time is next. A tenant at its in-flight
+    cap is skipped until one of its calls is released.
+
+    Only the call at the head of the schedule asks the resource (`try_dispatch`)
+    whether it may go, one at a time and outside the scheduler's lock; while it
+    waits on the resource a more urgent arrival can overtake it.
+    """
+
+    def __init__(
+        self,
+        weights: Optional[dict[str, float]] = None,
+        max_in_flight: int = 0,
+    ):
+        self.weights = weights or {}
+        self.max_in_flight = max_in_flight
+        self._cond = threading.Condition()
+        self._waiting: dict[str, dict[str, deque[Ticket]]] = {
+            priority: {} for priority in PRIORITIES
+        }
+        # Virtual clocks are kept per priority class, so urgent traffic does not
+        # erase the shares batch tenants have earned
+        self._last_finish: dict[tuple[str, str], float] = {}
+        self._in_flight: Counter = Counter()
+        self._clock = {priority: 0.0 for priority in PRIORITIES}
+        self._retry_at = 0.0
+        # Set while a head ticket is asking the resource
+        self._checking = False
+        self._seq = itertools.count()
+
+    def _notify(self):
+        self._cond.notify_all()
+        head = self._head()
+        if head is not None and head.wake is not None:
+            head.wake()
+
+    def _enqueue(self, ticket: Ticket) -> Ticket:
+        if ticket.cancelled:
+            return ticket
+        priority, tenant = ticket.priority, ticket.tenant
+        start = max(self._clock[priority], self._last_finish.get((priority, tenant), 0))
+        ticket.finish = start + max(ticket.cost, 1.0) / self.weights.get(tenant, 1.0)
+        ticket.seq = next(self._seq)
+        self._last_finish[(priority, tenant)] = ticket.finish
+        self._waiting[priority].setdefault(tenant, deque()).append(ticket)
+        self._notify()
+        return ticket
+
+    def _head(self) -> Optional[Ticket]:
+        for priority in PRIORITIES:
+            heads = [
+                queue[0]
+                for tenant, queue in self._waiting[priority].items()
+                if not self.max_in_flight
+                or self._in_flight[tenant] < self.max_in_flight
+            ]
+            if heads:
+                return min(heads, key=lambda ticket: (ticket.finish, ticket.seq))
+        return None
+
+    def _remove(self, ticket: Ticket):
+        queues = self._waiting[ticket.priority]
+        if ticket in queues.get(ticket.tenant, ()):
+            queues[ticket.tenant].remove(ticket)
+            if not queues[ticket.tenant]:
+                del queues[ticket.tenant]
+
+    def _release_slot(self, tenant: str):
+        self._in_flight[tenant] -= 1
+        if not self._in_flight[tenant]:
+            del self._in_flight[tenant]
+
+    def _turn(self, ticket: Ticket) -> Optional[float]:
+        """0.0 if `ticket` may ask the resource now, else the wait (None: not next).
+
+        A 0.0 reserves the resource for the caller, which must then `_check`.
+        """
+        if self._checking or self._head() is not ticket:
+            return None
+        now = time.monotonic()
+        if self._retry_at > now:
+            return self._retry_at - now
+        self._checking = True
+        return 0.0
+
+    def _check(
+        self, ticket: Ticket, try_dispatch: Callable[[], float]
+    ) -> Optional[float]:
+        """Ask the resource for `ticket` outside the lock; 0.0 once it is dispatched.
+
+        The schedule is read again afterwards: whichever ticket is next then is
+        woken, whether or not this one went.
+        """
+        granted, wait = False, None
+        try:
+            wait = try_dispatch()
+            granted = not wait
+        finally:
+            with self._cond:
+                self._checking = False
+                now = time.monotonic()
+                if granted and not ticket.cancelled:
+                    self._remove(ticket)
+                    self._clock[ticket.priority] = max(
+                        self._clock[ticket.priority], ticket.finish
+                    )
+                    self._in_flight[ticket.tenant] += 1
+                    ticket.waited = now - ticket.enqueued_at
+                    ticket.dispatched = True
+                elif wait:
+                    self._retry_at = now + wait
+                self._notify()
+        return 0.0 if granted else wait
+
+    def _abandon(self, ticket: Ticket):
+        """Take a waiting call out of the schedule, or give back its slot."""
+        with self._cond:
+            ticket.cancelled = True
+            if ticket.dispatched:
+                self._release_slot(ticket.tenant)
+            else:
+                self._remove(ticket)
+            self._notify()
+
+    def acquire(
+        self,
+        tenant: str,
+        priority: str,
+        cost: float,
+        try_dispatch: Callable[[], float],
+    ) -> Ticket:
+        """Block until it is this call's turn and `try_dispatch` returns no wait."""
+        with self._cond:
+            ticket = self._enqueue(Ticket(tenant, priority, cost))
+        try:
+            while True:
+                with self._cond:
+                    while (wait := self._turn(ticket)) != 0.0:
+                        # Waits on the resource are capped so new arrivals get a
+                        # look in
+                        self._cond.wait(None if wait is None else min(wait, 1.0))
+                if self._check(ticket, try_dispatch) == 0.0:
+                    return ticket
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    def _locked(self, fn: Callable, *args):
+        with self._cond:
+            return fn(*args)
+
+    def _step(self, ticket: Ticket, try_dispatch: Callable[[], float]):
+        with self._cond:
+            wait = self._turn(ticket)
+        return self._check(ticket, try_dispatch) if wait == 0.0 else wait
+
+    async def aacquire(
+        self,
+        tenant: str,
+        priority: str,
+        cost: float,
+        try_dispatch: Callable[[], float],
+    ) -> Ticket:
+        # The loop never takes the scheduler's lock, which sync callers hold, nor
+        # runs `try_dispatch`, which may block on the shared SQLite buckets: both
+        # happen on worker threads. The waiter sleeps until it is woken as the
+        # next ticket or its wait on the resource is over.
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+        ticket = Ticket(
+            tenant, priority, cost, wake=lambda: loop.call_soon_threadsafe(woken.set)
+        )
+        try:
+            await asyncio.to_thread(self._locked, self._enqueue, ticket)
+            while True:
+                woken.clear()
+                wait = await asyncio.to_thread(self._step, ticket, try_dispatch)
+                if wait == 0.0:
+                    return ticket
+                try:
+                    await asyncio.wait_for(
+                        woken.wait(), None if wait is None else min(wait, 1.0)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            # Steps still running on their threads see the ticket cancelled
+            loop.run_in_executor(None, self._abandon, ticket)
+            raise
+
+    def release(self, ticket: Ticket):
+        """Mark a dispatched call as finished, freeing its tenant's in-flight slot."""
+        with self._cond:
+            self._release_slot(ticket.tenant)
+            self._notify()
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                "waiting": {
+                    priority: {tenant: len(queue) for tenant, queue in queues.items()}
+                    for priority, queues in self._waiting.items()
+                },
+                "in_flight": dict(self._in_flight),
+            }
@@ -0,0 +1,197 @@
+import threading
+from typing import Any, Optional
+
+import ormsgpack
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    ChatMessage,
+    FunctionMessage,
+    HumanMessage,
+    RemoveMessage,
+    SystemMessage,
+    ToolMessage,
+)
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# msgpack extension codes; 0-6 are used by JsonPlusSerializer
+EXT_MESSAGE = 16
+EXT_FALLBACK = 17
+
+# Stable wire codes: never renumber, only append
+MESSAGE_TYPES: list[type[BaseMessage]] = [
+    HumanMessage,
+    AIMessage,
+    ToolMessage,
+    SystemMessage,
+    RemoveMessage,
+    FunctionMessage,
+    ChatMessage,
+]
+MESSAGE_CODES = {cls: code for code, cls in enumerate(MESSAGE_TYPES)}
+
+OPTIONS = (
+    ormsgpack.OPT_NON_STR_KEYS
+    | ormsgpack.OPT_PASSTHROUGH_DATACLASS
+    | ormsgpack.OPT_PASSTHROUGH_DATETIME
+    | ormsgpack.OPT_PASSTHROUGH_ENUM
+    | ormsgpack.OPT_PASSTHROUGH_UUID
+)
+
+COMPRESSORS = ("zstd", "lz4")
+
+
+def _field_defaults(cls: type[BaseMessage]) -> dict[str, Any]:
+    defaults = {}
+    for name, field in cls.model_fields.items():
+        if name in ("content", "id") or field.is_required():
+            continue
+        defaults[name] = field.get_default(call_default_factory=True)
+    return defaults
+
+
+def _build_message(
+    cls: type[BaseMessage], content: Any, id: Optional[str], fields: dict
+) -> BaseMessage:
+    """Rebuild a message from trusted checkpoint data without validation.
+
+    Equivalent to `cls.model_construct(...)`, which is dominated by resolving
+    field defaults through `inspect` on every call.
+    """
+    values = {}
+    for name, default in MESSAGE_DEFAULTS[cls].items():
+        values[name] = default.copy() if isinstance(default, (dict, list)) else default
+    extra = {}
+    for name, value in fields.items():
+        if name in cls.model_fields:
+            values[name] = value
+        else:
+            extra[name] = value
+    values["content"] = content
+    values["id"] = id
+
+    message = cls.__new__(cls)
+    object.__setattr__(message, "__dict__", values)
+    object.__setattr__(message, "__pydantic_fields_set__", {"content", "id", *fields})
+    object.__setattr__(message, "__pydantic_extra__", extra)
+    object.__setattr__(message, "__pydantic_private__", None)
+    return message
+
+
+MESSAGE_DEFAULTS = {cls: _field_defaults(cls) for cls in MESSAGE_TYPES}
+
+
+class CompactSerializer(SerializerProtocol):
+    """Compact binary checkpoint serializer.
+
+    Messages, which dominate our checkpoints, are packed as msgpack extensions
+    holding a type code, the content, the id and only the fields that differ from
+    their defaults, and are rebuilt without re-running pydantic validation.
+    Everything else is delegated to `JsonPlusSerializer`, which is also used to
+    read checkpoints written before this serializer was enabled.
+
+    Payloads larger than `threshold` bytes are compressed with `compression`
+    ("zstd" needs `zstandard`, "lz4" needs `lz4`).
+    """
+
+    def __init__(
+        self,
+        compression: Optional[str] = None,
+        threshold: int = 4096,
+        level: Optional[int] = None,
+    ):
+        if compression not in (None, *COMPRESSORS):
+            raise ValueError(
+                f"Unknown compression {compression!r}, expected one of {COMPRESSORS}"
+            )
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("zstd compression requires the `zstandard` package")
+        if compression == "lz4" and lz4 is None:
+            raise ImportError("lz4 compression requires the `lz4` package")
+        self.compression = compression
+        self.threshold = threshold
+        self.level = level
+        self.fallback = JsonPlusSerializer()
+        # zstd contexts are not thread-safe and checkpoints are written from
+        # background threads
+        self._local = threading.local()
+
+    def _default(self, obj: Any) -> ormsgpack.Ext:
+        code = MESSAGE_CODES.get(type(obj))
+        if code is not None:
+            defaults = MESSAGE_DEFAULTS[type(obj)]
+            fields = {}
+            for name, value in obj.__dict__.items():
+                if name in ("content", "id", "type"):
+                    continue
+                if name not in defaults or value != defaults[name]:
+                    fields[name] = value
+            if obj.__pydantic_extra__:
+                fields.update(obj.__pydantic_extra__)
+            return ormsgpack.Ext(
+                EXT_MESSAGE, self._pack([code, obj.content, obj.id, fields])
+            )
+        return ormsgpack.Ext(EXT_FALLBACK, self._pack(self.fallback.dumps_typed(obj)))
+
+    def _ext_hook(self, code: int, data: bytes) -> Any:
+        if code == EXT_MESSAGE:
+            type_code, content, id, fields = self._unpack(data)
+            return _build_message(MESSAGE_TYPES[type_code], content, id, fields)
+        if code == EXT_FALLBACK:
+            return self.fallback.loads_typed(tuple(self._unpack(data)))
+        raise ValueError(f"Unknown msgpack extension code {code}")
+
+    def _pack(self, obj: Any) -> bytes:
+        return ormsgpack.packb(obj, default=self._default, option=OPTIONS)
+
+    def _unpack(self, data: bytes) -> Any:
+        return ormsgpack.unpackb(
+            data, ext_hook=self._ext_hook, option=ormsgpack.OPT_NON_STR_KEYS
+        )
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._pack(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return self._unpack(data)
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        if obj is None or isinstance(obj, (bytes, bytearray)):
+            return self.fallback.dumps_typed(obj)
+        data = self._pack(obj)
+        if self.compression is None or len(data) < self.threshold:
+            return "compact", data
+        if self.compression == "zstd":
+            if not hasattr(self._local, "compressor"):
+                self._local.compressor = zstandard.ZstdCompressor(level=self.level or 3)
+            return "compact+zstd", self._local.compressor.compress(data)
+        return "compact+lz4", lz4.frame.compress(
+            data, compression_level=self.level or 0
+        )
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, data_ = data
+        if type_ == "compact":
+            return self._unpack(data_)
+        if type_ == "compact+zstd":
+            if zstandard is None:
+                raise ImportError("Reading zstd checkpoints requires `zstandard`")
+            if not hasattr(self._local, "decompressor"):
+                self._local.decompressor = zstandard.ZstdDecompressor()
+            return self._unpack(self._local.decompressor.decompress(data_))
+        if type_ == "compact+lz4":
+            if lz4 is None:
+                raise ImportError("Reading lz4 checkpoints requires `lz4`")
+            return self._unpack(lz4.frame.decompress(data_))
+        return self.fallback.loads_typed(data)
@@ -0,0 +1,507 @@
+"""Incremental sync of Dify knowledge bases into the local indexes.
+
+Documents and segments are pulled page by page into a SQLite snapshot
+(KB_SYNC_DB) that keeps a content hash per segment, so each run only applies
+what changed:
+
+- documents whose metadata (name, word count, update time, status) is unchanged
+  are skipped without listing their segments, unless `--full` is given;
+- segments of the other documents are compared by content hash and inserted,
+  updated or deleted; documents that disappeared or were disabled lose theirs.
+
+Changed segments are also queued in the snapshot until the local keyword index
+(and the vector index, where one exists) has them: they are appended to the
+indexes, which are rebuilt from the snapshot once too many segments were
+replaced, re-embedding only content that is new. Indexes are rebuilt as well
+when their indexed version is unknown, and an update that failed is retried on
+the next run. Running processes pick the new indexes up on their next lookup.
+The dataset's synced version changes as well, which marks cached lead
+qualifications stale.
+
+    python -m agent_common.sync                  # CMS and NPI knowledge bases
+    python -m agent_common.sync <dataset_id> --every 3600
+
+Only DIFY_BASE_URL and DIFY_API_KEY are used, so a local Dify stand-in works the
+same as the real service.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import Iterator, Optional
+
+import numpy as np
+
+from agent_common import bm25, vectors
+from agent_common.dify import iter_documents, iter_segments
+
+KB_SYNC_DB = os.environ.get("KB_SYNC_DB", "kb_sync.sqlite")
+CMS_KNOWLEDGE_BASE_ID = os.environ.get("CMS_KNOWLEDGE_BASE_ID")
+NPI_KNOWLEDGE_BASE_ID = os.environ.get("NPI_KNOWLEDGE_BASE_ID")
+
+# Document fields that change whenever its segments are edited
+DOCUMENT_FIELDS = (
+    "name",
+    "word_count",
+    "tokens",
+    "updated_at",
+    "indexing_status",
+    "enabled",
+    "archived",
+)
+# Segments read from the snapshot per query while rebuilding indexes
+READ_BATCH_SIZE = 1000
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def document_fingerprint(document: dict) -> str:
+    return json.dumps([document.get(field) for field in DOCUMENT_FIELDS])
+
+
+@dataclass
+class SyncResult:
+    dataset_id: str
+    documents: int = 0
+    documents_skipped: int = 0
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.inserted or self.updated or self.deleted)
+
+
+class SnapshotStore:
+    """Local copy of knowledge-base segments in a SQLite file."""
+
+    def __init__(self, path: str = KB_SYNC_DB):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents (dataset_id TEXT, "
+            "document_id TEXT, position INTEGER, fingerprint TEXT, "
+            "PRIMARY KEY (dataset_id, document_id))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS segments (dataset_id TEXT, segment_id TEXT, "
+            "document_id TEXT, position INTEGER, content_hash TEXT, content TEXT, "
+            "PRIMARY KEY (dataset_id, segment_id))"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS segments_document "
+            "ON segments (dataset_id, document_id)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS datasets (dataset_id TEXT PRIMARY KEY, "
+            "version TEXT, synced_at REAL)"
+        )
+        # Version of the snapshot the local indexes were last brought up to
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(datasets)")]
+        if "indexed_version" not in columns:
+            conn.execute("ALTER TABLE datasets ADD COLUMN indexed_version TEXT")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (model TEXT, content_hash TEXT, "
+            "vector BLOB, PRIMARY KEY (model, content_hash))"
+        )
+        # Segments inserted, updated or deleted since the indexes were updated.
+        # A segment that changes again is queued anew under a higher seq, so
+        # the changes an update read can be dropped without losing later ones.
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(changes)")]
+        if columns and "seq" not in columns:
+            # Changes queued without a seq cannot be told apart: rebuild instead
+            conn.execute("DROP TABLE changes")
+            conn.execute("UPDATE datasets SET indexed_version = NULL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "dataset_id TEXT, segment_id TEXT, UNIQUE (dataset_id, segment_id))"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        if not hasattr(self._local, "conn"):
+            self._local.conn = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None
+            )
+            self._local.conn.execute("PRAGMA journal_mode=WAL")
+        return self._local.conn
+
+    def version(self, dataset_id: str) -> Optional[str]:
+        row = (
+            self._connect()
+            .execute("SELECT version FROM datasets WHERE dataset_id = ?", (dataset_id,))
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def indexed_version(self, dataset_id: str) -> Optional[str]:
+        row = (
+            self._connect()
+            .execute(
+                "SELECT indexed_version FROM datasets WHERE dataset_id = ?",
+                (dataset_id,),
+            )
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def sync(self, dataset_id: str, full: bool = False) -> SyncResult:
+        """Apply the changes of a Dify knowledge base to the snapshot."""
+        conn = self._connect()
+        result = SyncResult(dataset_id)
+        fingerprints = dict(
+            conn.execute(
+                "SELECT document_id, fingerprint FROM documents WHERE dataset_id = ?",
+                (dataset_id,),
+            )
+        )
+        seen = set()
+        for position, document in enumerate(iter_documents(dataset_id)):
+            if document.get("enabled") is False or document.get("archived"):
+                continue
+            document_id = document["id"]
+            seen.add(document_id)
+            result.documents += 1
+            fingerprint = document_fingerprint(document)
+            if not full and fingerprints.get(document_id) == fingerprint:
+                result.documents_skipped += 1
+                continue
+            self._sync_document(dataset_id, document_id, result)
+            conn.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)",
+                (dataset_id, document_id, position, fingerprint),
+            )
+
+        for document_id in set(fingerprints) - seen:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO changes (dataset_id, segment_id) "
+                "SELECT dataset_id, segment_id "
+                "FROM segments WHERE dataset_id = ? AND document_id = ?",
+                (dataset_id, document_id),
+            )
+            result.deleted += conn.execute(
+                "DELETE FROM segments WHERE dataset_id = ? AND document_id = ?",
+                (dataset_id, document_id),
+            ).rowcount
+            conn.execute(
+                "DELETE FROM documents WHERE dataset_id = ? AND document_id = ?",
+                (dataset_id, document_id),
+            )
+            conn.execute("COMMIT")
+
+        version = self.version(dataset_id)
+        if result.changed or version is None:
+            version = uuid.uuid4().hex[:16]
+        conn.execute(
+            "INSERT INTO datasets (dataset_id, version, synced_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (dataset_id) DO UPDATE "
+            "SET version = excluded.version, synced_at = excluded.synced_at",
+            (dataset_id, version, time.time()),
+        )
+        return result
+
+    def _sync_document(self, dataset_id: str, document_id: str, result: SyncResult):
+        conn = self._connect()
+        # Only one document's hashes are held at a time
+        hashes = dict(
+            conn.execute(
+                "SELECT segment_id, content_hash FROM segments "
+                "WHERE dataset_id = ? AND document_id = ?",
+                (dataset_id, document_id),
+            )
+        )
+        seen = set()
+        page = []
+
+        def write():
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?, ?, ?)", page
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO changes (dataset_id, segment_id) VALUES (?, ?)",
+                [(dataset_id, row[1]) for row in page],
+            )
+            conn.execute("COMMIT")
+            page.clear()
+
+        for segment in iter_segments(dataset_id, document_id):
+            segment_id = segment["id"]
+            content = segment.get("content") or ""
+            digest = content_hash(content)
+            position = segment.get("position", len(seen))
+            seen.add(segment_id)
+            previous = hashes.get(segment_id)
+            if previous == digest:
+                continue
+            if previous is None:
+                result.inserted += 1
+            else:
+                result.updated += 1
+            page.append(
+                (dataset_id, segment_id, document_id, position, digest, content)
+            )
+            if len(page) >= READ_BATCH_SIZE:
+                write()
+        if page:
+            write()
+
+        removed = [(dataset_id, s) for s in set(hashes) - seen]
+        if removed:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "DELETE FROM segments WHERE dataset_id = ? AND segment_id = ?", removed
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO changes (dataset_id, segment_id) VALUES (?, ?)",
+                removed,
+            )
+            conn.execute("COMMIT")
+            result.deleted += len(removed)
+
+    def iter_segments(self, dataset_id: str) -> Iterator[dict]:
+        """Snapshot segments in document order, streamed from the database."""
+        cursor = self._connect().execute(
+            "SELECT s.segment_id, s.content FROM segments s JOIN documents d "
+            "ON s.dataset_id = d.dataset_id AND s.document_id = d.document_id "
+            "WHERE s.dataset_id = ? ORDER BY d.position, s.position",
+            (dataset_id,),
+        )
+        while rows := cursor.fetchmany(READ_BATCH_SIZE):
+            for segment_id, content in rows:
+                yield {"id": segment_id, "content": content}
+
+    def last_change(self, dataset_id: str) -> int:
+        """Seq of the latest queued change of `dataset_id`, 0 if there is none."""
+        row = (
+            self._connect()
+            .execute("SELECT MAX(seq) FROM changes WHERE dataset_id = ?", (dataset_id,))
+            .fetchone()
+        )
+        return row[0] or 0
+
+    def pending_changes(
+        self, dataset_id: str, up_to: int
+    ) -> tuple[list[dict], list[str]]:
+        """Segments changed since the indexes were updated, and deleted segment ids.
+
+        Only changes queued up to seq `up_to` are returned.
+        """
+        conn = self._connect()
+        changed = [
+            {"id": segment_id, "content": content}
+            for segment_id, content in conn.execute(
+                "SELECT s.segment_id, s.content FROM changes c JOIN segments s "
+                "ON c.dataset_id = s.dataset_id AND c.segment_id = s.segment_id "
+                "WHERE c.dataset_id = ? AND c.seq <= ?",
+                (dataset_id, up_to),
+            )
+        ]
+        removed = [
+            segment_id
+            for (segment_id,) in conn.execute(
+                "SELECT c.segment_id FROM changes c LEFT JOIN segments s "
+                "ON c.dataset_id = s.dataset_id AND c.segment_id = s.segment_id "
+                "WHERE c.dataset_id = ? AND c.seq <= ? AND s.segment_id IS NULL",
+                (dataset_id, up_to),
+            )
+        ]
+        return changed, removed
+
+    def mark_indexed(self, dataset_id: str, version: str, up_to: int):
+        """Record that the indexes have `version` and every change up to seq `up_to`."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM changes WHERE dataset_id = ? AND seq <= ?",
+                (dataset_id, up_to),
+            )
+            conn.execute(
+                "UPDATE datasets SET indexed_version = ? WHERE dataset_id = ?",
+                (version, dataset_id),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def cached_embedder(self, model: str) -> vectors.Embed:
+        """Embeds texts with `model`, reusing the stored vectors of known texts."""
+        conn = self._connect()
+
+        def embed(texts: list[str]) -> np.ndarray:
+            digests = [content_hash(text) for text in texts]
+            known = {
+                digest: np.frombuffer(vector, dtype=np.float32)
+                for digest, vector in conn.execute(
+                    "SELECT content_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND content_hash IN ({', '.join('?' * len(digests))})",
+                    [model, *digests],
+                )
+            }
+            missing = [i for i, digest in enumerate(digests) if digest not in known]
+            if missing:
+                fresh = np.asarray(
+                    vectors.embedder(model)([texts[i] for i in missing]), np.float32
+                )
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                    [
+                        (model, digests[i], vector.tobytes())
+                        for i, vector in zip(missing, fresh)
+                    ],
+                )
+                conn.execute("COMMIT")
+                known.update((digests[i], v) for i, v in zip(missing, fresh))
+            return np.stack([known[digest] for digest in digests])
+
+        return embed
+
+    def prune_embeddings(self):
+        """Drop stored vectors of content no longer in any snapshot."""
+        self._connect().execute(
+            "DELETE FROM embeddings WHERE content_hash NOT IN "
+            "(SELECT content_hash FROM segments)"
+        )
+
+
+def update_indexes(
+    store: SnapshotStore,
+    dataset_id: str,
+    up_to: int,
+    keyword_dir: str = bm25.KB_INDEX_DIR,
+    vector_dir: str = vectors.VECTOR_INDEX_DIR,
+):
+    """Apply the snapshot's changes up to seq `up_to` to the indexes of `dataset_id`.
+
+    Changes are appended to the indexes; once either has too many replaced
+    segments or appended parts, both are rebuilt instead.
+    """
+    segments, removed = store.pending_changes(dataset_id, up_to)
+    keyword = bm25.update(
+        os.path.join(keyword_dir, dataset_id), segments, removed, bm25.build
+    )
+    path = os.path.join(vector_dir, dataset_id)
+    vector = None
+    if bm25.index_version(path) is not None:
+        previous = vectors.VectorIndex(path)
+        model = previous.meta["model"]
+        vector = bm25.update(
+            path,
+            segments,
+            removed,
+            lambda segments, out_dir: vectors.build(
+                segments,
+                out_dir,
+                model,
+                embed=store.cached_embedder(model),
+                centroids=np.asarray(previous.centroids),
+            ),
+        )
+    if keyword.needs_compaction() or (vector and vector.needs_compaction()):
+        rebuild_indexes(store, dataset_id, keyword_dir, vector_dir)
+
+
+def rebuild_indexes(
+    store: SnapshotStore,
+    dataset_id: str,
+    keyword_dir: str = bm25.KB_INDEX_DIR,
+    vector_dir: str = vectors.VECTOR_INDEX_DIR,
+    retrain: bool = False,
+):
+    """Rebuild the local indexes of `dataset_id` from the snapshot."""
+    count = bm25.build(
+        store.iter_segments(dataset_id), os.path.join(keyword_dir, dataset_id)
+    )
+    path = os.path.join(vector_dir, dataset_id)
+    # Vector indexes are opt-in: only one built before is kept up to date
+    if not count or bm25.index_version(path) is None:
+        return
+    previous = vectors.VectorIndex(path)
+    model = previous.meta["model"]
+    vectors.build(
+        store.iter_segments(dataset_id),
+        path,
+        model,
+        lists=previous.meta["lists"],
+        embed=store.cached_embedder(model),
+        centroids=None if retrain else np.asarray(previous.centroids),
+    )
+    store.prune_embeddings()
+
+
+_store: Optional[SnapshotStore] = None
+
+
+def synced_version(dataset_id: str) -> Optional[str]:
+    """Version of the last synced content of `dataset_id`, if it is synced."""
+    global _store
+    if not os.path.exists(KB_SYNC_DB):
+        return None
+    if _store is None:
+        _store = SnapshotStore()
+    return _store.version(dataset_id)
+
+
+def sync(dataset_ids: list[str], full: bool = False) -> list[SyncResult]:
+    store = SnapshotStore()
+    results = []
+    for dataset_id in dataset_ids:
+        result = store.sync(dataset_id, full)
+        version = store.version(dataset_id)
+        indexed = store.indexed_version(dataset_id)
+        # Only changes queued so far are applied and dropped; ones another sync
+        # queues meanwhile are left for the next run
+        applied = store.last_change(dataset_id)
+        keyword_index = os.path.join(bm25.KB_INDEX_DIR, dataset_id)
+        # Pending changes stay queued until the indexes have them, so a failed
+        # update is applied again on the next run
+        if full or indexed is None or bm25.index_version(keyword_index) is None:
+            rebuild_indexes(store, dataset_id, retrain=full)
+            store.mark_indexed(dataset_id, version, applied)
+        elif indexed != version:
+            update_indexes(store, dataset_id, applied)
+            store.mark_indexed(dataset_id, version, applied)
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sync Dify knowledge bases into the local indexes."
+    )
+    parser.add_argument(
+        "dataset_ids",
+        nargs="*",
+        help="Defaults to CMS_KNOWLEDGE_BASE_ID and NPI_KNOWLEDGE_BASE_ID",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Compare every segment and retrain the vector index",
+    )
+    parser.add_argument("--every", type=float, help="Sync again every N seconds")
+    args = parser.parse_args()
+    dataset_ids = args.dataset_ids or [
+        dataset_id
+        for dataset_id in (CMS_KNOWLEDGE_BASE_ID, NPI_KNOWLEDGE_BASE_ID)
+        if dataset_id
+    ]
+    while True:
+        for result in sync(dataset_ids, args.full):
+            print(json.dumps(asdict(result)), flush=True)
+        if not args.every:
+            break
+        time.sleep(args.every)
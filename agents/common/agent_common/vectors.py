@@ -0,0 +1,444 @@
+"""Local approximate-nearest-neighbour index over knowledge-base snapshots.
+
+Segments of a knowledge base are embedded offline and stored in an IVF index:
+k-means centroids partition the vectors into lists, and a query only scores
+the vectors of the `nprobe` lists whose centroids are closest to it. Vectors
+are stored as float16, grouped by list, and memory-mapped, so an index of a
+million segments costs a few hundred megabytes of page cache and no load time.
+
+When an index exists for a knowledge base, `npi_lookup`/`cms_lookup` use it in
+place of Dify's semantic search. Segments come from the local keyword snapshot
+(see agent_common.bm25) when one exists, otherwise from Dify:
+
+    python -m agent_common.vectors build <dataset_id> [--lists 1024]
+    python -m agent_common.vectors bench <dataset_id> --queries queries.txt
+
+`bench` reports recall@k against exact search and latency for each nprobe over
+real queries (indexed segments would find themselves in whichever list they
+were assigned to), to choose the number of lists and VECTOR_NPROBE.
+
+Layout of an index directory (VECTOR_INDEX_DIR/<dataset_id>):
+
+- content.bin, content_offsets.npy, segment_ids.txt: the segments, in order
+- centroids.npy (float32) and list_offsets.npy, slicing the lists
+- vectors.npy (float16, normalized, grouped by list) and docs.npy, the
+  segment of each vector
+- meta.json: embedding model, dimensions, segment and list counts
+
+Updates append parts assigned to the same centroids, with tombstones for the
+segments they replace, as described in agent_common.bm25.
+"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+from agent_common.bm25 import (
+    KB_INDEX_DIR,
+    KeywordIndex,
+    SegmentIndex,
+    index_version,
+    replace_dir,
+)
+from agent_common.dify import iter_dataset_segments
+
+VECTOR_INDEX_DIR = os.environ.get("VECTOR_INDEX_DIR", "vector_index")
+# sentence-transformers model name, or "openai:<model>" for OpenAI embeddings
+VECTOR_EMBEDDING_MODEL = os.environ.get(
+    "VECTOR_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
+)
+# Lists scanned per query; more lists trade latency for recall
+VECTOR_NPROBE = int(os.environ.get("VECTOR_NPROBE", "16"))
+
+EMBEDDING_BATCH_SIZE = 256
+KMEANS_ITERATIONS = 12
+# Vectors sampled per list to train the centroids
+KMEANS_SAMPLE_PER_LIST = 64
+ASSIGN_BATCH_SIZE = 8192
+# Seconds an embedding model that failed to load is not tried again
+EMBEDDER_RETRY_SECONDS = 60
+
+Embed = Callable[[list[str]], np.ndarray]
+
+_embedders: dict[str, Embed] = {}
+# Model -> (monotonic time to retry at, the error loading it raised)
+_embedder_failures: dict[str, tuple[float, Exception]] = {}
+_embedders_lock = threading.Lock()
+
+
+def embedder(model: str = VECTOR_EMBEDDING_MODEL) -> Embed:
+    """A function embedding texts with `model`, loaded once per process.
+
+    A model that fails to load raises the same error without another attempt for
+    EMBEDDER_RETRY_SECONDS, so lookups fall back to Dify without paying for it.
+    """
+    with _embedders_lock:
+        if model not in _embedders:
+            retry_at, error = _embedder_failures.get(model, (0.0, None))
+            if time.monotonic() < retry_at:
+                raise error
+            try:
+                _embedders[model] = _load_embedder(model)
+            except Exception as e:
+                _embedder_failures[model] = (
+                    time.monotonic() + EMBEDDER_RETRY_SECONDS,
+                    e,
+                )
+                raise
+            _embedder_failures.pop(model, None)
+        return _embedders[model]
+
+
+def _load_embedder(model: str) -> Embed:
+    if model.startswith("openai:"):
+        from langchain_openai import OpenAIEmbeddings
+
+        embeddings = OpenAIEmbeddings(model=model.split(":", 1)[1])
+        return lambda texts: np.asarray(
+            embeddings.embed_documents(texts), dtype=np.float32
+        )
+    if SentenceTransformer is None:
+        raise ImportError(
+            "Local embedding models require the `sentence-transformers` package"
+        )
+    encoder = SentenceTransformer(model)
+    return lambda texts: encoder.encode(texts, convert_to_numpy=True).astype(np.float32)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """The closest centroid of each vector, in batches to bound memory."""
+    return np.concatenate(
+        [
+            np.argmax(
+                np.asarray(vectors[start : start + ASSIGN_BATCH_SIZE], np.float32)
+                @ centroids.T,
+                axis=1,
+            )
+            for start in range(0, len(vectors), ASSIGN_BATCH_SIZE)
+        ]
+    )
+
+
+def _train(vectors: np.ndarray, lists: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means centroids of a sample of `vectors`."""
+    rng = np.random.default_rng(seed)
+    size = min(len(vectors), lists * KMEANS_SAMPLE_PER_LIST)
+    sample = np.asarray(
+        vectors[np.sort(rng.choice(len(vectors), size, replace=False))], np.float32
+    )
+    centroids = sample[rng.choice(size, lists, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = np.bincount(assignment, minlength=lists) == 0
+        # Empty lists restart from random sample vectors
+        sums[empty] = sample[rng.choice(size, int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def build(
+    segments: Iterable[dict],
+    out_dir: str,
+    model: str = VECTOR_EMBEDDING_MODEL,
+    lists: Optional[int] = None,
+    embed: Optional[Embed] = None,
+    centroids: Optional[np.ndarray] = None,
+) -> int:
+    """Embed `segments` (dicts with `id` and `content`) and index them in `out_dir`.
+
+    `lists` defaults to about 4 * sqrt(segments). Passing the `centroids` of an
+    earlier build skips training them again. As with the keyword index, the new
+    index replaces the old one only once complete.
+    """
+    embed = embed or embedder(model)
+    tmp_dir = f"{out_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    offsets = [0]
+    count = dimensions = 0
+    # Embeddings are spooled to disk so memory stays bounded by one batch
+    with tempfile.TemporaryFile(dir=tmp_dir) as spool:
+        with open(os.path.join(tmp_dir, "content.bin"), "wb") as contents, open(
+            os.path.join(tmp_dir, "segment_ids.txt"), "w"
+        ) as ids:
+            batch: list[str] = []
+
+            def flush():
+                nonlocal dimensions
+                vectors = _normalize(np.asarray(embed(batch), np.float32))
+                dimensions = vectors.shape[1]
+                spool.write(vectors.astype(np.float32).tobytes())
+                batch.clear()
+
+            for segment in segments:
+                content = segment.get("content") or ""
+                encoded = content.encode()
+                contents.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+                ids.write(f"{segment.get('id', '')}\n")
+                batch.append(content)
+                count += 1
+                if len(batch) == EMBEDDING_BATCH_SIZE:
+                    flush()
+            if batch:
+                flush()
+        if not count:
+            raise ValueError("No segments to index")
+        spool.flush()
+        vectors = np.memmap(
+            spool, dtype=np.float32, mode="r", shape=(count, dimensions)
+        )
+
+        if centroids is None:
+            lists = max(1, min(lists or round(4 * math.sqrt(count)), count))
+            centroids = _train(vectors, lists)
+        lists = len(centroids)
+        assignment = _assign(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        grouped = np.lib.format.open_memmap(
+            os.path.join(tmp_dir, "vectors.npy"),
+            mode="w+",
+            dtype=np.float16,
+            shape=(count, dimensions),
+        )
+        for start in range(0, count, ASSIGN_BATCH_SIZE):
+            rows = order[start : start + ASSIGN_BATCH_SIZE]
+            grouped[start : start + len(rows)] = vectors[rows]
+        grouped.flush()
+        del grouped, vectors
+
+    np.save(os.path.join(tmp_dir, "docs.npy"), order.astype(np.int32))
+    np.save(os.path.join(tmp_dir, "centroids.npy"), centroids)
+    np.save(
+        os.path.join(tmp_dir, "list_offsets.npy"),
+        np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=lists))]),
+    )
+    np.save(os.path.join(tmp_dir, "content_offsets.npy"), np.asarray(offsets))
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(
+            {
+                "model": model,
+                "dimensions": dimensions,
+                "segments": count,
+                "lists": lists,
+                "built_at": time.time(),
+            },
+            f,
+        )
+
+    replace_dir(tmp_dir, out_dir)
+    return count
+
+
+class VectorIndex(SegmentIndex):
+    """Memory-mapped IVF index built by `build`, with the parts of `update`.
+
+    Appended parts are built with the centroids of the index, so a list has a
+    slice in every part.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+
+        def load(name: str) -> list[np.ndarray]:
+            return [
+                np.load(os.path.join(part, f"{name}.npy"), mmap_mode="r")
+                for part in self.part_dirs
+            ]
+
+        self.vectors = load("vectors")
+        self.docs = load("docs")
+        self.list_offsets = load("list_offsets")
+        # Centroids are scored on every query, so they live in memory
+        self.centroids = np.load(os.path.join(path, "centroids.npy"))
+
+    def _top(
+        self, docs: list[np.ndarray], scores: list[np.ndarray], top_k: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        if not docs:
+            return np.zeros(0, np.int64), np.zeros(0, np.float32)
+        docs, scores = np.concatenate(docs), np.concatenate(scores)
+        live = self.alive[docs]
+        docs, scores = docs[live], scores[live]
+        if not len(docs):
+            return docs, scores
+        top = np.argpartition(-scores, min(top_k, len(scores)) - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return docs[top], scores[top]
+
+    def search(
+        self, query: np.ndarray, top_k: int, nprobe: int = VECTOR_NPROBE
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Segments closest to the normalized `query` vector, and their scores."""
+        nprobe = min(nprobe, len(self.centroids))
+        probed = np.sort(
+            np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        )
+        docs, scores = [], []
+        for start, vectors, part_docs, offsets in zip(
+            self.starts, self.vectors, self.docs, self.list_offsets
+        ):
+            # Probed lists are scored as contiguous slices of the memory map
+            for i in probed:
+                begin, end = offsets[i], offsets[i + 1]
+                if begin < end:
+                    docs.append(start + part_docs[begin:end])
+                    scores.append(np.asarray(vectors[begin:end], np.float32) @ query)
+        return self._top(docs, scores, top_k)
+
+    def exact_search(self, query: np.ndarray, top_k: int) -> np.ndarray:
+        docs, scores = [], []
+        for start, vectors, part_docs in zip(self.starts, self.vectors, self.docs):
+            for begin in range(0, len(vectors), ASSIGN_BATCH_SIZE):
+                end = begin + ASSIGN_BATCH_SIZE
+                docs.append(start + part_docs[begin:end])
+                scores.append(np.asarray(vectors[begin:end], np.float32) @ query)
+        return self._top(docs, scores, top_k)[0]
+
+
+class VectorSearch:
+    """Serves semantic lookups from local vector indexes where they exist."""
+
+    def __init__(self, directory: str = VECTOR_INDEX_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._indexes: dict[str, Optional[VectorIndex]] = {}
+        self._versions: dict[str, Optional[int]] = {}
+        self.searches = 0
+        self.errors = 0
+
+    def index(self, dataset_id: str) -> Optional[VectorIndex]:
+        if not dataset_id:
+            return None
+        path = os.path.join(self.directory, dataset_id)
+        version = index_version(path)
+        with self._lock:
+            if self._versions.get(dataset_id, -1) != version:
+                index = VectorIndex(path) if version is not None else None
+                self._indexes[dataset_id] = index
+                self._versions[dataset_id] = version
+            return self._indexes[dataset_id]
+
+    def search(
+        self,
+        dataset_id: str,
+        query: str,
+        top_k: int,
+        score_threshold: Optional[float] = None,
+    ) -> Optional[list[dict]]:
+        """Up to `top_k` segments, or None when Dify has to answer instead."""
+        index = self.index(dataset_id)
+        if index is None:
+            return None
+        try:
+            vector = _normalize(embedder(index.meta["model"])([query])[0])
+        except Exception:
+            # The embedding model is unavailable; Dify can still answer
+            self.errors += 1
+            return None
+        self.searches += 1
+        docs, scores = index.search(vector, top_k)
+        return [
+            index.segment(int(doc))
+            for doc, score in zip(docs, scores)
+            if score_threshold is None or score >= score_threshold
+        ]
+
+    def snapshot(self) -> dict:
+        return {
+            "indexes": {
+                dataset_id: len(index)
+                for dataset_id, index in self._indexes.items()
+                if index is not None
+            },
+            "searches": self.searches,
+            "errors": self.errors,
+        }
+
+
+vector_search = VectorSearch()
+
+
+def benchmark(
+    index: VectorIndex,
+    queries: np.ndarray,
+    nprobes: list[int],
+    top_k: int = 10,
+) -> list[dict]:
+    """Recall@k against exact search and latency of each nprobe over `queries`."""
+    exact = [set(index.exact_search(query, top_k).tolist()) for query in queries]
+    results = []
+    for nprobe in nprobes:
+        latencies, recalls = [], []
+        for query, truth in zip(queries, exact):
+            started = time.perf_counter()
+            docs, _ = index.search(query, top_k, nprobe)
+            latencies.append(time.perf_counter() - started)
+            recalls.append(len(truth & set(docs.tolist())) / len(truth))
+        latencies.sort()
+        results.append(
+            {
+                "nprobe": nprobe,
+                f"recall@{top_k}": float(np.mean(recalls)),
+                "p50_ms": latencies[len(latencies) // 2] * 1000,
+                "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+            }
+        )
+    return results
+
+
+def _segments(dataset_id: str) -> Iterable[dict]:
+    snapshot = os.path.join(KB_INDEX_DIR, dataset_id)
+    if os.path.exists(os.path.join(snapshot, "meta.json")):
+        return KeywordIndex(snapshot).segments()
+    return (
+        {"id": segment.get("id", ""), "content": segment.get("content", "")}
+        for _, segment in iter_dataset_segments(dataset_id)
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage local vector indexes.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="Embed and index a knowledge base")
+    build_parser.add_argument("dataset_id")
+    build_parser.add_argument("--model", default=VECTOR_EMBEDDING_MODEL)
+    build_parser.add_argument("--lists", type=int)
+    bench = commands.add_parser("bench", help="Measure recall and latency")
+    bench.add_argument("dataset_id")
+    bench.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    bench.add_argument("--k", type=int, default=10)
+    bench.add_argument("--queries", required=True, help="File of queries, one per line")
+    args = parser.parse_args()
+    path = os.path.join(VECTOR_INDEX_DIR, args.dataset_id)
+    if args.command == "build":
+        count = build(_segments(args.dataset_id), path, args.model, args.lists)
+        print(f"Indexed {count} segments of {args.dataset_id}")
+    else:
+        index = VectorIndex(path)
+        with open(args.queries) as f:
+            texts = [line.strip() for line in f if line.strip()]
+        queries = _normalize(embedder(index.meta["model"])(texts))
+        print(f"{len(index)} segments, {index.meta['lists']} lists")
+        for result in benchmark(index, queries, args.nprobe, args.k):
+            print("  ".join(f"{key}={value:.3g}" for key, value in result.items()))
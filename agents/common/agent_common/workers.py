@@ -0,0 +1,358 @@
+import importlib
+import itertools
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from multiprocessing.connection import Connection, wait
+from typing import Any, Optional
+
+from langchain_core.runnables import RunnableConfig
+
+from agent_common import blobs, checkpoint
+from agent_common.admission import AdmissionController, AdmittedGraph, Load, local_load
+from agent_common.scheduler import call_context
+
+# Number of worker processes and graph runs each of them executes at once
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES") or os.cpu_count() or 1)
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", "8"))
+# Seconds between checks that the worker processes are still running
+HEALTH_CHECK_INTERVAL = 0.5
+# Seconds a worker's reported load counts toward admission. Workers only report
+# with results, so one that has had no run since is taken as idle rather than
+# keeping new runs rejected on a stale reading.
+LOAD_MAX_AGE = 5.0
+
+
+class WorkerCrashedError(RuntimeError):
+    """The worker running a request exited before answering it."""
+
+
+def load_graph(spec: str):
+    """Import a graph from a `langgraph.json` style "module:attribute" spec.
+
+    File paths such as "./agents/analytics/analytics_agent/graph.py:graph" are
+    accepted too and resolve to the package module, which must be installed.
+    Graphs served under admission control are returned without it: the pool
+    admits runs before they reach a worker, and job workers bound their own.
+    """
+    module_name, _, attribute = spec.partition(":")
+    if module_name.endswith(".py"):
+        parts = module_name[: -len(".py")].replace(os.sep, "/").split("/")
+        module_name = ".".join(parts[-2:])
+    graph = getattr(importlib.import_module(module_name), attribute or "graph")
+    if isinstance(graph, AdmittedGraph):
+        return graph.without_admission()
+    return graph
+
+
+def _portable(value: Any) -> Any:
+    try:
+        pickle.dumps(value)
+        return value
+    except Exception:
+        return RuntimeError(repr(value))
+
+
+def _worker_main(
+    index: int,
+    graph_specs: dict[str, str],
+    requests: multiprocessing.Queue,
+    results: Connection,
+    concurrency: int,
+    checkpoint_path: str,
+):
+    # Every worker reads and writes the same durable checkpoints, so any of them
+    # can pick up a thread another one started. The settings were already read
+    # from the environment when this module was imported.
+    checkpoint.CHECKPOINTER = "sqlite"
+    checkpoint.CHECKPOINT_SQLITE_PATH = checkpoint_path
+    graphs = {name: load_graph(spec) for name, spec in graph_specs.items()}
+
+    executor = ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix=f"worker-{index}"
+    )
+    # Turns of one conversation never run concurrently. A thread's lock is
+    # dropped once no turn holds or waits for it, so idle threads cost nothing.
+    thread_locks: dict[str, list] = {}
+    locks_lock = threading.Lock()
+    send_lock = threading.Lock()
+
+    def reply(*result):
+        with send_lock:
+            results.send(result)
+
+    def run(request_id: int, graph: str, input: Any, config: RunnableConfig):
+        thread_id = config.get("configurable", {}).get("thread_id")
+        with locks_lock:
+            entry = thread_locks.setdefault(thread_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                output = graphs[graph].invoke(input, config)
+            reply(request_id, True, _portable(output), local_load())
+        except Exception as e:
+            reply(request_id, False, _portable(e), local_load())
+        finally:
+            with locks_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del thread_locks[thread_id]
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        executor.submit(run, *request)
+    executor.shutdown(wait=True)
+
+
+@dataclass
+class _Worker:
+    process: multiprocessing.Process
+    requests: multiprocessing.Queue
+    results: Connection
+    in_flight: set = field(default_factory=set)
+    completed: int = 0
+    load: Load = field(default_factory=lambda: Load(0, 0.0))
+    load_at: float = 0.0
+
+
+class WorkerPool:
+    """Serve the agent graphs from several processes sharing a SQLite checkpointer.
+
+    `graphs` maps graph names to "module:attribute" specs (the `graphs` section of
+    `langgraph.json` works as is). Requests are routed by `thread_id`: a thread
+    stays on the worker that first served it, new threads go to the least loaded
+    worker, and threads of a worker that dies migrate to the others, resuming from
+    the shared checkpoints. Requests that were running on the dead worker fail
+    with `WorkerCrashedError`, since they may already have been partly applied.
+
+    With `admission` set, runs first pass an `AdmissionController` fed by the
+    load the workers report with each result, and are rejected with
+    `AdmissionRejected` when the pool is overloaded.
+
+        with WorkerPool(graphs, processes=4) as pool:
+            pool.invoke("strategyAgent", {"messages": [...]}, config)
+    """
+
+    def __init__(
+        self,
+        graphs: dict[str, str],
+        processes: int = WORKER_PROCESSES,
+        concurrency: int = WORKER_CONCURRENCY,
+        checkpoint_path: str = checkpoint.CHECKPOINT_SQLITE_PATH,
+        admission: bool = False,
+    ):
+        # Threads move between workers, so their offloaded tool outputs have to
+        # be readable by every worker
+        if blobs.TOOL_BLOB_OFFLOAD and not blobs.TOOL_BLOB_DIR:
+            raise ValueError(
+                "TOOL_BLOB_OFFLOAD with worker processes requires a shared "
+                "TOOL_BLOB_DIR"
+            )
+        self.graph_specs = graphs
+        self.processes = processes
+        self.concurrency = concurrency
+        self.checkpoint_path = checkpoint_path
+        # Processes are spawned: forking a parent with live threads is unsafe
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: list[_Worker] = []
+        # Thread id -> index and pid of the worker that serves it
+        self._assignments: dict[str, tuple[int, int]] = {}
+        self._pending: dict[int, tuple[Future, int]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._collector: Optional[threading.Thread] = None
+        self._closed = False
+        self.migrations = 0
+        self.restarts = 0
+        self.admission = AdmissionController(load=self.load) if admission else None
+
+    def _spawn(self, index: int) -> _Worker:
+        requests = self._context.Queue()
+        # One pipe per worker: a worker dying mid-write cannot block the others
+        # the way it could hold the lock of a shared results queue
+        results, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(
+                index,
+                self.graph_specs,
+                requests,
+                writer,
+                self.concurrency,
+                self.checkpoint_path,
+            ),
+            name=f"agent-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        # Only the worker holds the writing end, so the pipe ends when it exits
+        writer.close()
+        return _Worker(process, requests, results)
+
+    def start(self) -> "WorkerPool":
+        self._workers = [self._spawn(index) for index in range(self.processes)]
+        self._collector = threading.Thread(
+            target=self._collect, name="worker-pool-results", daemon=True
+        )
+        self._collector.start()
+        return self
+
+    def _route(self, thread_id: Optional[str]) -> int:
+        alive = [
+            index
+            for index, worker in enumerate(self._workers)
+            if worker.process.is_alive()
+        ]
+        if not alive:
+            raise WorkerCrashedError("No worker processes are running")
+        index, pid = self._assignments.get(thread_id, (None, None))
+        if index in alive and self._workers[index].process.pid == pid:
+            return index
+        # A thread whose worker died (even if it was restarted since) moves to
+        # the least loaded worker; this is the only place migrations are counted
+        if index is not None:
+            self.migrations += 1
+        index = min(alive, key=lambda i: len(self._workers[i].in_flight))
+        if thread_id is not None:
+            self._assignments[thread_id] = (index, self._workers[index].process.pid)
+        return index
+
+    def submit(
+        self, graph: str, input: Any, config: Optional[RunnableConfig] = None
+    ) -> Future:
+        if graph not in self.graph_specs:
+            raise ValueError(f"Unknown graph {graph!r}")
+        config = config or {}
+        thread_id = config.get("configurable", {}).get("thread_id")
+        future = Future()
+        if self.admission is not None:
+            _, priority = call_context(config)
+            self.admission.acquire(priority)
+            started = time.monotonic()
+        try:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("WorkerPool is closed")
+                index = self._route(thread_id)
+                request_id = next(self._ids)
+                self._pending[request_id] = (future, index)
+                self._workers[index].in_flight.add(request_id)
+                self._workers[index].requests.put((request_id, graph, input, config))
+        except BaseException:
+            # The run never reached a worker, so its admission slot is freed here
+            if self.admission is not None:
+                self.admission.release(time.monotonic() - started)
+            raise
+        if self.admission is not None:
+            future.add_done_callback(
+                lambda _: self.admission.release(time.monotonic() - started)
+            )
+        return future
+
+    def invoke(
+        self, graph: str, input: Any, config: Optional[RunnableConfig] = None
+    ) -> Any:
+        return self.submit(graph, input, config).result()
+
+    def _collect(self):
+        checked = time.monotonic()
+        while not self._closed or self._pending:
+            with self._lock:
+                readers = [w.results for w in self._workers if not w.results.closed]
+            for reader in wait(readers, timeout=HEALTH_CHECK_INTERVAL):
+                try:
+                    result = reader.recv()
+                except (EOFError, OSError):
+                    # The worker exited; _check_workers fails its requests
+                    reader.close()
+                    checked = 0.0
+                    continue
+                self._complete(*result)
+            # Checked on a timer: a steady stream of results from the healthy
+            # workers must not hide a crashed one
+            if time.monotonic() - checked >= HEALTH_CHECK_INTERVAL:
+                self._check_workers()
+                checked = time.monotonic()
+
+    def _complete(self, request_id: int, ok: bool, value: Any, load: Load):
+        with self._lock:
+            future, index = self._pending.pop(request_id, (None, None))
+            if future is None:
+                return
+            self._workers[index].in_flight.discard(request_id)
+            self._workers[index].completed += 1
+            self._workers[index].load = load
+            self._workers[index].load_at = time.monotonic()
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def _check_workers(self):
+        crashed = []
+        with self._lock:
+            for index, worker in enumerate(self._workers):
+                if worker.process.is_alive() or (self._closed and not worker.in_flight):
+                    continue
+                crashed += [self._pending.pop(r)[0] for r in worker.in_flight]
+                worker.in_flight.clear()
+                if self._closed:
+                    continue
+                # Its threads move to the least loaded workers on their next turn,
+                # since their assignments name the dead process
+                self._workers[index] = self._spawn(index)
+                self.restarts += 1
+        for future in crashed:
+            future.set_exception(
+                WorkerCrashedError("Worker exited while running the request")
+            )
+
+    def load(self) -> Load:
+        """Queued LLM calls across workers and the slowest worker's retrieval p95."""
+        cutoff = time.monotonic() - LOAD_MAX_AGE
+        loads = [worker.load for worker in self._workers if worker.load_at >= cutoff]
+        return Load(
+            llm_queue=sum(load.llm_queue for load in loads),
+            retrieval_ms=max((load.retrieval_ms for load in loads), default=0.0),
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": [
+                    {
+                        "pid": worker.process.pid,
+                        "alive": worker.process.is_alive(),
+                        "in_flight": len(worker.in_flight),
+                        "completed": worker.completed,
+                    }
+                    for worker in self._workers
+                ],
+                "threads": len(self._assignments),
+                "migrations": self.migrations,
+                "restarts": self.restarts,
+                "admission": self.admission.snapshot() if self.admission else None,
+            }
+
+    def close(self):
+        """Stop accepting requests and wait for the running ones to finish."""
+        with self._lock:
+            self._closed = True
+            for worker in self._workers:
+                worker.requests.put(None)
+        if self._collector is not None:
+            self._collector.join()
+        for worker in self._workers:
+            worker.process.join()
+
+    def __enter__(self) -> "WorkerPool":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,157 @@
+"""Benchmark checkpoint serializers on strategy-graph style threads.
+
+Each turn mirrors the strategy supervisor: user question, transfer tool call,
+handoff message, retrieval tool call, a long retrieval ToolMessage, the
+specialist's answer with CompleteOrEscalate, the resume message and the final
+answer, with OpenAI-style metadata on every AIMessage. The messages channel
+blob is what MemorySaver serializes on every step, so that is what is timed.
+
+    python benchmarks/checkpoint_serde.py --turns 5 20 50
+"""
+
+import argparse
+import time
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from agent_common.serde import CompactSerializer, lz4, zstandard
+
+SEGMENT = (
+    "Provider: St. Mary's Regional Medical Center | CCN 450123 | Type: Short Term "
+    "Acute Care | Address: 1200 Main St, Austin, TX 78701 | Beds: 412 | Medicare "
+    "discharges 2022: 18,404 | Avg Medicare payment per discharge: $14,212 | "
+    "Top DRGs: 871 Septicemia w MCC, 470 Major joint replacement, 291 Heart failure "
+    "& shock w MCC | Ownership: Voluntary non-profit - Church | Star rating: 4. "
+) * 3
+
+
+def ai_message(content: str, tool_calls: list) -> AIMessage:
+    tokens = 1200 + len(content) // 4
+    return AIMessage(
+        content=content,
+        tool_calls=tool_calls,
+        id=f"run-{uuid.uuid4()}-0",
+        response_metadata={
+            "token_usage": {
+                "completion_tokens": 180,
+                "prompt_tokens": tokens,
+                "total_tokens": tokens + 180,
+            },
+            "model_name": "gpt-4o-2024-08-06",
+            "system_fingerprint": "fp_5f20662549",
+            "finish_reason": "tool_calls" if tool_calls else "stop",
+            "logprobs": None,
+        },
+        usage_metadata={
+            "input_tokens": tokens,
+            "output_tokens": 180,
+            "total_tokens": tokens + 180,
+        },
+    )
+
+
+def make_thread(turns: int) -> list:
+    messages = []
+    for turn in range(turns):
+        transfer_id, lookup_id, done_id = (
+            f"call_{uuid.uuid4().hex[:24]}" for _ in range(3)
+        )
+        messages += [
+            HumanMessage(
+                content=f"Which hospitals in Texas had the most cardiac admissions? ({turn})",
+                id=str(uuid.uuid4()),
+            ),
+            ai_message(
+                "",
+                [
+                    {
+                        "name": "ToAnalyticsAssistant",
+                        "args": {
+                            "request": "Rank Texas hospitals by cardiac admissions."
+                        },
+                        "id": transfer_id,
+                    }
+                ],
+            ),
+            ToolMessage(
+                content="The assistant is now the Healthcare Analytics Assistant. " * 6,
+                tool_call_id=transfer_id,
+                id=str(uuid.uuid4()),
+            ),
+            ai_message(
+                "",
+                [
+                    {
+                        "name": "cms_lookup",
+                        "args": {"query": "Texas hospitals cardiac admissions"},
+                        "id": lookup_id,
+                    }
+                ],
+            ),
+            ToolMessage(
+                content="\n\n".join([SEGMENT] * 3),
+                name="cms_lookup",
+                tool_call_id=lookup_id,
+                id=str(uuid.uuid4()),
+            ),
+            ai_message(
+                "Here are the top hospitals by cardiac admissions:\n"
+                + "- Hospital\n" * 10,
+                [
+                    {
+                        "name": "CompleteOrEscalate",
+                        "args": {"cancel": True, "reason": "Task completed."},
+                        "id": done_id,
+                    }
+                ],
+            ),
+            ToolMessage(
+                content="Resuming dialog with the host assistant.",
+                tool_call_id=done_id,
+                id=str(uuid.uuid4()),
+            ),
+            ai_message("Final answer:\n" + "- Hospital details\n" * 10, []),
+        ]
+    return messages
+
+
+def measure(serde, value, repeat: int) -> tuple[float, float, int]:
+    typed = serde.dumps_typed(value)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        typed = serde.dumps_typed(value)
+    encode = (time.perf_counter() - started) / repeat
+    started = time.perf_counter()
+    for _ in range(repeat):
+        decoded = serde.loads_typed(typed)
+    decode = (time.perf_counter() - started) / repeat
+    assert decoded == value
+    return encode, decode, len(typed[1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, nargs="+", default=[5, 20, 50])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    serializers = {
+        "jsonplus": JsonPlusSerializer(),
+        "compact": CompactSerializer(),
+    }
+    if zstandard is not None:
+        serializers["compact+zstd"] = CompactSerializer(compression="zstd")
+    if lz4 is not None:
+        serializers["compact+lz4"] = CompactSerializer(compression="lz4")
+
+    for turns in args.turns:
+        thread = make_thread(turns)
+        print(f"{turns} turns, {len(thread)} messages")
+        for name, serde in serializers.items():
+            encode, decode, size = measure(serde, thread, args.repeat)
+            print(
+                f"  {name:<14} encode {encode * 1e3:8.2f}ms"
+                f"  decode {decode * 1e3:8.2f}ms  {size / 1024:9.1f} KiB"
+            )
@@ -0,0 +1,101 @@
+"""Benchmark delta checkpoints against full checkpoints over a whole session.
+
+Replays strategy-graph style turns (see checkpoint_serde.py) through a graph that
+appends one message per super-step, as the supervisor's hops do, and reports the
+bytes written to the checkpointer per session, the time spent in the graph and
+the time to resume the thread from a cold cache.
+
+    python benchmarks/delta_checkpoints.py --turns 5 20 50
+"""
+
+import argparse
+import time
+from typing import Annotated
+
+from langchain_core.messages import AnyMessage, HumanMessage
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import END, START, StateGraph
+from typing_extensions import TypedDict
+
+from agent_common.checkpoint import DeltaMemorySaver
+from agent_common.messages import IndexedMessages
+from agent_common.serde import CompactSerializer
+from checkpoint_serde import make_thread
+
+MESSAGES_PER_TURN = 8
+
+
+class State(TypedDict):
+    messages: Annotated[list[AnyMessage], IndexedMessages]
+
+
+def build_graph(script: list[AnyMessage], checkpointer):
+    def step(state: State):
+        return {"messages": [script[len(state["messages"])]]}
+
+    def route(state: State):
+        if isinstance(script[len(state["messages"]) % len(script)], HumanMessage):
+            return END
+        return "step"
+
+    builder = StateGraph(State)
+    builder.add_node("step", step)
+    builder.add_edge(START, "step")
+    builder.add_conditional_edges("step", route)
+    return builder.compile(checkpointer=checkpointer)
+
+
+def stored_bytes(saver: MemorySaver) -> int:
+    total = sum(len(data) for _, data in saver.blobs.values())
+    for namespaces in saver.storage.values():
+        for checkpoints in namespaces.values():
+            for checkpoint, metadata, _ in checkpoints.values():
+                total += len(checkpoint[1]) + len(metadata[1])
+    return total
+
+
+def run_session(turns: int, checkpointer) -> tuple[int, float, float, int]:
+    script = make_thread(turns)
+    graph = build_graph(script, checkpointer)
+    config = {"configurable": {"thread_id": "bench"}, "recursion_limit": 100}
+
+    started = time.perf_counter()
+    for turn in range(turns):
+        # The user turn is the input, the graph appends the rest of the turn
+        graph.invoke({"messages": [script[turn * MESSAGES_PER_TURN]]}, config)
+    elapsed = time.perf_counter() - started
+
+    if isinstance(checkpointer, DeltaMemorySaver):
+        checkpointer.cache.clear()
+    started = time.perf_counter()
+    state = graph.get_state(config)
+    resume = time.perf_counter() - started
+    assert state.values["messages"] == script
+
+    return stored_bytes(checkpointer), elapsed, resume, len(script)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, nargs="+", default=[5, 20, 50])
+    parser.add_argument("--snapshot-interval", type=int, default=20)
+    args = parser.parse_args()
+
+    checkpointers = {
+        "full": lambda: MemorySaver(),
+        "delta": lambda: DeltaMemorySaver(snapshot_interval=args.snapshot_interval),
+        "full compact": lambda: MemorySaver(serde=CompactSerializer()),
+        "delta compact": lambda: DeltaMemorySaver(
+            serde=CompactSerializer(), snapshot_interval=args.snapshot_interval
+        ),
+    }
+
+    for turns in args.turns:
+        print(f"{turns} turns")
+        for name, factory in checkpointers.items():
+            size, elapsed, resume, messages = run_session(turns, factory())
+            print(
+                f"  {name:<14} {size / 1024 / 1024:8.2f} MiB written"
+                f"  {elapsed / messages * 1e3:7.2f}ms/step"
+                f"  resume {resume * 1e3:7.2f}ms"
+            )
@@ -0,0 +1,83 @@
+"""Benchmark interactive latency under batch load, with and without the scheduler.
+
+Simulated LLM calls (--call-ms each) share a --rpm budget. Batch tenants keep
+--batch-threads callers busy back to back while an interactive caller sends a
+call every --interactive-every seconds. "fifo" puts everyone in one queue,
+"scheduled" uses priority classes and weighted fair queueing per tenant.
+
+    python benchmarks/llm_scheduler.py --seconds 10
+"""
+
+import argparse
+import threading
+import time
+from collections import Counter
+
+from agent_common.ratelimit import TokenBucketLimiter, _percentile
+from agent_common.scheduler import FairScheduler
+
+
+def run(args, scheduled: bool) -> tuple[list[float], Counter]:
+    limiter = TokenBucketLimiter(
+        rpm=args.rpm,
+        scheduler=FairScheduler({"acme": 3.0, "globex": 1.0}),
+    )
+    # Start from an empty bucket so the whole run is rate limited
+    limiter._update(lambda state, now: state.update(requests=0.0))
+    deadline = time.monotonic() + args.seconds
+    waits = []
+    completed = Counter()
+
+    def call(tenant: str, priority: str):
+        if not scheduled:
+            tenant, priority = "default", "interactive"
+        ticket = limiter.acquire(500, tenant, priority)
+        try:
+            time.sleep(args.call_ms / 1000)
+        finally:
+            limiter.release(ticket)
+        return ticket.waited
+
+    def batch(tenant: str):
+        while time.monotonic() < deadline:
+            call(tenant, "batch")
+            completed[tenant] += 1
+
+    def interactive():
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            waits.append(call("chat", "interactive"))
+            completed["chat"] += 1
+            time.sleep(max(0.0, args.interactive_every - (time.monotonic() - started)))
+
+    threads = [
+        threading.Thread(target=batch, args=(tenant,))
+        for tenant in ("acme", "globex")
+        for _ in range(args.batch_threads)
+    ]
+    threads.append(threading.Thread(target=interactive))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(waits), completed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--rpm", type=int, default=600)
+    parser.add_argument("--call-ms", type=float, default=100)
+    parser.add_argument("--batch-threads", type=int, default=16)
+    parser.add_argument("--interactive-every", type=float, default=0.25)
+    args = parser.parse_args()
+
+    for name, scheduled in (("fifo", False), ("scheduled", True)):
+        waits, completed = run(args, scheduled)
+        batch_total = completed["acme"] + completed["globex"]
+        print(
+            f"{name:<10} interactive wait p50 {_percentile(waits, 0.5) * 1e3:7.1f}ms"
+            f"  p95 {_percentile(waits, 0.95) * 1e3:7.1f}ms"
+            f"  calls {completed['chat']:4}  batch calls {batch_total:5}"
+            f"  acme:globex {completed['acme'] / max(completed['globex'], 1):4.2f}"
+        )
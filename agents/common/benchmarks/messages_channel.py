@@ -0,0 +1,96 @@
+"""Benchmark `IndexedMessages` against the `add_messages` reducer.
+
+Grows a thread to --messages messages one super-step at a time (update, then
+read and checkpoint the channel as the Pregel loop does), then runs a small
+StateGraph that keeps appending to a thread of that length.
+
+    python benchmarks/messages_channel.py --messages 10000
+"""
+
+import argparse
+import time
+from typing import Annotated
+
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, ToolMessage
+from langgraph.channels.binop import BinaryOperatorAggregate
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.message import add_messages
+from typing_extensions import TypedDict
+
+from agent_common.messages import IndexedMessages
+
+
+def make_message(i: int) -> AnyMessage:
+    if i % 3 == 0:
+        return HumanMessage(content=f"question {i}")
+    if i % 3 == 1:
+        return AIMessage(
+            content="",
+            tool_calls=[
+                {"name": "cms_lookup", "args": {"query": f"q{i}"}, "id": f"c{i}"}
+            ],
+        )
+    return ToolMessage(content="segment " * 50, tool_call_id=f"c{i - 1}")
+
+
+def grow(channel, n: int) -> list[float]:
+    """Per-step seconds for growing a thread to n messages."""
+    timings = []
+    for i in range(n):
+        started = time.perf_counter()
+        channel.update([[make_message(i)]])
+        channel.get()
+        channel.checkpoint()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def bench_channel(n: int):
+    results = {
+        "add_messages": grow(BinaryOperatorAggregate(list, add_messages), n),
+        "IndexedMessages": grow(IndexedMessages(list), n),
+    }
+    print(f"channel: grow a thread to {n} messages")
+    for name, timings in results.items():
+        tail = timings[-1000:]
+        print(
+            f"  {name:<16} total {sum(timings):8.3f}s"
+            f"  last 1k steps {sum(tail) / len(tail) * 1e6:9.1f}us/step"
+        )
+
+
+def bench_graph(n: int, steps: int):
+    print(f"graph: {steps} appending steps on a {n}-message thread")
+    history = [make_message(i) for i in range(n)]
+    for name, annotation in [
+        ("add_messages", Annotated[list[AnyMessage], add_messages]),
+        ("IndexedMessages", Annotated[list[AnyMessage], IndexedMessages]),
+    ]:
+        State = TypedDict("State", {"messages": annotation})
+
+        def step(state):
+            return {"messages": [AIMessage(content="step")]}
+
+        def route(state):
+            return END if len(state["messages"]) >= n + steps else "step"
+
+        builder = StateGraph(State)
+        builder.add_node("step", step)
+        builder.add_edge(START, "step")
+        builder.add_conditional_edges("step", route, ["step", END])
+        graph = builder.compile()
+
+        started = time.perf_counter()
+        out = graph.invoke({"messages": list(history)}, {"recursion_limit": steps + 10})
+        elapsed = time.perf_counter() - started
+        assert len(out["messages"]) == n + steps
+        print(f"  {name:<16} {elapsed:8.3f}s  {elapsed / steps * 1e3:7.2f}ms/step")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--steps", type=int, default=200)
+    args = parser.parse_args()
+    bench_channel(args.messages)
+    bench_graph(args.messages, args.steps)
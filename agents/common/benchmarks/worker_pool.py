@@ -0,0 +1,101 @@
+"""Benchmark WorkerPool throughput as worker processes are added.
+
+Each request is one turn of a small graph that checkpoints to the shared SQLite
+file and spends --cpu-ms of pure Python work plus --io-ms of simulated LLM
+latency, with one run at a time per worker, so throughput should grow with the
+number of processes up to the number of cores (or further for I/O-bound turns).
+
+    python benchmarks/worker_pool.py --processes 1 2 4 --requests 200
+"""
+
+import argparse
+import operator
+import os
+import tempfile
+import time
+from typing import Annotated
+
+from langgraph.graph import END, START, StateGraph
+from typing_extensions import TypedDict
+
+from agent_common import checkpoint
+from agent_common.workers import WorkerPool
+
+CPU_MS = float(os.environ.get("BENCH_CPU_MS", "20"))
+IO_MS = float(os.environ.get("BENCH_IO_MS", "0"))
+
+
+class State(TypedDict):
+    turns: Annotated[int, operator.add]
+
+
+def turn(state: State):
+    deadline = time.process_time() + CPU_MS / 1000
+    while time.process_time() < deadline:
+        sum(range(1000))
+    time.sleep(IO_MS / 1000)
+    return {"turns": 1}
+
+
+def build_graph():
+    builder = StateGraph(State)
+    builder.add_node("turn", turn)
+    builder.add_edge(START, "turn")
+    builder.add_edge("turn", END)
+    return builder.compile(checkpointer=checkpoint.create_checkpointer())
+
+
+# Only built inside workers, where the checkpointer is the shared SQLite file
+graph = build_graph() if checkpoint.CHECKPOINTER == "sqlite" else None
+
+
+def run(processes: int, requests: int, threads: int) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = WorkerPool(
+            {"bench": "worker_pool:graph"},
+            processes=processes,
+            concurrency=1,
+            checkpoint_path=os.path.join(tmp, "checkpoints.sqlite"),
+        )
+        with pool:
+            # Warm up every worker before timing
+            for future in [
+                pool.submit("bench", {"turns": 0}, {"configurable": {"thread_id": i}})
+                for i in range(processes * 2)
+            ]:
+                future.result()
+            started = time.perf_counter()
+            futures = [
+                pool.submit(
+                    "bench",
+                    {"turns": 0},
+                    {"configurable": {"thread_id": f"thread-{i % threads}"}},
+                )
+                for i in range(requests)
+            ]
+            outputs = [future.result() for future in futures]
+            elapsed = time.perf_counter() - started
+        # Turns of a thread were applied one at a time, in order
+        last_turn = {}
+        for i, output in enumerate(outputs):
+            last_turn[i % threads] = output["turns"]
+        assert sum(last_turn.values()) == requests
+    return requests / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=32)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {CPU_MS}ms CPU + {IO_MS}ms I/O per turn")
+    baseline = None
+    for processes in args.processes:
+        throughput = run(processes, args.requests, args.threads)
+        baseline = baseline or throughput
+        print(
+            f"  {processes} workers  {throughput:8.1f} turns/s"
+            f"  {throughput / baseline:5.2f}x"
+        )
@@ -0,0 +1,293 @@
+"""Bulk lead qualification.
+
+Qualifies a CSV or JSONL list of leads with the lead-qualification graph, many
+at a time through `abatch_as_completed`, and yields each result as soon as it
+is ready. Leads of the same organization share a single organization lookup.
+
+Every lead runs on its own thread, `bulk:<run_id>:<lead key>`, and results are
+appended to a JSONL file. Re-running with the same run id and output skips the
+leads already written and resumes any lead that was interrupted mid-run from
+its checkpoint (with CHECKPOINTER=sqlite this survives a restart).
+
+Leads with an NPI are looked up in the qualification cache first, so known
+accounts are answered without running the agent again. Outdated outcomes are
+recomputed by background jobs (`python -m agent_common.jobs`), and the graph
+stores every new outcome in the cache.
+
+    python -m lead_qualification_agent.bulk leads.csv --out qualified.jsonl
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableConfig
+
+from agent_common.jobs import JobQueue
+from agent_common.retrieval import normalize_query
+from lead_qualification_agent.cache import (
+    criteria_version,
+    data_version,
+    qualification_cache,
+    verdict_of,
+)
+from lead_qualification_agent.graph import graph
+from lead_qualification_agent.tools import cms_lookup
+
+# Leads qualified at once in a bulk run
+BULK_QUALIFICATION_CONCURRENCY = int(
+    os.environ.get("BULK_QUALIFICATION_CONCURRENCY", "8")
+)
+
+# Graph the job workers run to refresh outdated outcomes, named as in langgraph.json
+REFRESH_GRAPH = "leadQualificationAgent"
+
+KEY_FIELDS = ("id", "lead_id", "npi")
+ORGANIZATION_FIELDS = ("organization", "company", "hospital", "facility")
+
+BULK_INSTRUCTIONS = (
+    "Qualify the following lead for our sales team. Finish your answer with a "
+    "line reading `Verdict: qualified`, `Verdict: not qualified` or "
+    "`Verdict: needs review`."
+)
+
+
+def read_leads(path: str) -> Iterator[dict]:
+    """Leads from a CSV file with a header row, or a JSON Lines file."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def lead_key(lead: dict, index: int) -> str:
+    for field in KEY_FIELDS:
+        if lead.get(field):
+            return str(lead[field])
+    return str(index)
+
+
+def lead_keys(leads: list[dict]) -> list[str]:
+    """Keys of `leads`, made unique by appending the row index to repeated ones.
+
+    A key names the lead's thread and marks it done in the output file, so
+    duplicate rows must not share one.
+    """
+    keys, seen = [], set()
+    for index, lead in enumerate(leads):
+        key = lead_key(lead, index)
+        if key in seen:
+            key = f"{key}#{index}"
+        seen.add(key)
+        keys.append(key)
+    return keys
+
+
+def lead_organization(lead: dict) -> Optional[str]:
+    for field in ORGANIZATION_FIELDS:
+        if lead.get(field):
+            return str(lead[field])
+    return None
+
+
+def _completed_keys(out: str) -> set[str]:
+    if not os.path.exists(out):
+        return set()
+    with open(out, encoding="utf-8") as f:
+        return {json.loads(line)["key"] for line in f if line.strip()}
+
+
+async def _organization_context(
+    organizations: set[str], config: RunnableConfig, concurrency: int
+) -> dict[str, str]:
+    """One lookup per organization, shared by all of its leads."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def lookup(organization: str) -> tuple[str, str]:
+        async with semaphore:
+            try:
+                return organization, await cms_lookup.ainvoke(
+                    {"query": organization}, config
+                )
+            except Exception:
+                # The agent can still look the organization up itself
+                return organization, ""
+
+    return dict(await asyncio.gather(*map(lookup, organizations)))
+
+
+def _lead_input(lead: dict, context: str) -> dict:
+    # cache.record_outcome reads the lead back from this message
+    content = f"{BULK_INSTRUCTIONS}\n\nLead:\n{json.dumps(lead, indent=2)}"
+    if context:
+        content += f"\n\nWhat we know about the organization:\n{context}"
+    return {"messages": [HumanMessage(content)]}
+
+
+async def _qualify(
+    pending: list[tuple[str, dict]],
+    thread_prefix: str,
+    concurrency: int,
+    config: Optional[RunnableConfig],
+) -> AsyncIterator[tuple[str, dict, Any]]:
+    """Run the graph for each (key, lead), yielding outputs or exceptions."""
+    if not pending:
+        return
+    # Lead runs are batch traffic unless `config` says otherwise, so interactive
+    # users keep priority for LLM capacity
+    configurable = {"priority": "batch", **(config or {}).get("configurable", {})}
+    contexts = await _organization_context(
+        {
+            normalize_query(organization)
+            for _, lead in pending
+            if (organization := lead_organization(lead))
+        },
+        {**(config or {}), "configurable": configurable},
+        concurrency,
+    )
+
+    inputs, configs = [], []
+    for key, lead in pending:
+        lead_config = {
+            **(config or {}),
+            "configurable": {**configurable, "thread_id": f"{thread_prefix}:{key}"},
+            "max_concurrency": concurrency,
+        }
+        # A lead interrupted mid-run continues from its last checkpoint
+        if (await graph.aget_state(lead_config)).next:
+            inputs.append(None)
+        else:
+            organization = lead_organization(lead)
+            context = contexts.get(normalize_query(organization or ""), "")
+            inputs.append(_lead_input(lead, context))
+        configs.append(lead_config)
+
+    async for index, output in graph.abatch_as_completed(
+        inputs, configs, return_exceptions=True
+    ):
+        key, lead = pending[index]
+        yield key, lead, output
+
+
+def _result(key: str, lead: dict, output: Any) -> dict:
+    if isinstance(output, Exception):
+        return {"key": key, "lead": lead, "error": repr(output)}
+    answer = output["messages"][-1].content
+    return {"key": key, "lead": lead, "verdict": verdict_of(answer), "answer": answer}
+
+
+def queue_refreshes(
+    leads: list[dict], config: Optional[RunnableConfig] = None
+) -> list[str]:
+    """Queue batch jobs recomputing the cached outcomes of `leads`.
+
+    Leads whose refresh is already queued, by any process, are skipped. Returns
+    the ids of the new jobs.
+    """
+    claimed = set(
+        qualification_cache.claim_refreshes([str(lead["npi"]) for lead in leads])
+    )
+    if not claimed:
+        return []
+    jobs = JobQueue()
+    job_ids = []
+    for lead in leads:
+        if str(lead["npi"]) in claimed:
+            claimed.discard(str(lead["npi"]))
+            job_ids.append(jobs.submit(REFRESH_GRAPH, _lead_input(lead, ""), config))
+    return job_ids
+
+
+async def aqualify_leads(
+    leads: list[dict],
+    run_id: str,
+    out: str,
+    concurrency: int = BULK_QUALIFICATION_CONCURRENCY,
+    config: Optional[RunnableConfig] = None,
+) -> AsyncIterator[dict]:
+    """Qualify `leads`, appending to and yielding each result as it completes.
+
+    Leads with a cached outcome are answered from the qualification cache first
+    (marked `cached`); refresh jobs are queued for the outdated ones. Only the
+    others are run through the graph.
+    """
+    done = _completed_keys(out)
+    pending = [
+        (key, lead) for key, lead in zip(lead_keys(leads), leads) if key not in done
+    ]
+    if not pending:
+        return
+
+    criteria, data = criteria_version(), data_version()
+    cached = qualification_cache.get_many(
+        [str(lead["npi"]) for _, lead in pending if lead.get("npi")], criteria, data
+    )
+    misses, stale = [], []
+    with open(out, "a", encoding="utf-8") as f:
+        for key, lead in pending:
+            entry = cached.get(str(lead.get("npi")))
+            if entry is None:
+                misses.append((key, lead))
+                continue
+            if entry.stale:
+                stale.append(lead)
+            result = {
+                "key": key,
+                "lead": lead,
+                "verdict": entry.verdict,
+                "answer": entry.answer,
+                "cached": True,
+                "stale": entry.stale,
+            }
+            f.write(json.dumps(result) + "\n")
+            yield result
+        f.flush()
+        if stale:
+            queue_refreshes(stale, config)
+
+        async for key, lead, output in _qualify(
+            misses, f"bulk:{run_id}", concurrency, config
+        ):
+            result = _result(key, lead, output)
+            # Failures are not written, so they are retried on the next run
+            if "error" not in result:
+                f.write(json.dumps(result) + "\n")
+                f.flush()
+            yield result
+
+
+async def _main(args: argparse.Namespace):
+    run_id = args.run_id or os.path.splitext(os.path.basename(args.out))[0]
+    leads = list(read_leads(args.leads))
+    completed = errors = 0
+    async for result in aqualify_leads(leads, run_id, args.out, args.concurrency):
+        if "error" in result:
+            errors += 1
+        else:
+            completed += 1
+        print(
+            f"[{completed + errors}] {result['key']}: "
+            f"{result.get('verdict') or result.get('error')}",
+            flush=True,
+        )
+    print(f"{completed} qualified, {errors} failed, results in {args.out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("leads", help="CSV or JSONL file of leads")
+    parser.add_argument("--out", required=True, help="JSONL file to append results")
+    parser.add_argument(
+        "--run-id", help="Identifies the run for resuming; defaults to --out's name"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=BULK_QUALIFICATION_CONCURRENCY
+    )
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,314 @@
+"""Persistent cache of lead qualification outcomes.
+
+Outcomes are stored per NPI together with the version of the qualification
+criteria (prompt and scoring weights) and of the source data (the NPI and CMS
+knowledge bases) they were computed against. An entry is fresh while both
+versions still match and it is younger than QUALIFICATION_CACHE_TTL_DAYS;
+otherwise it is stale and is served while a background job recomputes it.
+
+Every run of the graph that ends in a verdict on a single provider, whether in
+a chat, a bulk run or a refresh job, stores its outcome through `record_outcome`.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import requests
+from langchain_core.tools import tool
+
+from agent_common.dify import dataset_fingerprint
+from agent_common.sync import synced_version
+from lead_qualification_agent.prompts import SYSTEM_PROMPT
+from lead_qualification_agent.scoring import DEFAULT_WEIGHTS, LEAD_SCORING_WEIGHTS
+from lead_qualification_agent.tools import CMS_KNOWLEDGE_BASE_ID, NPI_KNOWLEDGE_BASE_ID
+
+QUALIFICATION_CACHE_PATH = os.environ.get(
+    "QUALIFICATION_CACHE_PATH", "qualifications.sqlite"
+)
+QUALIFICATION_CACHE_TTL_DAYS = float(
+    os.environ.get("QUALIFICATION_CACHE_TTL_DAYS", "30")
+)
+# Bump to invalidate every cached outcome after changing how leads are judged
+QUALIFICATION_CRITERIA_VERSION = os.environ.get("QUALIFICATION_CRITERIA_VERSION", "")
+# Source data version; when unset it is derived from the knowledge bases, or from
+# their local snapshots when they are synced
+QUALIFICATION_DATA_VERSION = os.environ.get("QUALIFICATION_DATA_VERSION", "")
+# Seconds a derived source data version is reused before asking Dify again, and
+# before asking again after Dify could not be reached
+DATA_VERSION_TTL = 300
+DATA_VERSION_RETRY = 30
+# Seconds after which a queued refresh that has not landed is queued again
+REFRESH_REQUEUE_SECONDS = 3600
+
+VERDICTS = ("qualified", "not qualified", "needs review")
+VERDICT = re.compile(r"verdict:\W*(" + "|".join(VERDICTS) + ")", re.IGNORECASE)
+NPI = re.compile(r"\b\d{10}\b")
+
+
+def criteria_version() -> str:
+    criteria = json.dumps(
+        [
+            QUALIFICATION_CRITERIA_VERSION,
+            SYSTEM_PROMPT,
+            {**DEFAULT_WEIGHTS, **LEAD_SCORING_WEIGHTS},
+        ]
+    )
+    return hashlib.sha256(criteria.encode()).hexdigest()[:16]
+
+
+_data_version: tuple[float, Optional[str]] = (0.0, None)
+_data_version_lock = threading.Lock()
+
+
+def data_version() -> Optional[str]:
+    """Version of the source data, or None if it has never been determined.
+
+    While Dify cannot be reached the last known version is kept.
+    """
+    global _data_version
+    if QUALIFICATION_DATA_VERSION:
+        return QUALIFICATION_DATA_VERSION
+    with _data_version_lock:
+        checked_at, version = _data_version
+        if time.monotonic() - checked_at > DATA_VERSION_TTL:
+            try:
+                # The synced version also changes when segments are edited in place
+                fingerprints = [
+                    synced_version(dataset_id) or dataset_fingerprint(dataset_id)
+                    for dataset_id in (NPI_KNOWLEDGE_BASE_ID, CMS_KNOWLEDGE_BASE_ID)
+                ]
+            except requests.RequestException:
+                retry_at = time.monotonic() - DATA_VERSION_TTL + DATA_VERSION_RETRY
+                _data_version = (retry_at, version)
+                return version
+            version = hashlib.sha256("|".join(fingerprints).encode()).hexdigest()[:16]
+            _data_version = (time.monotonic(), version)
+        return version
+
+
+def verdict_of(answer: str) -> Optional[str]:
+    match = VERDICT.search(answer)
+    return match.group(1).lower() if match else None
+
+
+def is_npi(number: str) -> bool:
+    """Whether a 10-digit number has a valid NPI check digit (Luhn, prefix 80840)."""
+    total = 0
+    for position, digit in enumerate(reversed("80840" + number)):
+        digit = int(digit) * (2 if position % 2 else 1)
+        total += digit - 9 if digit > 9 else digit
+    return total % 10 == 0
+
+
+@dataclass
+class CachedQualification:
+    npi: str
+    lead: dict
+    verdict: Optional[str]
+    answer: str
+    updated_at: float
+    stale: bool
+
+
+class QualificationCache:
+    """Qualification outcomes by NPI in a SQLite file shared by all processes."""
+
+    def __init__(
+        self,
+        path: str = QUALIFICATION_CACHE_PATH,
+        ttl_days: float = QUALIFICATION_CACHE_TTL_DAYS,
+    ):
+        self.path = path
+        self.ttl = ttl_days * 86400
+        self._local = threading.local()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # Opened on first use, so importing the agent creates no file
+        if not hasattr(self._local, "conn"):
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS qualifications (npi TEXT PRIMARY KEY, "
+                "criteria_version TEXT, data_version TEXT, lead TEXT, verdict TEXT, "
+                "answer TEXT, updated_at REAL, invalidated INTEGER DEFAULT 0, "
+                "refresh_queued_at REAL)"
+            )
+            self._local.conn = conn
+        return self._local.conn
+
+    def get_many(
+        self, npis: list[str], criteria: str, data: Optional[str]
+    ) -> dict[str, CachedQualification]:
+        """Cached outcomes of the known `npis`, marked stale where due a refresh.
+
+        With no known `data` version, entries are only judged by criteria and age.
+        """
+        found = {}
+        now = time.time()
+        for start in range(0, len(npis), 500):
+            chunk = npis[start : start + 500]
+            rows = self._connect().execute(
+                "SELECT npi, criteria_version, data_version, lead, verdict, answer, "
+                "updated_at, invalidated FROM qualifications "
+                f"WHERE npi IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            for npi, c, d, lead, verdict, answer, updated_at, invalidated in rows:
+                stale = bool(
+                    invalidated
+                    or c != criteria
+                    or (data is not None and d != data)
+                    or now - updated_at > self.ttl
+                )
+                found[npi] = CachedQualification(
+                    npi, json.loads(lead), verdict, answer, updated_at, stale
+                )
+        self.hits += sum(not entry.stale for entry in found.values())
+        self.stale_hits += sum(entry.stale for entry in found.values())
+        self.misses += len(set(npis)) - len(found)
+        return found
+
+    def put(
+        self,
+        npi: str,
+        criteria: str,
+        data: Optional[str],
+        lead: dict,
+        verdict: Optional[str],
+        answer: str,
+    ):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO qualifications (npi, criteria_version, "
+            "data_version, lead, verdict, answer, updated_at, invalidated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+            (npi, criteria, data, json.dumps(lead), verdict, answer, time.time()),
+        )
+
+    def claim_refreshes(self, npis: list[str]) -> list[str]:
+        """Those of `npis` with no refresh queued lately, now marked as queued.
+
+        Storing the new outcome clears the mark.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            claimed = [
+                npi
+                for npi in dict.fromkeys(npis)
+                if conn.execute(
+                    "UPDATE qualifications SET refresh_queued_at = ? WHERE npi = ? "
+                    "AND (refresh_queued_at IS NULL OR refresh_queued_at < ?)",
+                    (now, npi, now - REFRESH_REQUEUE_SECONDS),
+                ).rowcount
+            ]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return claimed
+
+    def invalidate(self, npis: Optional[list[str]] = None) -> int:
+        """Mark outcomes (all of them by default) for recomputation."""
+        if npis is None:
+            cursor = self._connect().execute(
+                "UPDATE qualifications SET invalidated = 1"
+            )
+        else:
+            cursor = self._connect().executemany(
+                "UPDATE qualifications SET invalidated = 1 WHERE npi = ?",
+                [(npi,) for npi in npis],
+            )
+        return cursor.rowcount
+
+    def snapshot(self) -> dict:
+        entries = (
+            self._connect().execute("SELECT COUNT(*) FROM qualifications").fetchone()[0]
+        )
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
+
+
+qualification_cache = QualificationCache()
+
+
+def _lead_of(request: str) -> Optional[dict]:
+    """The lead of a bulk or refresh run, sent as JSON after "Lead:"."""
+    _, found, rest = request.partition("Lead:\n")
+    if not found:
+        return None
+    try:
+        lead, _ = json.JSONDecoder().raw_decode(rest)
+    except ValueError:
+        return None
+    return lead if isinstance(lead, dict) else None
+
+
+def record_outcome(state: dict) -> None:
+    """Graph node caching the verdict of a turn that qualified a single provider.
+
+    The provider is the lead of a bulk or refresh run, or else the one valid NPI
+    number found in the user's request and the answer.
+    """
+    messages = state["messages"]
+    answer = messages[-1].content
+    if not isinstance(answer, str) or (verdict := verdict_of(answer)) is None:
+        return None
+    request = next((m.content for m in reversed(messages) if m.type == "human"), "")
+    if not isinstance(request, str):
+        return None
+    lead = _lead_of(request) or {}
+    if not lead.get("npi"):
+        npis = {npi for npi in NPI.findall(f"{request}\n{answer}") if is_npi(npi)}
+        if len(npis) != 1:
+            return None
+        lead = {**lead, "npi": npis.pop()}
+    qualification_cache.put(
+        str(lead["npi"]), criteria_version(), data_version(), lead, verdict, answer
+    )
+
+
+@tool
+def cached_qualifications(npis: list[str]) -> str:
+    """
+    Look up earlier qualification outcomes of providers by NPI number. Check this
+    before researching providers; only providers reported as unknown need to be
+    qualified from scratch. Outdated outcomes are returned marked as such and are
+    refreshed automatically.
+    """
+    entries = qualification_cache.get_many(
+        [str(npi) for npi in npis], criteria_version(), data_version()
+    )
+    stale = [entry.lead for entry in entries.values() if entry.stale]
+    if stale:
+        # Imported here: the bulk runner depends on the graph using this tool
+        from lead_qualification_agent.bulk import queue_refreshes
+
+        queue_refreshes(stale)
+    lines = []
+    for npi in npis:
+        entry = entries.get(str(npi))
+        if entry is None:
+            lines.append(f"NPI {npi}: unknown")
+        else:
+            age = (time.time() - entry.updated_at) / 86400
+            note = ", outdated and queued for a refresh" if entry.stale else ""
+            lines.append(
+                f"NPI {npi}: verdict {entry.verdict or 'n/a'} "
+                f"(qualified {age:.0f} days ago{note})\n{entry.answer}"
+            )
+    return "\n\n".join(lines)
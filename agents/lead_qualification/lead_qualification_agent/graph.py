@@ -4,24 +4,29 @@ from langchain_core.runnables import Runnable, RunnableConfig
 from langgraph.prebuilt import tools_condition
 from typing import Annotated
 from typing_extensions import TypedDict
-from langgraph.graph.message import AnyMessage, add_messages
+from langgraph.graph.message import AnyMessage
+from agent_common.messages import IndexedMessages
 from langchain_anthropic import ChatAnthropic
 from langchain_core.prompts import ChatPromptTemplate
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.graph import StateGraph, START
-from langchain_openai import ChatOpenAI
+from agent_common.admission import admitted
+from agent_common.checkpoint import create_checkpointer
+from langgraph.graph import StateGraph, START, END
+from agent_common.ratelimit import RateLimitedChatOpenAI
 from lead_qualification_agent.prompts import SYSTEM_PROMPT
 from lead_qualification_agent.utils import create_tool_node_with_fallback, create_prompt
 from lead_qualification_agent.tools import npi_lookup, cms_lookup
+from agent_common.nppes import npi_registry_search
+from lead_qualification_agent.scoring import score_lead_list
+from lead_qualification_agent.cache import cached_qualifications, record_outcome
 
 # llm = ChatAnthropic(model="claude-3-haiku-20240307")
-llm = ChatOpenAI(model="gpt-4o")
+llm = RateLimitedChatOpenAI(model="gpt-4o")
 # llm = ChatOpenAI(model="o1-preview", temperature=1, disable_streaming=True)
 # llm = ChatAnthropic(model="claude-3-sonnet-20240229", temperature=1)
 
 
 class State(TypedDict):
-    messages: Annotated[list[AnyMessage], add_messages]
+    messages: Annotated[list[AnyMessage], IndexedMessages]
 
 
 class Assistant:
@@ -51,7 +56,13 @@ class Assistant:
 lead_qualification_agent_prompt = create_prompt(SYSTEM_PROMPT)
 
 
-tools = [npi_lookup, cms_lookup]
+tools = [
+    npi_lookup,
+    npi_registry_search,
+    cms_lookup,
+    score_lead_list,
+    cached_qualifications,
+]
 lead_qualification_assistant_runnable = (
     lead_qualification_agent_prompt | llm.bind_tools(tools)
 )
@@ -63,17 +74,21 @@ builder = StateGraph(State)
 # Define nodes: these do the work
 builder.add_node("assistant", Assistant(lead_qualification_assistant_runnable))
 builder.add_node("tools", create_tool_node_with_fallback(tools))
+# Stores the verdict of a finished turn in the qualification cache
+builder.add_node("record_outcome", record_outcome)
 # Define edges: these determine how the control flow moves
 builder.add_edge(START, "assistant")
 builder.add_conditional_edges(
     "assistant",
     tools_condition,
+    {"tools": "tools", END: "record_outcome"},
 )
 builder.add_edge("tools", "assistant")
+builder.add_edge("record_outcome", END)
 
 # The checkpointer lets the graph persist its state
 # this is a complete memory for the entire graph.
-memory = MemorySaver()
-graph = builder.compile(checkpointer=memory)
+memory = create_checkpointer()
+graph = admitted(builder.compile(checkpointer=memory))
 
 graph.name = "Lead Qualification Agent"
@@ -0,0 +1,176 @@
+"""Deterministic lead scoring.
+
+Scores whole lead tables at once from structured attributes instead of having
+the LLM weigh each lead in prose. Every lead gets a component score in [0, 1]
+per attribute and a weighted total from 0 to 100:
+
+- specialty: 1 when the specialty or taxonomy matches a target specialty
+- geography: 1 when the lead is in a target state
+- size: percentile of organization size (beds, providers, employees) in the table
+- volume: percentile of CMS volume (services, beneficiaries, payments) in the table
+
+Components without criteria or data are left out and the remaining weights are
+rescaled, so the same table and criteria always give the same scores.
+"""
+
+import json
+import os
+import re
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from langchain_core.tools import tool
+
+# Relative weights of the score components, e.g. "specialty=4,volume=3"
+LEAD_SCORING_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, _, weight in (
+        item.partition("=")
+        for item in os.environ.get("LEAD_SCORING_WEIGHTS", "").split(",")
+        if item.strip()
+    )
+}
+
+# Directory lead files passed to score_lead_list must be in
+LEAD_UPLOAD_DIR = os.environ.get("LEAD_UPLOAD_DIR", "uploads")
+
+DEFAULT_WEIGHTS = {"specialty": 0.35, "volume": 0.3, "size": 0.2, "geography": 0.15}
+
+# Column names each attribute is read from, in order of preference
+SPECIALTY_COLUMNS = ("specialty", "taxonomy", "primary_specialty", "provider_type")
+STATE_COLUMNS = ("state", "provider_state", "practice_state")
+SIZE_COLUMNS = ("organization_size", "beds", "bed_count", "providers", "employees")
+VOLUME_COLUMNS = (
+    "cms_volume",
+    "total_services",
+    "total_beneficiaries",
+    "total_medicare_payment",
+    "claims",
+)
+
+
+def _normalize_columns(leads: pd.DataFrame) -> pd.DataFrame:
+    return leads.rename(
+        columns=lambda column: re.sub(r"\W+", "_", str(column).strip().lower())
+    )
+
+
+def _first_column(leads: pd.DataFrame, names: tuple[str, ...]) -> Optional[pd.Series]:
+    for name in names:
+        if name in leads.columns:
+            return leads[name]
+    return None
+
+
+def _match_distinct(values: pd.Series, match) -> np.ndarray:
+    # Categorical attributes repeat a few values, so match each distinct one once
+    codes, distinct = pd.factorize(values.fillna("").astype(str))
+    return match(pd.Series(distinct)).to_numpy(dtype=float)[codes]
+
+
+def _percentile(values: pd.Series) -> Optional[np.ndarray]:
+    values = pd.to_numeric(values, errors="coerce")
+    if values.notna().sum() == 0:
+        return None
+    # Ties share their average rank; missing values score 0
+    return values.rank(pct=True).fillna(0.0).to_numpy()
+
+
+def score_leads(
+    leads: pd.DataFrame,
+    specialties: list[str] = (),
+    states: list[str] = (),
+    weights: Optional[dict[str, float]] = None,
+) -> pd.DataFrame:
+    """`leads` with `<component>_score` columns and a `score`, best first."""
+    leads = _normalize_columns(leads).reset_index(drop=True)
+    weights = {**DEFAULT_WEIGHTS, **LEAD_SCORING_WEIGHTS, **(weights or {})}
+    unknown = set(weights) - set(DEFAULT_WEIGHTS)
+    if unknown:
+        raise ValueError(f"Unknown score components {sorted(unknown)}")
+
+    components: dict[str, np.ndarray] = {}
+    specialty = _first_column(leads, SPECIALTY_COLUMNS)
+    targets = [re.escape(s.strip()) for s in specialties if s.strip()]
+    # Blank specialties would match every lead, so they do not count as criteria
+    if targets and specialty is not None:
+        pattern = "|".join(targets)
+        components["specialty"] = _match_distinct(
+            specialty,
+            lambda values: values.str.contains(pattern, case=False, regex=True),
+        )
+    state = _first_column(leads, STATE_COLUMNS)
+    targets = {s.strip().upper() for s in states if s.strip()}
+    # Likewise blank states would only match leads without a state
+    if targets and state is not None:
+        components["geography"] = _match_distinct(
+            state, lambda values: values.str.strip().str.upper().isin(targets)
+        )
+    for name, columns in (("size", SIZE_COLUMNS), ("volume", VOLUME_COLUMNS)):
+        column = _first_column(leads, columns)
+        if column is not None and (percentile := _percentile(column)) is not None:
+            components[name] = percentile
+
+    total_weight = sum(weights[name] for name in components)
+    scores = np.zeros(len(leads))
+    for name, values in components.items():
+        leads[f"{name}_score"] = values.round(3)
+        scores += weights[name] * values
+    leads["score"] = (100 * scores / total_weight).round(1) if total_weight else 0.0
+    # Stable, so equal scores keep the table's order
+    return leads.sort_values("score", ascending=False, kind="stable")
+
+
+def read_lead_table(path: str) -> pd.DataFrame:
+    if path.endswith((".jsonl", ".ndjson")):
+        return pd.read_json(path, lines=True)
+    if path.endswith(".json"):
+        return pd.read_json(path)
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+def _upload_path(name: str) -> Optional[str]:
+    """`name` resolved inside LEAD_UPLOAD_DIR, or None if it points elsewhere."""
+    root = os.path.realpath(LEAD_UPLOAD_DIR)
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        return None
+    return path
+
+
+@tool
+def score_lead_list(
+    leads_file: str = "",
+    leads_json: str = "",
+    specialties: Optional[list[str]] = None,
+    states: Optional[list[str]] = None,
+    top_n: int = 10,
+) -> str:
+    """
+    Score and rank a whole list of leads at once. Call this once per lead list
+    instead of assessing leads one by one, then explain the top results.
+    Pass either leads_file (name of an uploaded CSV, JSON, JSONL or Parquet
+    file) or leads_json (a JSON array of lead objects). specialties and states
+    (two-letter codes) are the targets leads are scored against.
+    Returns the top_n leads with their total and per-component scores (0-1).
+    """
+    if leads_file:
+        path = _upload_path(leads_file)
+        if path is None:
+            return f"Error: leads_file must be a file uploaded to {LEAD_UPLOAD_DIR}."
+        leads = read_lead_table(path)
+    elif leads_json:
+        leads = pd.DataFrame(json.loads(leads_json))
+    else:
+        return "Error: pass leads_file or leads_json."
+    scored = score_leads(leads, specialties or [], states or [])
+    top = scored.head(top_n)
+    summary = (
+        f"Scored {len(scored)} leads; mean score {scored['score'].mean():.1f}, "
+        f"{int((scored['score'] >= 70).sum())} scored 70 or more. "
+        f"Top {len(top)}:"
+    )
+    return f"{summary}\n\n{top.to_csv(index=False)}"
@@ -0,0 +1,327 @@
+"""Bulk prospecting exports.
+
+Requests such as "all cardiologists in Texas" ask for every matching provider,
+not the top few a lookup returns. This graph has the LLM extract the search
+criteria once, then pages through the knowledge bases, filters segments against
+the criteria and writes matching leads to CSV or Parquet in batches, streaming
+progress as it goes. The LLM is never called per record.
+
+    for progress in export_graph.stream(
+        {"messages": [("user", "All cardiologists in Texas")]},
+        {"configurable": {"thread_id": "1", "export_format": "parquet"}},
+        stream_mode="custom",
+    ):
+        print(progress)
+"""
+
+import csv
+import os
+import re
+import uuid
+from typing import Annotated, Iterable, Iterator, Optional
+
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import END, START, StateGraph
+from langgraph.types import StreamWriter
+from pydantic import BaseModel, Field
+from typing_extensions import TypedDict
+
+from agent_common.admission import admitted
+from agent_common.checkpoint import create_checkpointer
+from agent_common.dify import iter_dataset_segments
+from agent_common.messages import IndexedMessages
+from agent_common.ratelimit import RateLimitedChatOpenAI
+from prospecting_agent.tools import CMS_KNOWLEDGE_BASE_ID, NPI_KNOWLEDGE_BASE_ID
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Directory exports are written to, leads per written batch, and how often
+# progress is reported (in scanned segments)
+PROSPECT_EXPORT_DIR = os.environ.get("PROSPECT_EXPORT_DIR", "exports")
+PROSPECT_EXPORT_BATCH_SIZE = int(os.environ.get("PROSPECT_EXPORT_BATCH_SIZE", "500"))
+PROSPECT_EXPORT_PROGRESS_EVERY = int(
+    os.environ.get("PROSPECT_EXPORT_PROGRESS_EVERY", "1000")
+)
+
+EXPORT_FORMATS = ("csv", "parquet")
+SOURCES = {"npi": NPI_KNOWLEDGE_BASE_ID, "cms": CMS_KNOWLEDGE_BASE_ID}
+
+LEAD_COLUMNS = (
+    "source",
+    "npi",
+    "name",
+    "specialty",
+    "organization",
+    "city",
+    "state",
+    "content",
+)
+# Record field names as they appear in the knowledge-base segments
+FIELD_ALIASES = {
+    "npi": "npi",
+    "provider name": "name",
+    "name": "name",
+    "provider first name": "first_name",
+    "provider last name (legal name)": "last_name",
+    "provider last name": "last_name",
+    "specialty": "specialty",
+    "taxonomy": "specialty",
+    "healthcare provider taxonomy": "specialty",
+    "primary specialty": "specialty",
+    "organization": "organization",
+    "provider organization name (legal business name)": "organization",
+    "facility name": "organization",
+    "hospital name": "organization",
+    "city": "city",
+    "provider business practice location address city name": "city",
+    "state": "state",
+    "provider business practice location address state name": "state",
+}
+
+llm = RateLimitedChatOpenAI(model="gpt-4o")
+
+
+class ProspectCriteria(BaseModel):
+    """Criteria a lead must meet to be exported."""
+
+    specialties: list[str] = Field(
+        default_factory=list,
+        description="Provider specialties or roles, e.g. 'Cardiology'. Any may match.",
+    )
+    states: list[str] = Field(
+        default_factory=list,
+        description="Two-letter US state codes, e.g. 'TX'. Any may match.",
+    )
+    cities: list[str] = Field(
+        default_factory=list, description="City names. Any may match."
+    )
+    keywords: list[str] = Field(
+        default_factory=list,
+        description="Other terms every lead must mention, e.g. an organization.",
+    )
+    sources: list[str] = Field(
+        default_factory=lambda: ["npi"],
+        description="Knowledge bases to scan: 'npi' for providers, 'cms' for facilities.",
+    )
+
+    def matcher(self):
+        """A predicate over segment text implementing these criteria."""
+
+        def any_of(terms: list[str], flags: int = re.IGNORECASE):
+            if not terms:
+                return None
+            alternatives = "|".join(re.escape(term.strip()) for term in terms)
+            return re.compile(rf"\b(?:{alternatives})\b", flags).search
+
+        # State codes are matched case-sensitively so "IN" does not match "in"
+        checks = [
+            check
+            for check in (
+                any_of(self.specialties),
+                any_of([state.upper() for state in self.states], 0),
+                any_of(self.cities),
+                *(any_of([keyword]) for keyword in self.keywords),
+            )
+            if check is not None
+        ]
+        return lambda text: all(check(text) for check in checks)
+
+
+class ExportState(TypedDict, total=False):
+    messages: Annotated[list[AnyMessage], IndexedMessages]
+    criteria: Optional[ProspectCriteria]
+    path: str
+    exported: int
+    scanned: int
+
+
+def parse_lead(source: str, content: str) -> dict:
+    """Map a segment's "field: value" pairs onto the lead columns.
+
+    Segments of tabular documents read like `NPI:"123";Provider Name:"..."`, one
+    record per line or separated by semicolons. The full text is kept as well.
+    """
+    fields = {}
+    for pair in re.split(r"[;\n]", content):
+        key, sep, value = pair.partition(":")
+        column = FIELD_ALIASES.get(key.strip().strip("\"'").lower())
+        if sep and column and column not in fields:
+            fields[column] = value.strip().strip("\"'")
+    if "name" not in fields and ("first_name" in fields or "last_name" in fields):
+        fields["name"] = " ".join(
+            filter(None, (fields.get("first_name"), fields.get("last_name")))
+        )
+    lead = {column: fields.get(column, "") for column in LEAD_COLUMNS}
+    lead["source"] = source
+    lead["content"] = content.strip()
+    return lead
+
+
+def _batched(rows: Iterable[dict], size: int) -> Iterator[list[dict]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class LeadWriter:
+    """Appends batches of leads to a CSV or Parquet file."""
+
+    def __init__(self, path: str, format: str = "csv"):
+        if format not in EXPORT_FORMATS:
+            raise ValueError(
+                f"Unknown export format {format!r}, expected one of {EXPORT_FORMATS}"
+            )
+        if format == "parquet" and pyarrow is None:
+            raise ImportError("Parquet exports require the `pyarrow` package")
+        self.path = path
+        self.format = format
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if format == "csv":
+            self._file = open(path, "w", newline="", encoding="utf-8")
+            self._csv = csv.DictWriter(self._file, fieldnames=LEAD_COLUMNS)
+            self._csv.writeheader()
+        else:
+            self._schema = pyarrow.schema(
+                [(column, pyarrow.string()) for column in LEAD_COLUMNS]
+            )
+            self._parquet = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write(self, leads: list[dict]):
+        if self.format == "csv":
+            self._csv.writerows(leads)
+            self._file.flush()
+        else:
+            # Each batch becomes one row group
+            self._parquet.write_table(
+                pyarrow.Table.from_pylist(leads, schema=self._schema)
+            )
+
+    def close(self):
+        if self.format == "csv":
+            self._file.close()
+        else:
+            self._parquet.close()
+
+    def __enter__(self) -> "LeadWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_leads(criteria: ProspectCriteria, progress=None) -> Iterator[dict]:
+    """Leads from the criteria's knowledge bases that match them, lazily.
+
+    `progress` is called with the number of segments scanned so far every
+    PROSPECT_EXPORT_PROGRESS_EVERY segments.
+    """
+    matches = criteria.matcher()
+    scanned = 0
+    for source in criteria.sources:
+        if source not in SOURCES:
+            raise ValueError(
+                f"Unknown source {source!r}, expected one of {sorted(SOURCES)}"
+            )
+        for _, segment in iter_dataset_segments(SOURCES[source]):
+            scanned += 1
+            if progress and scanned % PROSPECT_EXPORT_PROGRESS_EVERY == 0:
+                progress(scanned)
+            content = segment.get("content") or ""
+            if content and matches(content):
+                yield parse_lead(source, content)
+    if progress:
+        progress(scanned)
+
+
+def extract_criteria(state: ExportState):
+    if state.get("criteria") is not None:
+        return {}
+    request = next(
+        message
+        for message in reversed(state["messages"])
+        if isinstance(message, HumanMessage)
+    )
+    criteria = llm.with_structured_output(ProspectCriteria).invoke(
+        [
+            (
+                "system",
+                "Extract the criteria of a bulk prospecting request. Use "
+                "two-letter codes for US states. Leave out anything the request "
+                "does not restrict.",
+            ),
+            request,
+        ]
+    )
+    return {"criteria": criteria}
+
+
+def _export_path(thread_id: Optional[str], format: str) -> str:
+    """A new file under PROSPECT_EXPORT_DIR for one export run.
+
+    The graph is served to API clients, so nothing they send picks the
+    directory: the thread id is reduced to a safe label and every run gets its
+    own id, so exports of the same thread never overwrite each other.
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Unknown export format {format!r}, expected one of {EXPORT_FORMATS}"
+        )
+    label = re.sub(r"[^A-Za-z0-9_-]+", "_", thread_id or "").strip("_")[:64]
+    name = "-".join(filter(None, ["prospects", label, uuid.uuid4().hex[:12]]))
+    root = os.path.realpath(PROSPECT_EXPORT_DIR)
+    path = os.path.realpath(os.path.join(root, f"{name}.{format}"))
+    if os.path.dirname(path) != root:
+        raise ValueError(f"Export path {path!r} is outside {root!r}")
+    return path
+
+
+def export_leads(state: ExportState, config: RunnableConfig, writer: StreamWriter):
+    configuration = config.get("configurable", {})
+    export_format = configuration.get("export_format", "csv")
+    path = _export_path(configuration.get("thread_id"), export_format)
+
+    counts = {"scanned": 0, "exported": 0}
+
+    def progress(scanned: int):
+        counts["scanned"] = scanned
+        writer({"export": {**counts, "path": path}})
+
+    with LeadWriter(path, export_format) as leads_file:
+        for batch in _batched(
+            iter_leads(state["criteria"], progress), PROSPECT_EXPORT_BATCH_SIZE
+        ):
+            leads_file.write(batch)
+            counts["exported"] += len(batch)
+            writer({"export": {**counts, "path": path}})
+
+    summary = (
+        f"Exported {counts['exported']} leads matching "
+        f"{state['criteria'].model_dump(exclude_defaults=True)} "
+        f"({counts['scanned']} records scanned) to {path}."
+    )
+    return {
+        "messages": AIMessage(summary),
+        "path": path,
+        **counts,
+    }
+
+
+builder = StateGraph(ExportState)
+builder.add_node("extract_criteria", extract_criteria)
+builder.add_node("export_leads", export_leads)
+builder.add_edge(START, "extract_criteria")
+builder.add_edge("extract_criteria", "export_leads")
+builder.add_edge("export_leads", END)
+
+export_graph = admitted(builder.compile(checkpointer=create_checkpointer()))
+export_graph.name = "Prospecting Export"
@@ -2,21 +2,24 @@ from langchain_core.runnables import Runnable, RunnableConfig
 from langgraph.prebuilt import tools_condition
 from typing import Annotated
 from typing_extensions import TypedDict
-from langgraph.graph.message import AnyMessage, add_messages
-from langchain_openai import ChatOpenAI
+from langgraph.graph.message import AnyMessage
+from agent_common.messages import IndexedMessages
+from agent_common.ratelimit import RateLimitedChatOpenAI
 from prospecting_agent.prompts import SYSTEM_PROMPT
 from prospecting_agent.utils import create_tool_node_with_fallback, create_prompt
 from prospecting_agent.tools import npi_lookup, cms_lookup
-from langgraph.checkpoint.memory import MemorySaver
+from agent_common.nppes import npi_registry_search
+from agent_common.admission import admitted
+from agent_common.checkpoint import create_checkpointer
 from langgraph.graph import StateGraph, START
 
 # llm = ChatAnthropic(model="claude-3-haiku-20240307")
-llm = ChatOpenAI(model="gpt-4o")
+llm = RateLimitedChatOpenAI(model="gpt-4o")
 # llm = ChatAnthropic(model="claude-3-sonnet-20240229", temperature=1)
 
 
 class State(TypedDict):
-    messages: Annotated[list[AnyMessage], add_messages]
+    messages: Annotated[list[AnyMessage], IndexedMessages]
 
 
 class Assistant:
@@ -46,7 +49,7 @@ class Assistant:
 prospecting_agent_prompt = create_prompt(SYSTEM_PROMPT)
 
 
-tools = [npi_lookup, cms_lookup]
+tools = [npi_lookup, npi_registry_search, cms_lookup]
 prospecting_assistant_runnable = prospecting_agent_prompt | llm.bind_tools(tools)
 
 
@@ -66,7 +69,7 @@ builder.add_edge("tools", "assistant")
 
 # The checkpointer lets the graph persist its state
 # this is a complete memory for the entire graph.
-memory = MemorySaver()
-graph = builder.compile(checkpointer=memory)
+memory = create_checkpointer()
+graph = admitted(builder.compile(checkpointer=memory))
 
 graph.name = "Prospecting Agent"
@@ -0,0 +1,59 @@
+import csv
+import os
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from prospecting_agent import export  # noqa: E402
+from prospecting_agent.export import ProspectCriteria, export_leads  # noqa: E402
+
+SEGMENTS = [
+    'NPI:"1234567890";Provider Name:"Ada Heart";Specialty:"Cardiology";State:"TX"',
+    'NPI:"1234567891";Provider Name:"Bo Skin";Specialty:"Dermatology";State:"TX"',
+    'NPI:"1234567892";Provider Name:"Cy Beat";Specialty:"Cardiology";State:"CA"',
+]
+
+
+@pytest.fixture
+def segments(monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        export,
+        "iter_dataset_segments",
+        lambda dataset_id: ((None, {"content": content}) for content in SEGMENTS),
+    )
+    monkeypatch.setattr(export, "PROSPECT_EXPORT_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.parametrize("export_format", ["csv", "parquet"])
+def test_export_leads_writes_matching_leads(segments, export_format):
+    if export_format == "parquet":
+        pytest.importorskip("pyarrow")
+    progress = []
+    result = export_leads(
+        {"criteria": ProspectCriteria(specialties=["Cardiology"], states=["TX"])},
+        {"configurable": {"thread_id": "t1", "export_format": export_format}},
+        progress.append,
+    )
+
+    assert result["exported"] == 1
+    assert result["scanned"] == len(SEGMENTS)
+    assert os.path.dirname(result["path"]) == os.path.realpath(segments)
+    assert result["path"].endswith(f".{export_format}")
+    if export_format == "csv":
+        with open(result["path"], newline="") as f:
+            rows = list(csv.DictReader(f))
+    else:
+        rows = export.pyarrow.parquet.read_table(result["path"]).to_pylist()
+    assert [row["npi"] for row in rows] == ["1234567890"]
+    assert progress[-1]["export"]["exported"] == 1
+
+
+def test_export_leads_rejects_unknown_format(segments):
+    with pytest.raises(ValueError, match="Unknown export format 'xlsx'"):
+        export_leads(
+            {"criteria": ProspectCriteria()},
+            {"configurable": {"thread_id": "t1", "export_format": "xlsx"}},
+            lambda chunk: None,
+        )
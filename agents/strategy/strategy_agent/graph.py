@@ -3,11 +3,12 @@ from typing import Callable
 
 from pydantic import BaseModel, Field
 
-from langchain_openai import ChatOpenAI
-from langchain_core.runnables import Runnable, RunnableConfig
-from langchain_core.messages import ToolMessage
+from agent_common.ratelimit import RateLimitedChatOpenAI
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
 
-from langgraph.checkpoint.memory import MemorySaver
+from agent_common.admission import admitted
+from agent_common.checkpoint import create_checkpointer
 from langgraph.graph import StateGraph, START, END
 from langgraph.prebuilt import tools_condition
 
@@ -20,15 +21,24 @@ from strategy_agent.prompts import (
 )
 from strategy_agent.tools import cms_lookup, npi_lookup
 from strategy_agent.utils import (
+    SCOPED_HANDOFFS,
     create_tool_node_with_fallback,
+    create_entry_message,
     create_prompt,
     pop_dialog_state,
+    scope_handoff_context,
+)
+from strategy_agent.speculation import Speculator, speculation_enabled
+from strategy_agent.subgraphs import (
+    MOUNT_SUBGRAPHS,
+    create_subgraph_node,
+    load_specialist_graphs,
 )
 from strategy_agent.state import State
 
 # LLM Setup
 # llm = ChatAnthropic(model="claude-3-sonnet-20240229")
-llm = ChatOpenAI(model="gpt-4o")
+llm = RateLimitedChatOpenAI(model="gpt-4o")
 
 
 class Assistant:
@@ -36,6 +46,13 @@ class Assistant:
         self.runnable = runnable
 
     def __call__(self, state: State, config: RunnableConfig):
+        speculation = state.get("speculation")
+        if speculation is not None:
+            # A committed speculative run already produced this step's output
+            dialog_state = state.get("dialog_state") or [None]
+            if speculation["dialog_state"] == dialog_state[-1]:
+                return {"messages": speculation["message"], "speculation": None}
+
         while True:
             result = self.runnable.invoke(state)
 
@@ -48,15 +65,41 @@ class Assistant:
                 state = {**state, "messages": messages}
             else:
                 break
+        if speculation is not None:
+            return {"messages": result, "speculation": None}
         return {"messages": result}
 
 
+class SpeculativeAssistant(Assistant):
+    """Primary assistant that races the most likely specialist against its own routing."""
+
+    def __init__(self, runnable: Runnable, speculator: Speculator):
+        super().__init__(runnable)
+        self.speculator = speculator
+
+    def __call__(self, state: State, config: RunnableConfig):
+        if not speculation_enabled(config):
+            return super().__call__(state, config)
+
+        pending = self.speculator.start(state, config)
+        output = super().__call__(state, config)
+        if pending is not None:
+            committed = self.speculator.resolve(pending, output["messages"])
+            if committed is not None:
+                output["speculation"] = committed
+        return output
+
+
 class CompleteOrEscalate(BaseModel):
     """A tool to mark the current task as completed and/or to escalate control of the dialog to the main assistant,
     who can re-route the dialog based on the user's needs."""
 
     cancel: bool = True
     reason: str
+    completed: bool = Field(
+        default=False,
+        description="True only if your last response fully answers the user's request.",
+    )
 
     class Config:
         json_schema_extra = {
@@ -67,6 +110,7 @@ class CompleteOrEscalate(BaseModel):
             "example 2": {
                 "cancel": True,
                 "reason": "I have fully completed the task.",
+                "completed": True,
             },
             "example 3": {
                 "cancel": False,
@@ -94,17 +138,27 @@ strategy_prompt = create_prompt(STRATEGY_PLANNER_PROMPT)
 
 
 # Runnable Definitions
-analytics_runnable = anlaytics_prompt | llm.bind_tools(
-    [cms_lookup, npi_lookup] + [CompleteOrEscalate]
+# Specialists only see their own handoff, not the whole shared history
+scoped = RunnableLambda(scope_handoff_context)
+analytics_runnable = (
+    scoped
+    | anlaytics_prompt
+    | llm.bind_tools([cms_lookup, npi_lookup] + [CompleteOrEscalate])
 )
-prospecting_runnable = prospecting_prompt | llm.bind_tools(
-    [cms_lookup, npi_lookup] + [CompleteOrEscalate]
+prospecting_runnable = (
+    scoped
+    | prospecting_prompt
+    | llm.bind_tools([cms_lookup, npi_lookup] + [CompleteOrEscalate])
 )
-lead_qualification_runnable = lead_qualification_prompt | llm.bind_tools(
-    [cms_lookup, npi_lookup] + [CompleteOrEscalate]
+lead_qualification_runnable = (
+    scoped
+    | lead_qualification_prompt
+    | llm.bind_tools([cms_lookup, npi_lookup] + [CompleteOrEscalate])
 )
-strategy_runnable = strategy_prompt | llm.bind_tools(
-    [cms_lookup, npi_lookup] + [CompleteOrEscalate]
+strategy_runnable = (
+    scoped
+    | strategy_prompt
+    | llm.bind_tools([cms_lookup, npi_lookup] + [CompleteOrEscalate])
 )
 
 
@@ -157,169 +211,137 @@ def create_entry_node(assistant_name: str, new_dialog_state: str) -> Callable:
     def entry_node(state: State) -> dict:
         tool_call_id = state["messages"][-1].tool_calls[0]["id"]
         return {
-            "messages": [
-                ToolMessage(
-                    content=f"The assistant is now the {assistant_name}. Reflect on the above conversation between the host assistant and the user."
-                    f" The user's intent is unsatisfied. Use the provided tools to assist the user. Remember, you are {assistant_name},"
-                    " and the booking, update, other other action is not complete until after you have successfully invoked the appropriate tool."
-                    " If the user changes their mind or needs help for other tasks, call the CompleteOrEscalate function to let the primary host assistant take control."
-                    " Do not mention who you are - just act as the proxy for the assistant.",
-                    tool_call_id=tool_call_id,
-                )
-            ],
+            "messages": [create_entry_message(assistant_name, tool_call_id)],
             "dialog_state": new_dialog_state,
         }
 
     return entry_node
 
 
-# Build StateGraph
-builder = StateGraph(State)
-
-
-builder.add_edge(START, "primary_assistant")
-
-builder.add_node(
-    "enter_analytics_assistant",
-    create_entry_node("Healthcare Analytics Assistant", "analytics_assistant"),
-)
-builder.add_node("analytics_assistant", Assistant(analytics_runnable))
-builder.add_edge("enter_analytics_assistant", "analytics_assistant")
-builder.add_node(
-    "analytics_tools",
-    create_tool_node_with_fallback(tools),
-)
-
-
-# Routing Logic
-def route_analytics_assistant(state: State):
-    route = tools_condition(state)
-    if route == END:
-        return END
-    tool_calls = state["messages"][-1].tool_calls
-    did_cancel = any(tc["name"] == CompleteOrEscalate.__name__ for tc in tool_calls)
-    if did_cancel:
-        return "leave_skill"
-    return "analytics_tools"
-
-
-# Edges for Analytics Assistant
-builder.add_edge("analytics_tools", "analytics_assistant")
-builder.add_conditional_edges(
-    "analytics_assistant",
-    route_analytics_assistant,
-    ["analytics_tools", "leave_skill", END],
-)
-
-
-builder.add_node("leave_skill", pop_dialog_state)
-builder.add_edge("leave_skill", "primary_assistant")
-
-
-# Entry Node for Prospecting Assistant
-builder.add_node(
-    "enter_prospecting_assistant",
-    create_entry_node("Prospecting Assistant", "prospecting_assistant"),
-)
-builder.add_node("prospecting_assistant", Assistant(prospecting_runnable))
-builder.add_edge("enter_prospecting_assistant", "prospecting_assistant")
-builder.add_node(
-    "prospecting_tools",
-    create_tool_node_with_fallback(tools),
-)
-
-
-# Routing Logic
-def route_prospecting_assistant(state: State):
-    route = tools_condition(state)
-    if route == END:
-        return END
-    tool_calls = state["messages"][-1].tool_calls
-    did_cancel = any(tc["name"] == CompleteOrEscalate.__name__ for tc in tool_calls)
-    if did_cancel:
-        return "leave_skill"
-    return "prospecting_tools"
-
-
-# Edges for Prospecting Assistant
-builder.add_edge("prospecting_tools", "prospecting_assistant")
-builder.add_conditional_edges(
-    "prospecting_assistant",
-    route_prospecting_assistant,
-    ["prospecting_tools", "leave_skill", END],
-)
+# Routing Logic shared by the inline specialists
+def create_specialist_route(tools_node: str) -> Callable:
+    def route_specialist(state: State):
+        route = tools_condition(state)
+        if route == END:
+            # An answer to the user ends the turn, after its handoff is collapsed
+            return "leave_skill" if SCOPED_HANDOFFS else END
+        tool_calls = state["messages"][-1].tool_calls
+        did_cancel = any(tc["name"] == CompleteOrEscalate.__name__ for tc in tool_calls)
+        if did_cancel:
+            return "leave_skill"
+        return tools_node
 
-
-# Entry Node for Lead Qualification Assistant
-builder.add_node(
-    "enter_lead_qualification",
-    create_entry_node("Lead Qualification Assistant", "lead_qualification_assistant"),
-)
-builder.add_node("lead_qualification_assistant", Assistant(lead_qualification_runnable))
-builder.add_edge("enter_lead_qualification", "lead_qualification_assistant")
-builder.add_node(
-    "lead_qualification_tools",
-    create_tool_node_with_fallback(tools),
-)
+    return route_specialist
 
 
-# Routing Logic
-def route_lead_qualification(state: State):
-    route = tools_condition(state)
-    if route == END:
+# A specialist that answered the user directly ends the turn
+def route_leave_skill(state: State):
+    if isinstance(state["messages"][-1], AIMessage):
         return END
-    tool_calls = state["messages"][-1].tool_calls
-    did_cancel = any(tc["name"] == CompleteOrEscalate.__name__ for tc in tool_calls)
-    if did_cancel:
-        return "leave_skill"
-    return "lead_qualification_tools"
+    return "primary_assistant"
 
 
-# Edges for Lead Qualification Assistant
-builder.add_edge("lead_qualification_tools", "lead_qualification_assistant")
-builder.add_conditional_edges(
-    "lead_qualification_assistant",
-    route_lead_qualification,
-    ["lead_qualification_tools", "leave_skill", END],
-)
-
+# Specialists: (transfer tool, display name, dialog state, runnable, entry node, tools node)
+specialists = [
+    (
+        ToAnalyticsAssistant,
+        "Healthcare Analytics Assistant",
+        "analytics_assistant",
+        analytics_runnable,
+        "enter_analytics_assistant",
+        "analytics_tools",
+    ),
+    (
+        ToProspectingAssistant,
+        "Prospecting Assistant",
+        "prospecting_assistant",
+        prospecting_runnable,
+        "enter_prospecting_assistant",
+        "prospecting_tools",
+    ),
+    (
+        ToLeadQualification,
+        "Lead Qualification Assistant",
+        "lead_qualification_assistant",
+        lead_qualification_runnable,
+        "enter_lead_qualification",
+        "lead_qualification_tools",
+    ),
+    (
+        ToStrategyAssistant,
+        "Strategy Planner Assistant",
+        "strategy_planner_assistant",
+        strategy_runnable,
+        "enter_strategy_planner",
+        "strategy_tools",
+    ),
+]
 
-# Entry Node for Strategy Planner Assistant
-builder.add_node(
-    "enter_strategy_planner",
-    create_entry_node("Strategy Planner Assistant", "strategy_planner_assistant"),
-)
-builder.add_node("strategy_planner_assistant", Assistant(strategy_runnable))
-builder.add_edge("enter_strategy_planner", "strategy_planner_assistant")
-builder.add_node(
-    "strategy_tools",
-    create_tool_node_with_fallback([cms_lookup, npi_lookup]),
-)
 
+# Build StateGraph
+builder = StateGraph(State)
 
-# Routing Logic
-def route_strategy_planner(state: State):
-    route = tools_condition(state)
-    if route == END:
-        return END
-    tool_calls = state["messages"][-1].tool_calls
-    did_cancel = any(tc["name"] == CompleteOrEscalate.__name__ for tc in tool_calls)
-    if did_cancel:
-        return "leave_skill"
-    return "strategy_tools"
 
+builder.add_edge(START, "primary_assistant")
 
-# Edges for Strategy Planner Assistant
-builder.add_edge("strategy_tools", "strategy_planner_assistant")
-builder.add_conditional_edges(
-    "strategy_planner_assistant",
-    route_strategy_planner,
-    ["strategy_tools", "leave_skill", END],
-)
+entry_nodes = {}
+if MOUNT_SUBGRAPHS:
+    # Compiled standalone specialists, each with private state and checkpoint namespace
+    specialist_graphs = load_specialist_graphs()
+    for transfer, assistant_name, dialog_state, _, _, _ in specialists:
+        builder.add_node(
+            dialog_state,
+            create_subgraph_node(assistant_name, specialist_graphs[dialog_state]),
+        )
+        builder.add_conditional_edges(
+            dialog_state, route_leave_skill, ["primary_assistant", END]
+        )
+        entry_nodes[transfer.__name__] = dialog_state
+else:
+    for (
+        transfer,
+        assistant_name,
+        dialog_state,
+        runnable,
+        entry,
+        tools_node,
+    ) in specialists:
+        builder.add_node(entry, create_entry_node(assistant_name, dialog_state))
+        builder.add_node(dialog_state, Assistant(runnable))
+        builder.add_edge(entry, dialog_state)
+        builder.add_node(tools_node, create_tool_node_with_fallback(tools))
+        builder.add_edge(tools_node, dialog_state)
+        builder.add_conditional_edges(
+            dialog_state,
+            create_specialist_route(tools_node),
+            [tools_node, "leave_skill", END],
+        )
+        entry_nodes[transfer.__name__] = entry
+
+    builder.add_node("leave_skill", pop_dialog_state)
+    builder.add_conditional_edges(
+        "leave_skill", route_leave_skill, ["primary_assistant", END]
+    )
 
 
 # Primary Assistant Node
-builder.add_node("primary_assistant", Assistant(assistant_runnable))
+if MOUNT_SUBGRAPHS:
+    # Speculation only applies to the inline specialists
+    builder.add_node("primary_assistant", Assistant(assistant_runnable))
+else:
+    speculator = Speculator(
+        specialists={
+            dialog_state: (assistant_name, runnable)
+            for _, assistant_name, dialog_state, runnable, _, _ in specialists
+        },
+        routes={
+            transfer.__name__: dialog_state
+            for transfer, _, dialog_state, _, _, _ in specialists
+        },
+    )
+    builder.add_node(
+        "primary_assistant", SpeculativeAssistant(assistant_runnable, speculator)
+    )
 builder.add_node(
     "primary_assistant_tools", create_tool_node_with_fallback([cms_lookup, npi_lookup])
 )
@@ -336,14 +358,8 @@ def route_primary_assistant(state: State):
 
     tool_calls = state["messages"][-1].tool_calls
     if tool_calls:
-        if tool_calls[0]["name"] == ToAnalyticsAssistant.__name__:
-            return "enter_analytics_assistant"
-        elif tool_calls[0]["name"] == ToProspectingAssistant.__name__:
-            return "enter_prospecting_assistant"
-        elif tool_calls[0]["name"] == ToLeadQualification.__name__:
-            return "enter_lead_qualification"
-        elif tool_calls[0]["name"] == ToStrategyAssistant.__name__:
-            return "enter_strategy_planner"
+        if tool_calls[0]["name"] in entry_nodes:
+            return entry_nodes[tool_calls[0]["name"]]
         return "primary_assistant_tools"
     raise ValueError("Invalid route")
 
@@ -352,21 +368,16 @@ def route_primary_assistant(state: State):
 builder.add_conditional_edges(
     "primary_assistant",
     route_primary_assistant,
-    [
-        "enter_analytics_assistant",
-        "enter_prospecting_assistant",
-        "enter_lead_qualification",
-        "enter_strategy_planner",
-        "primary_assistant_tools",
-        END,
-    ],
+    list(entry_nodes.values()) + ["primary_assistant_tools", END],
 )
 builder.add_edge("primary_assistant_tools", "primary_assistant")
 
 
 # Compile Graph
-memory = MemorySaver()
-graph = builder.compile(
-    checkpointer=memory,
+memory = create_checkpointer()
+graph = admitted(
+    builder.compile(
+        checkpointer=memory,
+    )
 )
 graph.name = "Strategy Agent"
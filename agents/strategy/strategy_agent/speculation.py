@@ -0,0 +1,222 @@
+import contextvars
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import patch_config
+
+from strategy_agent.state import State
+from strategy_agent.utils import create_entry_message, score_specialists
+
+# Speculation is opt-in: set the env var or pass {"configurable": {"speculative": True}}
+SPECULATIVE_ROUTING = os.environ.get("STRATEGY_SPECULATIVE_ROUTING", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+
+def speculation_enabled(config: Optional[RunnableConfig]) -> bool:
+    configuration = (config or {}).get("configurable", {})
+    return bool(configuration.get("speculative", SPECULATIVE_ROUTING))
+
+
+def predict_specialist(state: State, routes: dict[str, str]) -> Optional[str]:
+    """Guess which specialist the primary assistant is about to route to.
+
+    Only fresh user turns are speculated on; when the primary assistant runs after
+    a specialist has handed control back it almost always answers directly.
+    Keyword hits on the latest user message win, otherwise the thread's last
+    routed specialist is reused.
+    """
+    messages = state["messages"]
+    if not messages or not isinstance(messages[-1], HumanMessage):
+        return None
+
+    scores = score_specialists(messages[-1])
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    if ranked[0][1] and ranked[0][1] > ranked[1][1]:
+        return ranked[0][0]
+
+    for message in reversed(messages):
+        if isinstance(message, AIMessage) and message.tool_calls:
+            routed = routes.get(message.tool_calls[0]["name"])
+            if routed:
+                return routed
+    return None
+
+
+class SpeculationStats:
+    """Counters for speculative specialist runs, shared by every thread in the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.attempts = 0
+            self.hits = 0
+            self.misses = 0
+            self.failures = 0
+            self.saved_seconds = 0.0
+            self.wasted_calls = 0
+            self.wasted_tokens = 0
+
+    def record_hit(self, saved_seconds: float):
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += saved_seconds
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def record_waste(self, tokens: int):
+        with self._lock:
+            self.wasted_calls += 1
+            self.wasted_tokens += tokens
+
+    def record_attempt(self):
+        with self._lock:
+            self.attempts += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "hits": self.hits,
+                "misses": self.misses,
+                "failures": self.failures,
+                "hit_rate": self.hits / self.attempts if self.attempts else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "wasted_calls": self.wasted_calls,
+                "wasted_tokens": self.wasted_tokens,
+            }
+
+
+speculation_stats = SpeculationStats()
+
+
+@dataclass
+class PendingSpeculation:
+    dialog_state: str
+    future: Future
+    started_at: float
+
+
+class Speculator:
+    """Runs the most likely specialist's first step while the primary assistant routes.
+
+    `specialists` maps a dialog state to the specialist's display name and runnable,
+    `routes` maps the primary assistant's transfer tool names to dialog states.
+    """
+
+    def __init__(
+        self,
+        specialists: dict[str, tuple[str, Runnable]],
+        routes: dict[str, str],
+        max_workers: int = 4,
+    ):
+        self.specialists = specialists
+        self.routes = routes
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="speculation"
+        )
+
+    def start(
+        self, state: State, config: RunnableConfig
+    ) -> Optional[PendingSpeculation]:
+        """Start the predicted specialist as a child run of the node's `config`."""
+        dialog_state = predict_specialist(state, self.routes)
+        if dialog_state not in self.specialists:
+            return None
+        assistant_name, runnable = self.specialists[dialog_state]
+        tool_name = next(
+            name for name, routed in self.routes.items() if routed == dialog_state
+        )
+
+        # Stand in for the transfer tool call the primary assistant has yet to make
+        tool_call_id = f"speculative-{uuid.uuid4()}"
+        transfer = AIMessage(
+            content="",
+            tool_calls=[
+                {
+                    "name": tool_name,
+                    "args": {"request": state["messages"][-1].content},
+                    "id": tool_call_id,
+                }
+            ],
+        )
+        speculative_state = {
+            **state,
+            "messages": state["messages"]
+            + [transfer, create_entry_message(assistant_name, tool_call_id)],
+            "dialog_state": state.get("dialog_state", []) + [dialog_state],
+        }
+
+        speculation_stats.record_attempt()
+        # The pool thread runs in a copy of this context, so the run's config,
+        # callbacks and tenant/priority reach the specialist's LLM call
+        child_config = patch_config(config, run_name=f"speculative {dialog_state}")
+        future = self.executor.submit(
+            contextvars.copy_context().run,
+            self._run,
+            runnable,
+            speculative_state,
+            child_config,
+        )
+        return PendingSpeculation(dialog_state, future, time.monotonic())
+
+    @staticmethod
+    def _run(runnable: Runnable, state: State, config: RunnableConfig):
+        result = runnable.invoke(state, config)
+        return result, time.monotonic()
+
+    def resolve(self, pending: PendingSpeculation, result: AIMessage) -> Optional[dict]:
+        """Commit the speculative result if the router agreed, otherwise discard it."""
+        routed = None
+        if result.tool_calls:
+            routed = self.routes.get(result.tool_calls[0]["name"])
+
+        if routed != pending.dialog_state:
+            speculation_stats.record_miss()
+            if not pending.future.cancel():
+                pending.future.add_done_callback(_record_waste)
+            return None
+
+        routed_at = time.monotonic()
+        try:
+            message, finished_at = pending.future.result()
+        except Exception:
+            speculation_stats.record_failure()
+            return None
+        if not message.tool_calls and (
+            not message.content
+            or isinstance(message.content, list)
+            and not message.content[0].get("text")
+        ):
+            # Let the specialist re-prompt itself the usual way
+            speculation_stats.record_failure()
+            return None
+
+        speculation_stats.record_hit(min(finished_at, routed_at) - pending.started_at)
+        return {"dialog_state": pending.dialog_state, "message": message}
+
+
+def _record_waste(future: Future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    message, _ = future.result()
+    usage = getattr(message, "usage_metadata", None) or {}
+    speculation_stats.record_waste(usage.get("total_tokens", 0))
@@ -1,5 +1,7 @@
+import operator
 from typing import Annotated, Literal
-from langgraph.graph.message import AnyMessage, add_messages
+from langgraph.graph.message import AnyMessage
+from agent_common.messages import IndexedMessages
 from typing_extensions import TypedDict
 from typing import Optional
 
@@ -15,7 +17,7 @@ def update_dialog_stack(left: list[str], right: Optional[str]) -> list[str]:
 
 # State and Assistant Configuration
 class State(TypedDict):
-    messages: Annotated[list[AnyMessage], add_messages]
+    messages: Annotated[list[AnyMessage], IndexedMessages]
     dialog_state: Annotated[
         list[
             Literal[
@@ -28,3 +30,7 @@ class State(TypedDict):
         ],
         update_dialog_stack,
     ]
+    # Speculative specialist result committed by the primary assistant, if any
+    speculation: Optional[dict]
+    # Primary assistant hops skipped by returning a specialist's answer directly
+    hops_saved: Annotated[int, operator.add]
@@ -0,0 +1,104 @@
+import importlib
+import os
+from typing import Callable
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph.state import CompiledStateGraph
+
+from strategy_agent.state import State
+from strategy_agent.utils import (
+    HANDOFF_USER_TURNS,
+    create_result_message,
+    direct_return_enabled,
+    is_single_specialist_turn,
+)
+
+# Mount the standalone specialist graphs instead of the inline specialists.
+# Requires the analytics, prospecting, lead qualification and strategy planner
+# packages to be installed alongside this one (langgraph.json installs all five).
+MOUNT_SUBGRAPHS = os.environ.get("STRATEGY_MOUNT_SUBGRAPHS", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# Closing line of a mounted specialist's answer that fully handles the request:
+# the standalone graphs have no CompleteOrEscalate tool to set `completed` with
+COMPLETED_MARKER = "[COMPLETED]"
+
+# dialog state -> module exposing the specialist's uncompiled `builder`
+SPECIALIST_MODULES = {
+    "analytics_assistant": "analytics_agent.graph",
+    "prospecting_assistant": "prospecting_agent.graph",
+    "lead_qualification_assistant": "lead_qualification_agent.graph",
+    "strategy_planner_assistant": "strategy_planner_agent.graph",
+}
+
+
+def load_specialist_graphs() -> dict[str, CompiledStateGraph]:
+    """Compile each standalone specialist once for use as a subgraph.
+
+    `checkpointer=True` makes the subgraph persist through the supervisor's
+    checkpointer under its own namespace (the node name), so each specialist keeps
+    a private message history across hops instead of writing into `State`.
+    """
+    graphs = {}
+    for dialog_state, module_name in SPECIALIST_MODULES.items():
+        module = importlib.import_module(module_name)
+        graphs[dialog_state] = module.builder.compile(checkpointer=True)
+        graphs[dialog_state].name = module.graph.name
+    return graphs
+
+
+def create_subgraph_node(assistant_name: str, subgraph: CompiledStateGraph) -> Callable:
+    """Run a mounted specialist on the handoff request and hand back its answer.
+
+    The specialist only receives the recent user turns and the transfer request;
+    the supervisor only receives one result message in return. With direct
+    return, the answer goes straight to the user only if the specialist marked
+    it complete.
+    """
+
+    def subgraph_node(state: State, config: RunnableConfig) -> dict:
+        messages = state["messages"]
+        tool_call = messages[-1].tool_calls[0]
+        recent_turns = [m for m in messages if isinstance(m, HumanMessage)]
+        recent_turns = recent_turns[-HANDOFF_USER_TURNS:] if HANDOFF_USER_TURNS else []
+        direct = direct_return_enabled(config)
+        content = (
+            f"Request from the host assistant: {tool_call['args'].get('request', '')}"
+        )
+        if direct:
+            content += (
+                "\n\nIf your answer fully completes this request, end it with a "
+                f"line containing only {COMPLETED_MARKER}."
+            )
+        request = HumanMessage(content=content)
+
+        # Recent turns keep their ids, so re-sending them does not duplicate them
+        # in the specialist's private history
+        result = subgraph.invoke({"messages": recent_turns + [request]}, config)
+        answer = result["messages"][-1].content
+        if isinstance(answer, list):
+            answer = "\n".join(
+                part.get("text", "") for part in answer if isinstance(part, dict)
+            )
+        answer = answer.rstrip()
+        completed = answer.endswith(COMPLETED_MARKER)
+        if completed:
+            answer = answer[: -len(COMPLETED_MARKER)].rstrip()
+
+        update = {
+            "messages": [create_result_message(assistant_name, answer, tool_call["id"])]
+        }
+        if (
+            direct
+            and completed
+            and is_single_specialist_turn(messages, len(messages) - 1)
+        ):
+            update["messages"].append(AIMessage(content=answer))
+            update["hops_saved"] = 1
+        return update
+
+    return subgraph_node
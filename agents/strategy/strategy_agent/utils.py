@@ -1,12 +1,97 @@
+import os
 from datetime import datetime
 from typing import Optional
 
-from langchain_core.messages import ToolMessage
+from langchain_core.messages import (
+    AIMessage,
+    HumanMessage,
+    RemoveMessage,
+    ToolMessage,
+)
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnableLambda
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langgraph.prebuilt import ToolNode
+
+from agent_common.blobs import offload_tool_messages, resolve_tool_messages
 from strategy_agent.state import State
 
+# Specialists only see their handoff plus this many recent user turns, and their
+# tool traffic is collapsed into one result message when they hand back control
+# or answer the user.
+SCOPED_HANDOFFS = os.environ.get("STRATEGY_SCOPED_HANDOFFS", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+HANDOFF_USER_TURNS = int(os.environ.get("STRATEGY_HANDOFF_USER_TURNS", "2"))
+
+# Specialists that fully answer a single-specialist request reply to the user
+# directly instead of handing back to the primary assistant for re-synthesis.
+DIRECT_RETURN = os.environ.get("STRATEGY_DIRECT_RETURN", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+RESUME_MESSAGE = "Resuming dialog with the host assistant. Please reflect on the past conversation and assist the user as needed."
+
+
+# Cheap keyword predictor over a user turn, shared by speculation and direct return
+SPECIALIST_KEYWORDS = {
+    "analytics_assistant": (
+        "analy",
+        "trend",
+        "insight",
+        "metric",
+        "statistic",
+        "volume",
+        "admission",
+        "payment",
+        "compare",
+        "average",
+    ),
+    "prospecting_assistant": (
+        "prospect",
+        "find",
+        "lead",
+        "list of",
+        "contact",
+        "physician",
+        "provider",
+        "clinic",
+        "hospitals in",
+    ),
+    "lead_qualification_assistant": (
+        "qualif",
+        "score",
+        "prioriti",
+        "evaluat",
+        "rank",
+        "good fit",
+        "relevan",
+    ),
+    "strategy_planner_assistant": (
+        "strateg",
+        "outreach",
+        "plan",
+        "campaign",
+        "marketing",
+        "pitch",
+        "messaging",
+    ),
+}
+
+
+def score_specialists(message: HumanMessage) -> dict[str, int]:
+    text = message.content
+    if isinstance(text, list):
+        text = " ".join(part.get("text", "") for part in text if isinstance(part, dict))
+    text = text.lower()
+    return {
+        name: sum(keyword in text for keyword in keywords)
+        for name, keywords in SPECIALIST_KEYWORDS.items()
+    }
+
 
 def handle_tool_error(state) -> dict:
     error = state.get("error")
@@ -25,11 +110,11 @@ def handle_tool_error(state) -> dict:
 def create_tool_node_with_fallback(tools: list) -> dict:
     return ToolNode(tools).with_fallbacks(
         [RunnableLambda(handle_tool_error)], exception_key="error"
-    )
+    ) | RunnableLambda(offload_tool_messages)
 
 
 def create_prompt(template: str):
-    return ChatPromptTemplate.from_messages(
+    return RunnableLambda(resolve_tool_messages) | ChatPromptTemplate.from_messages(
         [
             ("system", template),
             ("placeholder", "{messages}"),
@@ -37,22 +122,187 @@ def create_prompt(template: str):
     ).partial(time=datetime.now())
 
 
+def create_entry_message(assistant_name: str, tool_call_id: str) -> ToolMessage:
+    return ToolMessage(
+        content=f"The assistant is now the {assistant_name}. Reflect on the above conversation between the host assistant and the user."
+        f" The user's intent is unsatisfied. Use the provided tools to assist the user. Remember, you are {assistant_name},"
+        " and the booking, update, other other action is not complete until after you have successfully invoked the appropriate tool."
+        " If the user changes their mind or needs help for other tasks, call the CompleteOrEscalate function to let the primary host assistant take control."
+        " Do not mention who you are - just act as the proxy for the assistant.",
+        tool_call_id=tool_call_id,
+        additional_kwargs={"handoff": assistant_name},
+    )
+
+
+def _find_handoff(messages: list) -> Optional[int]:
+    """Index of the entry message of the specialist currently holding the dialog."""
+    for i in range(len(messages) - 1, -1, -1):
+        message = messages[i]
+        if isinstance(message, ToolMessage) and "handoff" in message.additional_kwargs:
+            return i
+    return None
+
+
+def scope_handoff_context(state: State) -> State:
+    """Trim the messages a specialist sees down to its own handoff.
+
+    The specialist keeps the transfer request, its entry message and everything it
+    has done since, preceded by the most recent user turns for context. Other
+    specialists' tool chatter never reaches its prompt.
+    """
+    if not SCOPED_HANDOFFS:
+        return state
+    messages = state["messages"]
+    entry = _find_handoff(messages)
+    if entry is None or entry == 0:
+        return state
+
+    start = entry - 1  # the primary assistant's transfer tool call
+    recent_turns = [m for m in messages[:start] if isinstance(m, HumanMessage)]
+    recent_turns = recent_turns[-HANDOFF_USER_TURNS:] if HANDOFF_USER_TURNS else []
+    return {**state, "messages": recent_turns + messages[start:]}
+
+
+def _text(message: AIMessage) -> str:
+    if isinstance(message.content, str):
+        return message.content.strip()
+    return "\n".join(
+        part.get("text", "").strip()
+        for part in message.content
+        if isinstance(part, dict) and part.get("type") == "text"
+    ).strip()
+
+
+def _handoff_answer(segment: list) -> str:
+    return "\n\n".join(
+        _text(m) for m in segment if isinstance(m, AIMessage) and _text(m)
+    )
+
+
+def create_result_message(
+    assistant_name: str, answer: str, tool_call_id: str, id: Optional[str] = None
+) -> ToolMessage:
+    return ToolMessage(
+        content=f"{assistant_name} result:\n{answer.strip() or 'The specialist returned no answer.'}\n\n{RESUME_MESSAGE}",
+        tool_call_id=tool_call_id,
+        id=id,
+        additional_kwargs={"handoff_result": assistant_name},
+    )
+
+
+def collapse_handoff(
+    messages: list, reason: Optional[str] = None, keep_reply: bool = False
+) -> list:
+    """Replace a finished specialist's internal traffic with one compact result.
+
+    The entry message is rewritten in place (same id) to carry the specialist's
+    answer, and its tool calls, tool results and the closing CompleteOrEscalate
+    call are removed. User turns inside the segment are kept. With `keep_reply`,
+    the last message is the specialist's reply to the user and stays as it is.
+    """
+    entry = _find_handoff(messages)
+    if entry is None:
+        return []
+    handoff = messages[entry]
+    segment = messages[entry + 1 : -1 if keep_reply else None]
+
+    content = _handoff_answer(segment)
+    if keep_reply:
+        content = "\n\n".join(
+            filter(None, [content, "The specialist answered the user directly:"])
+        )
+    if reason:
+        content += f"\n\nReason for handing back: {reason}"
+    result = create_result_message(
+        handoff.additional_kwargs["handoff"],
+        content,
+        handoff.tool_call_id,
+        id=handoff.id,
+    )
+    removed = [
+        RemoveMessage(id=m.id)
+        for m in segment
+        if isinstance(m, (AIMessage, ToolMessage)) and m.id
+    ]
+    return [result] + removed
+
+
+def direct_return_enabled(config: Optional[RunnableConfig]) -> bool:
+    configuration = (config or {}).get("configurable", {})
+    return bool(configuration.get("direct_return", DIRECT_RETURN))
+
+
+def is_single_specialist_turn(messages: list, transfer: int) -> bool:
+    """Whether the user's turn mapped to the one specialist transferred to at `transfer`.
+
+    The transfer must be a single tool call, with no earlier handoff in the turn
+    and no keywords in the user's message pointing at a second specialist.
+    """
+    if len(messages[transfer].tool_calls) != 1:
+        return False
+    for i in range(transfer - 1, -1, -1):
+        message = messages[i]
+        if isinstance(message, HumanMessage):
+            scores = score_specialists(message)
+            return sum(1 for score in scores.values() if score) <= 1
+        if isinstance(message, ToolMessage) and (
+            "handoff" in message.additional_kwargs
+            or "handoff_result" in message.additional_kwargs
+        ):
+            return False
+    return False
+
+
+def _can_return_directly(messages: list) -> bool:
+    """Whether the specialist that is handing back fully answered the user's turn."""
+    last = messages[-1]
+    if not last.tool_calls or not last.tool_calls[0]["args"].get("completed"):
+        return False
+    entry = _find_handoff(messages)
+    if entry is None or entry == 0:
+        return False
+    if not _handoff_answer(messages[entry + 1 :]):
+        return False
+    return is_single_specialist_turn(messages, entry - 1)
+
+
 # This node will be shared for exiting all specialized assistants
-def pop_dialog_state(state: State) -> dict:
+def pop_dialog_state(state: State, config: RunnableConfig) -> dict:
     """Pop the dialog stack and return to the main assistant.
 
     This lets the full graph explicitly track the dialog flow and delegate control
-    to specific sub-graphs.
+    to specific sub-graphs. With scoped handoffs the specialist's work is collapsed
+    into a single result message so the primary assistant re-reads only that,
+    whether it handed back or ended the turn by answering the user. With
+    direct return, a specialist that fully answered a single-specialist request
+    replies to the user itself and the primary assistant is skipped.
     """
     messages = []
-    if state["messages"][-1].tool_calls:
+    last = state["messages"][-1]
+    direct = direct_return_enabled(config) and _can_return_directly(state["messages"])
+    if SCOPED_HANDOFFS and _find_handoff(state["messages"]) is not None:
+        if last.tool_calls:
+            reason = last.tool_calls[0]["args"].get("reason")
+            messages = collapse_handoff(state["messages"], reason)
+        else:
+            messages = collapse_handoff(state["messages"], keep_reply=True)
+    elif last.tool_calls:
         # Note: Doesn't currently handle the edge case where the llm performs parallel tool calls
         messages.append(
             ToolMessage(
-                content="Resuming dialog with the host assistant. Please reflect on the past conversation and assist the user as needed.",
-                tool_call_id=state["messages"][-1].tool_calls[0]["id"],
+                content=RESUME_MESSAGE,
+                tool_call_id=last.tool_calls[0]["id"],
             )
         )
+
+    if direct:
+        entry = _find_handoff(state["messages"])
+        answer = _handoff_answer(state["messages"][entry + 1 :])
+        return {
+            "dialog_state": "pop",
+            "messages": messages + [AIMessage(content=answer)],
+            "hops_saved": 1,
+        }
     return {
         "dialog_state": "pop",
         "messages": messages,
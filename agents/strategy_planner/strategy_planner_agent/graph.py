@@ -1,24 +1,26 @@
 from langchain_core.runnables import Runnable, RunnableConfig
 from langgraph.prebuilt import tools_condition
 from typing_extensions import TypedDict
-from langgraph.graph.message import AnyMessage, add_messages
-from langchain_openai import ChatOpenAI
+from langgraph.graph.message import AnyMessage
+from agent_common.messages import IndexedMessages
+from agent_common.ratelimit import RateLimitedChatOpenAI
 from strategy_planner_agent.prompts import SYSTEM_PROMPT
 from strategy_planner_agent.tools import npi_lookup, cms_lookup
 from strategy_planner_agent.utils import create_tool_node_with_fallback, create_prompt
 from langchain_community.tools.tavily_search import TavilySearchResults
-from langgraph.checkpoint.memory import MemorySaver
+from agent_common.admission import admitted
+from agent_common.checkpoint import create_checkpointer
 from langgraph.graph import StateGraph, START
 from typing import Annotated
 
 
 # llm = ChatAnthropic(model="claude-3-haiku-20240307")
-llm = ChatOpenAI(model="gpt-4o")
+llm = RateLimitedChatOpenAI(model="gpt-4o")
 # llm = ChatAnthropic(model="claude-3-sonnet-20240229", temperature=1)
 
 
 class State(TypedDict):
-    messages: Annotated[list[AnyMessage], add_messages]
+    messages: Annotated[list[AnyMessage], IndexedMessages]
 
 
 class Assistant:
@@ -67,7 +69,7 @@ builder.add_edge("tools", "assistant")
 
 # The checkpointer lets the graph persist its state
 # this is a complete memory for the entire graph.
-memory = MemorySaver()
-graph = builder.compile(checkpointer=memory)
+memory = create_checkpointer()
+graph = admitted(builder.compile(checkpointer=memory))
 
 graph.name = "Strategy Planner Agent"